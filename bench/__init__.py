@@ -0,0 +1,38 @@
+"""Нагрузочные сценарии. Запуск из корня репозитория: python -m bench.<имя>
+
+Модули бота при импорте открывают свои базы, поэтому они направляются во временный каталог,
+а токен бота подменяется: сценарии не ходят в Telegram, Google и Bitrix24.
+"""
+import os
+import tempfile
+from typing import Dict, List
+
+_tmp = tempfile.mkdtemp(prefix="coffebot-bench-")
+for _name, _file in (("OUTBOX_DB", "outbox.sqlite3"), ("ORDERS_DB", "orders.sqlite3"),
+                     ("FSM_DB", "fsm.sqlite3"), ("PHOTO_CACHE_DB", "photos.sqlite3"),
+                     ("MENU_SNAPSHOT_FILE", "menu_snapshot.json")):
+    os.environ.setdefault(_name, os.path.join(_tmp, _file))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+
+
+def tmp_path(name: str) -> str:
+    return os.path.join(_tmp, name)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max в миллисекундах"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1] * 1000}
+
+
+def report(title: str, values: List[float], **extra):
+    stats = percentiles(values)
+    line = "  ".join(f"{key}={value:.1f}ms" for key, value in stats.items())
+    tail = "  ".join(f"{key}={value}" for key, value in extra.items())
+    print(f"{title:<28} n={len(values):<5} {line}  {tail}".rstrip())
@@ -0,0 +1,113 @@
+"""Поток апдейтов через Dispatcher: p99 задержки обработчика до и после асинхронного доступа к меню.
+
+before - обработчик, как раньше, синхронно читает лист (вызов gspread блокирует event loop);
+after  - обработчик берёт каталог через MenuSnapshot.get_catalog_async: загрузка идёт в пуле
+         потоков, одновременные загрузки объединяются, обновление по TTL уходит в фон.
+
+Задержка считается от запланированного момента прихода апдейта до конца обработки, поэтому
+в неё входит ожидание за чужими блокирующими вызовами.
+
+    python -m bench.dispatcher_flood --updates 200 --rate 200 --sheets-ms 150
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import Chat, Message, Update, User
+
+from bench import report
+from catalog import MenuCatalog
+from google_sheets import MenuSnapshot
+
+HEADER = ["ID", "Название", "Описание", "Цена", "Ккал", "Б", "Ж", "С", "Фото", "Категория"]
+
+
+class SlowSheet:
+    """Источник меню с задержкой сетевого вызова, как у gspread (блокирующий)"""
+
+    def __init__(self, latency: float, products: int = 60):
+        self.latency = latency
+        self.calls = 0
+        self.rows = [HEADER] + [
+            [str(i), f"Напиток {i}", "", str(100 + i), "", "", "", "", "", f"Категория {i % 6}"]
+            for i in range(1, products + 1)
+        ]
+
+    def revision(self):
+        time.sleep(self.latency / 3)
+        return "r1"
+
+    def load_rows(self):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.rows
+
+
+def make_update(n: int) -> Update:
+    user = User(id=1000 + n % 300, is_bot=False, first_name="Гость")
+    message = Message(message_id=n, date=datetime.now(), chat=Chat(id=user.id, type="private"),
+                      from_user=user, text="Категория 1")
+    return Update(update_id=n, message=message)
+
+
+def build_dispatcher(mode: str, sheet: SlowSheet, ttl: float) -> Dispatcher:
+    router = Router()
+    snapshot = MenuSnapshot(sheet, ttl)
+
+    if mode == "before":
+        @router.message(F.text)
+        async def show_category(message: Message):
+            catalog = MenuCatalog(sheet.load_rows())
+            return catalog.products_in(message.text)
+    else:
+        @router.message(F.text)
+        async def show_category(message: Message):
+            catalog = await snapshot.get_catalog_async()
+            return catalog.products_in(message.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def flood(mode: str, updates: int, rate: float, sheets_ms: float, ttl: float):
+    sheet = SlowSheet(sheets_ms / 1000)
+    dp = build_dispatcher(mode, sheet, ttl)
+    bot = Bot("123456:BENCH")
+    latencies = []
+
+    async def deliver(n: int, arrival: float):
+        await dp.feed_update(bot, make_update(n))
+        latencies.append(time.perf_counter() - arrival)
+
+    started = time.perf_counter()
+    tasks = []
+    for n in range(updates):
+        arrival = started + n / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(deliver(n, arrival)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    report(mode, latencies, sheet_loads=sheet.calls, wall=f"{elapsed:.1f}s")
+    await bot.session.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=200, help="апдейтов в секунду")
+    parser.add_argument("--sheets-ms", type=float, default=150, help="задержка одного вызова Sheets")
+    parser.add_argument("--ttl", type=float, default=0.5, help="TTL снимка меню в режиме after")
+    args = parser.parse_args()
+
+    for mode in ("before", "after"):
+        await flood(mode, args.updates, args.rate, args.sheets_ms, args.ttl)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
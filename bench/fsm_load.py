@@ -0,0 +1,117 @@
+"""Нагрузка на FSM-хранилище: задержка get/update состояния при одновременных пользователях.
+
+Каждый пользователь повторяет шаг добавления товара в корзину: get_state, get_data,
+update_data (корзина растёт на одну позицию), set_state. Все --processes процессов
+работают с одними и теми же пользователями в одном файле SQLite, как воркеры вебхука,
+между которыми расходятся апдейты одного пользователя. Каждый процесс ведёт своё поле
+данных, поэтому обновления разных процессов сталкиваются на одной строке, но не на одном поле.
+
+Режимы соответствуют настройкам create_storage в bot.py:
+cached - отложенная запись 50 мс и кэш чтения 1 с (один процесс);
+shared - запись и чтение сразу в базу (WEBHOOK_WORKERS > 1).
+В конце проверяется, что ни одна позиция ни одного процесса не потерялась.
+
+    python -m bench.fsm_load --users 200 --steps 20 --processes 2
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+
+from bench import percentiles, tmp_path
+
+MODES = {"cached": (0.05, 1.0), "shared": (0.0, 0.0)}
+
+
+async def run_users(path: str, mode: str, users: range, steps: int, field: str):
+    from aiogram.fsm.storage.base import StorageKey
+
+    from storage import SQLiteStorage
+
+    flush_interval, cache_ttl = MODES[mode]
+    storage = SQLiteStorage(path, flush_interval=flush_interval, cache_ttl=cache_ttl)
+    reads, writes = [], []
+
+    async def user(user_id: int):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        for step in range(steps):
+            started = time.perf_counter()
+            await storage.get_state(key)
+            data = await storage.get_data(key)
+            reads.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await storage.update_data(key, {field: data.get(field, []) + [f"{step}|1"]})
+            await storage.set_state(key, "OrderStates:choosing_product")
+            writes.append(time.perf_counter() - started)
+            # Пользователь думает между нажатиями - даём поработать остальным
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in users))
+    await storage.close()
+    return reads, writes, time.perf_counter() - started
+
+
+def worker(path: str, mode: str, users: range, steps: int, field: str, results):
+    results.put(asyncio.run(run_users(path, mode, users, steps, field)))
+
+
+def check_carts(path: str, users: int, steps: int, fields) -> int:
+    """Сколько корзин не досчитались позиций хотя бы одного процесса"""
+    import json
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+    carts = [json.loads(data) for (data,) in conn.execute("SELECT data FROM fsm")]
+    conn.close()
+    return users - sum(1 for cart in carts if all(len(cart.get(field, [])) == steps for field in fields))
+
+
+def measure(mode: str, users: int, steps: int, processes: int):
+    path = tmp_path(f"fsm-load-{mode}.sqlite3")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    fields = [f"products_{n}" for n in range(processes)]
+    workers = [
+        context.Process(target=worker, args=(path, mode, range(users), steps, field, results))
+        for field in fields
+    ]
+    for process in workers:
+        process.start()
+    reads, writes, elapsed = [], [], 0.0
+    for _ in workers:
+        process_reads, process_writes, process_elapsed = results.get()
+        reads += process_reads
+        writes += process_writes
+        elapsed = max(elapsed, process_elapsed)
+    for process in workers:
+        process.join()
+
+    lost = check_carts(path, users, steps, fields)
+    ops = len(reads) + len(writes)
+    print(f"{mode:<7} processes={processes} users={users} ops/s={ops / elapsed:.0f} lost_carts={lost}")
+    for name, values in (("get", reads), ("update", writes)):
+        stats = "  ".join(f"{key}={value:.2f}ms" for key, value in percentiles(values).items())
+        print(f"  {name:<7} {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=2)
+    args = parser.parse_args()
+
+    # Отложенная запись и кэш безопасны только в одном процессе
+    measure("cached", args.users, args.steps, 1)
+    measure("shared", args.users, args.steps, args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Время создания лида с товарами: один batch-запрос против прежней цепочки вызовов.
+
+chain - create_lead_chain: crm.lead.add, затем crm.lead.productrows.set (два round trip);
+batch - create_lead: лид и товары одним batch со ссылкой $result[lead].
+
+Bitrix24 заменён локальным сервером (tests/fake_bitrix.py) с задержкой ответа --rtt-ms.
+
+    python -m bench.lead_batch_latency --leads 50 --rtt-ms 80
+"""
+import argparse
+import asyncio
+import time
+
+from bench import report
+from crm import BitrixClient
+from ratelimit import TokenBucket
+from tests.fake_bitrix import FakeBitrix
+
+ORDER = {
+    "name": "Анна",
+    "phone": "79990000000",
+    "address": "ул. Ленина, 1",
+    "products": [
+        {"name": "Капучино", "priece": "250", "quantity": 2},
+        {"name": "Круассан & джем", "priece": "180", "quantity": 1},
+        {"name": "Раф \"Лаванда\"", "priece": "320", "quantity": 1},
+    ],
+}
+
+
+async def measure(mode: str, leads: int, rtt: float):
+    fake = FakeBitrix(delay=rtt)
+    # Свой ограничитель без пауз: сравниваем только сетевые round trip
+    client = BitrixClient(await fake.start(), limiter=TokenBucket("bench", rate=10000, capacity=10000))
+    create = client.create_lead if mode == "batch" else client.create_lead_chain
+    latencies = []
+    try:
+        for _ in range(leads):
+            started = time.perf_counter()
+            lead_id = await create(ORDER)
+            latencies.append(time.perf_counter() - started)
+            assert fake.leads[lead_id]["rows"][1]["PRODUCT_NAME"] == "Круассан & джем"
+        report(mode, latencies, http_calls=len(fake.calls), calls_per_lead=len(fake.calls) / leads)
+    finally:
+        await client.close()
+        await fake.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=80, help="задержка ответа Bitrix24")
+    args = parser.parse_args()
+
+    for mode in ("chain", "batch"):
+        await measure(mode, args.leads, args.rtt_ms / 1000)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
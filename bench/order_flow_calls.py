@@ -0,0 +1,162 @@
+"""Сколько запросов к Bot API уходит на один заказ и на листание меню.
+
+Апдейты проходят через настоящий Dispatcher бота (все роутеры и middleware из main.py),
+а вместо Telegram стоит фейковая сессия, которая считает вызовы по методам и отвечает
+правдоподобными сообщениями. Меню берётся из временного CSV (MENU_SOURCE=local).
+
+order  - полный путь заказа: меню, категория, товар, количество, корзина, сводка,
+         оформление, имя, телефон, адрес, подтверждение;
+browse - категория и --pages переходов по страницам товаров.
+
+    python -m bench.order_flow_calls --pages 5
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+from collections import Counter
+
+from bench import tmp_path
+
+MENU_FILE = tmp_path("menu.csv")
+os.environ.update(MENU_SOURCE="local", MENU_LOCAL_FILE=MENU_FILE, METRICS_PORT="0", LOG_LEVEL="ERROR",
+                  USER_BURST="1000", USER_RATE="1000", DEDUP_WINDOW="0")
+
+USER_ID = 42
+# Товаров хватает на несколько страниц одной категории
+PRODUCTS = 40
+
+_SENT_METHODS = {"SendMessage", "SendPhoto", "EditMessageText", "EditMessageMedia", "EditMessageReplyMarkup"}
+_PHOTO_METHODS = {"SendPhoto", "EditMessageMedia"}
+
+
+def write_menu():
+    with open(MENU_FILE, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["ID", "Название", "Описание", "Цена", "Ккал", "Б", "Ж", "С", "Фото", "Категория"])
+        for n in range(1, PRODUCTS + 1):
+            writer.writerow([str(n), f"Напиток {n}", "", str(100 + n), "", "", "", "",
+                             f"https://example.com/{n}.jpg", "Кофе"])
+
+
+class Chat:
+    """Фейковая сессия Bot API и состояние чата: какое сообщение сейчас экран"""
+
+    def __init__(self):
+        from aiogram.client.session.base import BaseSession
+        from aiogram.types import Message
+
+        chat = self
+        self.calls = Counter()
+        self.message_ids = itertools.count(100)
+        self.update_ids = itertools.count(1)
+        self.screen_id = None
+        self.screen_photo = False
+        self.screen_text = ""
+
+        class FakeSession(BaseSession):
+            async def make_request(self, bot, method, timeout=None):
+                name = type(method).__name__
+                chat.calls[name] += 1
+                if name not in _SENT_METHODS:
+                    return True
+                message_id = getattr(method, "message_id", None) or next(chat.message_ids)
+                photo = name in _PHOTO_METHODS or (name == "EditMessageReplyMarkup" and chat.screen_photo)
+                chat.screen_id, chat.screen_photo = message_id, photo
+                data = {"message_id": message_id, "date": 0, "chat": {"id": USER_ID, "type": "private"}}
+                if photo:
+                    data["photo"] = [{"file_id": f"F{message_id}", "file_unique_id": "U", "width": 1, "height": 1}]
+                    data["caption"] = getattr(method, "caption", None) or "c"
+                else:
+                    # edit_reply_markup текст не присылает - он остаётся прежним
+                    chat.screen_text = getattr(method, "text", None) or chat.screen_text
+                    data["text"] = chat.screen_text
+                return Message.model_validate(data)
+
+            async def close(self):
+                pass
+
+            async def stream_content(self, *args, **kwargs):
+                yield b""
+
+        self.session = FakeSession()
+
+    def _user(self):
+        return {"id": USER_ID, "is_bot": False, "first_name": "Иван"}
+
+    def text(self, text: str):
+        from aiogram.types import Update
+
+        return Update.model_validate({"update_id": next(self.update_ids), "message": {
+            "message_id": next(self.message_ids), "date": 0, "chat": {"id": USER_ID, "type": "private"},
+            "from": self._user(), "text": text}})
+
+    def tap(self, data: str):
+        from aiogram.types import Update
+
+        message = {"message_id": self.screen_id, "date": 0, "chat": {"id": USER_ID, "type": "private"},
+                   "from": {"id": 1, "is_bot": True, "first_name": "bot"}}
+        if self.screen_photo:
+            message["photo"] = [{"file_id": "F", "file_unique_id": "U", "width": 1, "height": 1}]
+        else:
+            message["text"] = self.screen_text
+        return Update.model_validate({"update_id": next(self.update_ids), "callback_query": {
+            "id": str(next(self.update_ids)), "from": self._user(), "chat_instance": "x",
+            "data": data, "message": message}})
+
+
+async def run(pages: int):
+    import main  # noqa: F401 - регистрирует роутеры и middleware бота
+    from bot import bot, dp
+    from callbacks import CategoryCallback, ProductCallback, ProductPageCallback
+    from google_sheets import fetch_catalog
+
+    chat = Chat()
+    bot.session = chat.session
+    catalog = await fetch_catalog()
+    v = catalog.version
+
+    async def feed(update):
+        await dp.feed_update(bot, update() if callable(update) else update)
+
+    async def measure(title: str, steps):
+        chat.calls.clear()
+        for step in steps:
+            await feed(step)
+        calls = dict(sorted(chat.calls.items()))
+        answers = calls.pop("AnswerCallbackQuery", 0)
+        print(f"{title:<7} total={sum(chat.calls.values()):<3} answerCallbackQuery={answers:<3} {calls}")
+
+    await measure("order", [
+        chat.text("Сделать заказ☕"),
+        lambda: chat.tap(CategoryCallback(v=v, idx=0).pack()),
+        lambda: chat.tap(ProductCallback(v=v, id="1").pack()),
+        lambda: chat.tap("quantity_2"),
+        lambda: chat.tap("show_cart"),
+        lambda: chat.tap("show_cart_summary"),
+        lambda: chat.tap("purchase"),
+        chat.text("Иван"),
+        chat.text("+79991234567"),
+        chat.text("ул. Ленина 1"),
+        lambda: chat.tap("confirm_order"),
+    ])
+    await measure("browse", [
+        chat.text("Сделать заказ☕"),
+        lambda: chat.tap(CategoryCallback(v=v, idx=0).pack()),
+        *(lambda page=page: chat.tap(ProductPageCallback(v=v, idx=0, page=page % 2 + 1).pack())
+          for page in range(pages)),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+
+    write_menu()
+    asyncio.run(run(args.pages))
+
+
+if __name__ == "__main__":
+    main()
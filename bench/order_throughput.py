@@ -0,0 +1,67 @@
+"""Пропускная способность при всплеске заказов: заказ на запрос против общего batch.
+
+single     - каждый заказ отдельным create_lead (один batch-запрос на заказ);
+aggregated - LeadAggregator собирает одновременные заказы в batch до 50 команд.
+
+Запросы проходят через такой же ограничитель, как у бота (--rps/--concurrency), поэтому
+результат показывает, сколько заказов в секунду пропускает лимит Bitrix24.
+
+    python -m bench.order_throughput --orders 50 --rps 2 --rtt-ms 80
+"""
+import argparse
+import asyncio
+import time
+
+from bench import report
+from crm import BITRIX_BATCH_WINDOW, BitrixClient, LeadAggregator
+from ratelimit import TokenBucket
+from tests.fake_bitrix import FakeBitrix
+
+ORDER = {
+    "name": "Анна",
+    "phone": "79990000000",
+    "address": "ул. Ленина, 1",
+    "products": [{"name": "Капучино", "priece": "250", "quantity": 2}],
+}
+
+
+async def measure(mode: str, orders: int, rps: float, concurrency: int, rtt: float, window: float):
+    fake = FakeBitrix(delay=rtt)
+    limiter = TokenBucket("bench", rate=rps, capacity=rps, max_concurrency=concurrency)
+    client = BitrixClient(await fake.start(), limiter=limiter)
+    aggregator = LeadAggregator(client, window=window)
+    submit = aggregator.submit if mode == "aggregated" else client.create_lead
+    latencies = []
+
+    async def place(n: int):
+        started = time.perf_counter()
+        lead_id = await submit({**ORDER, "order_key": f"{mode}-{n}"})
+        latencies.append(time.perf_counter() - started)
+        return lead_id
+
+    try:
+        started = time.perf_counter()
+        lead_ids = await asyncio.gather(*(place(n) for n in range(orders)))
+        elapsed = time.perf_counter() - started
+        assert len(set(lead_ids)) == orders
+        report(mode, latencies, http_calls=len(fake.calls), orders_per_s=round(orders / elapsed, 1))
+    finally:
+        await client.close()
+        await fake.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--rps", type=float, default=2, help="лимит запросов к Bitrix24 в секунду")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--rtt-ms", type=float, default=80, help="задержка ответа Bitrix24")
+    parser.add_argument("--window-ms", type=float, default=BITRIX_BATCH_WINDOW * 1000)
+    args = parser.parse_args()
+
+    for mode in ("single", "aggregated"):
+        await measure(mode, args.orders, args.rps, args.concurrency, args.rtt_ms / 1000, args.window_ms / 1000)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""Воспроизведение записанных апдейтов на webhook-эндпоинт: пропускная способность и время ответа.
+
+Апдейты берутся из файла (--file): JSON Lines по апдейту в строке, JSON-массив или ответ
+getUpdates ({"ok": true, "result": [...]}). Без файла генерируются нажатия кнопок и сообщения.
+
+С --url апдейты отправляются на запущенного бота (RUN_MODE=webhook, с тем же WEBHOOK_SECRET).
+Без --url поднимается локальное приложение тем же SimpleRequestHandler(handle_in_background=True),
+что и в main.py, с обработчиком без вызовов Telegram: так измеряется сам веб-сервер и диспетчер.
+
+    python -m bench.webhook_replay --count 5000 --concurrency 64
+    python -m bench.webhook_replay --url http://127.0.0.1:8080/webhook --secret ... --file updates.jsonl
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import CallbackQuery, Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from bench import report
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data.get("result", [data])
+    return data
+
+
+def synthetic_updates(count: int, users: int = 500) -> List[dict]:
+    updates = []
+    for n in range(count):
+        user = {"id": 1000 + n % users, "is_bot": False, "first_name": "Гость"}
+        chat = {"id": user["id"], "type": "private"}
+        message = {"message_id": n, "date": int(time.time()), "chat": chat, "from": user, "text": "☕ Кофе"}
+        if n % 2:
+            updates.append({"update_id": n, "callback_query": {
+                "id": str(n), "from": user, "chat_instance": "1", "data": "p:1:3", "message": message}})
+        else:
+            updates.append({"update_id": n, "message": message})
+    return updates
+
+
+async def start_local_app(secret: Optional[str]):
+    """Локальный webhook с диспетчером, который только считает обработанные апдейты"""
+    router = Router()
+    processed = {"count": 0, "done": asyncio.Event(), "expected": 0}
+
+    def count():
+        processed["count"] += 1
+        if processed["count"] >= processed["expected"]:
+            processed["done"].set()
+
+    @router.message()
+    async def on_message(message: Message):
+        count()
+
+    @router.callback_query()
+    async def on_callback(callback: CallbackQuery):
+        count()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot("123456:BENCH")
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True).register(
+        app, path="/webhook")
+    runner = web.AppRunner(app, keepalive_timeout=75)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return f"http://127.0.0.1:{port}/webhook", runner, bot, processed
+
+
+async def replay(url: str, updates: List[dict], concurrency: int, secret: Optional[str]):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    latencies, statuses = [], {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def sender():
+            while not queue.empty():
+                update = queue.get_nowait()
+                started = time.perf_counter()
+                async with session.post(url, json=update, headers=headers) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="адрес webhook запущенного бота; без него - локальный сервер")
+    parser.add_argument("--secret", default="bench-secret", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--file", help="записанные апдейты (JSON Lines, массив или ответ getUpdates)")
+    parser.add_argument("--count", type=int, default=5000, help="число синтетических апдейтов без --file")
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременных HTTP-соединений")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else synthetic_updates(args.count)
+    runner = bot = processed = None
+    url = args.url
+    if url is None:
+        url, runner, bot, processed = await start_local_app(args.secret)
+        processed["expected"] = len(updates)
+
+    try:
+        latencies, statuses, elapsed = await replay(url, updates, args.concurrency, args.secret)
+        report("webhook ack", latencies, updates_per_s=round(len(updates) / elapsed), statuses=statuses)
+        if processed is not None:
+            await asyncio.wait_for(processed["done"].wait(), timeout=30)
+            print(f"processed {processed['count']} updates")
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+            await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
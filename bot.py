@@ -1,12 +1,36 @@
 import os
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
+from storage import SQLiteStorage
+
 # Загружаем переменные окружения
 load_dotenv()
 
+# Telegram ID администраторов через запятую: им доступны служебные команды
+ADMIN_IDS = {int(value) for value in os.getenv("ADMIN_IDS", "").split(",") if value.strip()}
+
 # Создаём объект бота (глобально)
 bot = Bot(token=os.getenv('BOT_TOKEN'))
 
+
+def create_storage():
+    """Хранилище FSM: sqlite (по умолчанию, переживает перезапуск и общее для воркеров) или memory.
+
+    Отложенная запись и кэш чтения включены по умолчанию только для одного процесса. Если
+    вебхук запущен в несколько воркеров (WEBHOOK_WORKERS > 1), по умолчанию FSM_FLUSH_MS=0 и
+    FSM_CACHE_TTL=0: иначе воркер может прочитать устаревшую корзину и затереть чужую запись.
+    """
+    if os.getenv("FSM_STORAGE", "sqlite") == "memory":
+        return MemoryStorage()
+    shared = os.getenv("RUN_MODE", "polling") == "webhook" and int(os.getenv("WEBHOOK_WORKERS", "1")) > 1
+    return SQLiteStorage(
+        os.getenv("FSM_DB", "fsm.sqlite3"),
+        flush_interval=float(os.getenv("FSM_FLUSH_MS", "0" if shared else "50")) / 1000,
+        cache_ttl=float(os.getenv("FSM_CACHE_TTL", "0" if shared else "1")),
+    )
+
+
 # Создаём диспетчер
-dp = Dispatcher()
+dp = Dispatcher(storage=create_storage())
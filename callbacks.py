@@ -0,0 +1,22 @@
+from aiogram.filters.callback_data import CallbackData
+
+
+# Компактные callback_data вместо полных названий: Telegram ограничивает поле 64 байтами.
+# v - версия каталога (MenuCatalog.version), по ней распознаются кнопки из старого меню.
+# Категории и страницы адресуются позицией и после смены версии не действительны;
+# товар адресуется ID и находится в новом каталоге, пока его не удалили.
+
+class CategoryCallback(CallbackData, prefix="c"):
+    v: str
+    idx: int  # позиция в отсортированном списке категорий
+
+
+class ProductCallback(CallbackData, prefix="p"):
+    v: str
+    id: str  # ID товара из колонки A листа "Меню"
+
+
+class ProductPageCallback(CallbackData, prefix="pp"):
+    v: str
+    idx: int  # позиция категории, как в CategoryCallback
+    page: int
@@ -0,0 +1,106 @@
+from typing import Dict, List, NamedTuple, Optional
+
+from catalog import MenuCatalog, Product
+
+
+class CartLine(NamedTuple):
+    """Строка корзины, дополненная данными из каталога для показа"""
+    product_id: str
+    name: str
+    quantity: int
+    price: int
+    product: Optional[Product]
+
+    @property
+    def subtotal(self) -> int:
+        return self.price * self.quantity
+
+
+class Cart:
+    """Компактная корзина для FSM: только ID товара, количество и цена на момент добавления.
+
+    Одинаковые товары сливаются в одну строку, итоги пересчитываются при каждом изменении,
+    а названия и описания подтягиваются из каталога только при выводе.
+    """
+
+    __slots__ = ("lines", "total_quantity", "total_cost")
+
+    def __init__(self):
+        self.lines: Dict[str, List[int]] = {}  # product_id -> [количество, цена]
+        self.total_quantity = 0
+        self.total_cost = 0
+
+    @classmethod
+    def from_state(cls, data: Dict) -> "Cart":
+        cart = cls()
+        state = data.get("cart") or {}
+        for product_id, quantity, price in state.get("l", []):
+            cart.lines[product_id] = [quantity, price]
+        cart.total_quantity = state.get("q", 0)
+        cart.total_cost = state.get("s", 0)
+        return cart
+
+    def to_state(self) -> Dict:
+        return {
+            "l": [[product_id, quantity, price] for product_id, (quantity, price) in self.lines.items()],
+            "q": self.total_quantity,
+            "s": self.total_cost,
+        }
+
+    def add(self, product_id: str, quantity: int, price: int):
+        line = self.lines.get(product_id)
+        if line is None:
+            self.lines[product_id] = [quantity, price]
+        else:
+            line[0] += quantity
+            price = line[1]
+        self.total_quantity += quantity
+        self.total_cost += quantity * price
+
+    def set_quantity(self, product_id: str, quantity: int) -> bool:
+        line = self.lines.get(product_id)
+        if line is None:
+            return False
+        delta = quantity - line[0]
+        line[0] = quantity
+        self.total_quantity += delta
+        self.total_cost += delta * line[1]
+        return True
+
+    def remove(self, product_id: str) -> bool:
+        line = self.lines.pop(product_id, None)
+        if line is None:
+            return False
+        self.total_quantity -= line[0]
+        self.total_cost -= line[0] * line[1]
+        return True
+
+    def clear(self):
+        self.lines.clear()
+        self.total_quantity = 0
+        self.total_cost = 0
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.lines
+
+    def hydrate(self, catalog: MenuCatalog) -> List[CartLine]:
+        """Строки корзины с названиями из каталога (товар мог пропасть из меню после добавления)"""
+        result = []
+        for product_id, (quantity, price) in self.lines.items():
+            product = catalog.get(product_id)
+            name = product.name if product else f"Товар #{product_id}"
+            result.append(CartLine(product_id, name, quantity, price, product))
+        return result
+
+    def to_order_products(self, catalog: MenuCatalog) -> List[Dict]:
+        """Позиции заказа в формате, который ожидает crm.py"""
+        products = []
+        for line in self.hydrate(catalog):
+            item = line.product.to_dict() if line.product else {"id": line.product_id, "name": line.name}
+            item["priece"] = line.price
+            item["quantity"] = line.quantity
+            products.append(item)
+        return products
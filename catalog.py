@@ -0,0 +1,209 @@
+import zlib
+from dataclasses import dataclass, asdict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+# Колонки листа "Меню": A..J
+MENU_COLUMNS = 10
+# Сколько товаров помещается на одну страницу клавиатуры категории
+PRODUCTS_PAGE_SIZE = 8
+
+
+def normalize_name(value: str) -> str:
+    """Ключ для точного поиска по названию: без регистра и лишних пробелов"""
+    return " ".join(value.split()).lower()
+
+
+@dataclass(frozen=True, slots=True)
+class Product:
+    """Товар из листа "Меню" """
+    id: str
+    name: str
+    description: str
+    price: int
+    calories: str
+    proteins: str
+    fats: str
+    sugar: str
+    image_url: str
+    category: str
+
+    @classmethod
+    def from_row(cls, row: List[str]) -> "Product":
+        try:
+            price = int(row[3])
+        except ValueError:
+            price = 0
+        return cls(
+            id=row[0].strip(),
+            name=row[1].strip(),
+            description=row[2],
+            price=price,
+            calories=row[4],
+            proteins=row[5],
+            fats=row[6],
+            sugar=row[7],
+            image_url=row[8],
+            category=row[9].strip(),
+        )
+
+    def to_dict(self) -> Dict:
+        """Словарь для FSM и CRM (ключ 'priece' сохранён для совместимости с crm.py)"""
+        data = asdict(self)
+        data["priece"] = data.pop("price")
+        return data
+
+
+class MenuDiff(NamedTuple):
+    """Что изменилось в меню между двумя загрузками"""
+    added: List[Product]
+    removed: List[Product]
+    changed: List[Product]  # новые версии изменённых товаров
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+def rows_version(rows: List[List[str]]) -> str:
+    return format(zlib.crc32(repr(rows).encode()), "08x")
+
+
+def _row_key(row: List[str]) -> str:
+    # Строки сопоставляем по ID, а если его нет - по названию
+    return row[0].strip() or "name:" + normalize_name(row[1])
+
+
+class MenuCatalog:
+    """Индекс меню, строится по первой загрузке таблицы и дальше обновляется по разнице строк.
+
+    Поиск товара по ID и по точному названию, а также списки товаров по категориям
+    занимают O(1) и не зависят от размера меню. version - короткий хэш содержимого листа:
+    он меняется только когда меняется меню, по нему сбрасываются кэши клавиатур.
+    """
+
+    def __init__(self, rows: List[List[str]]):
+        self.version = ""
+        self.by_id: Dict[str, Product] = {}
+        self.by_name: Dict[str, Product] = {}
+        self.by_category: Dict[str, List[Product]] = {}
+        self.categories: List[str] = []
+        # категория -> готовые срезы товаров по страницам (только товары с ID, их можно выбрать кнопкой)
+        self.pages: Dict[str, List[List[Product]]] = {}
+
+        self._rows: Dict[str, Tuple[str, ...]] = {}  # ключ строки -> её содержимое
+        self._products: Dict[str, Product] = {}
+        self._positions: Dict[str, int] = {}
+        self._category_keys: Dict[str, Set[str]] = {}
+        self._name_keys: Dict[str, Set[str]] = {}
+        self.update(rows)
+
+    def update(self, rows: List[List[str]]) -> MenuDiff:
+        """Применяет новую версию листа: разбираются и переиндексируются только изменённые строки"""
+        version = rows_version(rows)
+        if version == self.version:
+            return MenuDiff([], [], [])
+
+        new_rows: Dict[str, Tuple[str, ...]] = {}
+        positions: Dict[str, int] = {}
+        for position, row in enumerate(rows[1:]):  # Пропускаем заголовок
+            if len(row) < MENU_COLUMNS or not row[1].strip():
+                continue
+            key = _row_key(row)
+            if key not in new_rows:  # При дублях побеждает первая строка
+                new_rows[key] = tuple(row[:MENU_COLUMNS])
+                positions[key] = position
+
+        added, removed, changed = [], [], []
+        categories, names = set(), set()
+
+        for key in self._rows.keys() - new_rows.keys():
+            product = self._products.pop(key)
+            removed.append(product)
+            self._unindex(key, product, categories, names)
+
+        for key, row in new_rows.items():
+            old_row = self._rows.get(key)
+            if old_row == row:
+                continue
+            if old_row is not None:
+                self._unindex(key, self._products[key], categories, names)
+            product = Product.from_row(list(row))
+            (changed if old_row is not None else added).append(product)
+            self._products[key] = product
+            if product.id:
+                self.by_id[product.id] = product
+            self._category_keys.setdefault(product.category, set()).add(key)
+            self._name_keys.setdefault(normalize_name(product.name), set()).add(key)
+            categories.add(product.category)
+            names.add(normalize_name(product.name))
+
+        # Строки могли просто переставить - тогда порядок пересчитываем во всех категориях
+        kept = [key for key in new_rows if key in self._positions]
+        if kept != sorted(kept, key=self._positions.get):
+            categories, names = set(self._category_keys), set(self._name_keys)
+
+        self._rows = new_rows
+        self._positions = positions
+        self.version = version
+
+        for category in categories:
+            keys = self._category_keys.get(category)
+            if keys:
+                products = [self._products[key] for key in sorted(keys, key=positions.get)]
+                self.by_category[category] = products
+                self.pages[category] = _paginate([product for product in products if product.id])
+            else:
+                self.by_category.pop(category, None)
+                self.pages.pop(category, None)
+                self._category_keys.pop(category, None)
+
+        # При одинаковых названиях побеждает товар, стоящий выше в таблице
+        for name in names:
+            keys = self._name_keys.get(name)
+            if keys:
+                self.by_name[name] = self._products[min(keys, key=positions.get)]
+            else:
+                self.by_name.pop(name, None)
+                self._name_keys.pop(name, None)
+
+        # Стабильный порядок, чтобы клавиатуры не зависели от порядка строк и set
+        self.categories = sorted(self.by_category)
+        return MenuDiff(added, removed, changed)
+
+    def _unindex(self, key: str, product: Product, categories: Set[str], names: Set[str]):
+        if product.id and self.by_id.get(product.id) is product:
+            del self.by_id[product.id]
+        name = normalize_name(product.name)
+        self._category_keys[product.category].discard(key)
+        self._name_keys[name].discard(key)
+        categories.add(product.category)
+        names.add(name)
+
+    def category_at(self, index: int) -> Optional[str]:
+        """Категория по номеру из callback_data"""
+        if 0 <= index < len(self.categories):
+            return self.categories[index]
+        return None
+
+    def get(self, product_id: str) -> Optional[Product]:
+        return self.by_id.get(product_id)
+
+    def find_by_name(self, name: str) -> Optional[Product]:
+        return self.by_name.get(normalize_name(name))
+
+    def products_in(self, category: str) -> List[Product]:
+        return self.by_category.get(category.strip(), [])
+
+    def page_count(self, category: str) -> int:
+        return len(self.pages.get(category, ()))
+
+    def products_page(self, category: str, page: int) -> List[Product]:
+        """Товары на странице page (с нуля); пустой список для несуществующей страницы"""
+        pages = self.pages.get(category, ())
+        return pages[page] if 0 <= page < len(pages) else []
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+
+def _paginate(products: List[Product], size: int = PRODUCTS_PAGE_SIZE) -> List[List[Product]]:
+    return [products[i:i + size] for i in range(0, len(products), size)] or [[]]
@@ -1,27 +1,51 @@
 # crm.py
+import asyncio
 import os
+import aiohttp
 import requests
 from dotenv import load_dotenv
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
 import json
+import logging
+import time
+
+from ratelimit import PRIORITY_DIAGNOSTIC, PRIORITY_ORDER, TokenBucket, limiters
+from telemetry import crm_latency, crm_requests, fields, get_logger, should_sample
+from tracing import span
 
 load_dotenv()
 BITRIX_URL = os.getenv("BITRIX_WEBHOOK")
 
+log = get_logger("crm")
 
-def create_lead(data: Dict) -> bool:
-    """Создание лида в Bitrix24"""
-    if not BITRIX_URL:
-        print("❌ BITRIX_WEBHOOK не указан в .env")
-        return False
 
-    # Проверяем корректность URL и формируем правильный endpoint
-    base_url = BITRIX_URL.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
+def get_base_url(webhook_url: Optional[str]) -> Optional[str]:
+    """Базовый URL вебхука (без имени метода) с завершающим слэшем"""
+    if not webhook_url:
+        return None
+    base_url = webhook_url.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
     if not base_url.endswith('/'):
         base_url += '/'
-    webhook_url = base_url + 'crm.lead.add'
+    return base_url
+
+
+# Вычисляем один раз при импорте, а не в каждой функции
+BITRIX_BASE_URL = get_base_url(BITRIX_URL)
+# Источник лидов, созданных ботом (поле ORIGINATOR_ID)
+ORIGINATOR_ID = "telegram_bot"
+# Окно, в течение которого заказы копятся для общего batch-запроса
+BITRIX_BATCH_WINDOW = float(os.getenv("BITRIX_BATCH_WINDOW_MS", "100")) / 1000
+# Bitrix24 принимает не больше 50 команд в одном batch
+BITRIX_BATCH_LIMIT = 50
+# Сколько раз повторять запрос, на который Bitrix24 ответил 429/503
+BITRIX_THROTTLE_RETRIES = 2
 
+
+def build_lead_payload(data: Dict) -> Dict:
+    """Поля лида для crm.lead.add"""
     # Подготавливаем данные
     phone_value = data.get("phone", "")
     if phone_value and not phone_value.startswith("+"):
@@ -51,6 +75,24 @@ def create_lead(data: Dict) -> bool:
         }
     }
 
+    # Ключ идемпотентности заказа: по нему повторная отправка находит уже созданный лид
+    if data.get("order_key"):
+        payload["fields"]["ORIGINATOR_ID"] = ORIGINATOR_ID
+        payload["fields"]["ORIGIN_ID"] = data["order_key"]
+    return payload
+
+
+def create_lead(data: Dict) -> bool:
+    """Создание лида в Bitrix24"""
+    if not BITRIX_URL:
+        print("❌ BITRIX_WEBHOOK не указан в .env")
+        return False
+
+    base_url = BITRIX_BASE_URL
+    webhook_url = base_url + 'crm.lead.add'
+
+    payload = build_lead_payload(data)
+
     print(f"🔄 Отправляем запрос в Bitrix24...")
     print(f"URL: {webhook_url}")
     print(f"Payload: {json.dumps(payload, ensure_ascii=False, indent=2)}")
@@ -119,22 +161,8 @@ def create_lead(data: Dict) -> bool:
         return False
 
 
-def add_products_to_lead_improved(lead_id: int, products: List[Dict]) -> bool:
-    """Улучшенная версия добавления товаров к лиду"""
-    if not BITRIX_URL:
-        print("❌ BITRIX_WEBHOOK не настроен для добавления товаров")
-        return False
-
-    base_url = BITRIX_URL.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
-    if not base_url.endswith('/'):
-        base_url += '/'
-
-    # Сначала попробуем добавить товары через crm.lead.productrows.set
-    webhook_url = base_url + 'crm.lead.productrows.set'
-
-    print(f"🛒 Добавляем {len(products)} товаров к лиду {lead_id}")
-    print(f"URL для товаров: {webhook_url}")
-
+def build_product_rows(products: List[Dict]) -> List[Dict]:
+    """Товарные позиции для crm.lead.productrows.set"""
     # Формируем массив товарных позиций с минимальными обязательными полями
     product_rows = []
     for i, product in enumerate(products):
@@ -152,7 +180,86 @@ def add_products_to_lead_improved(lead_id: int, products: List[Dict]) -> bool:
         }
 
         product_rows.append(product_row)
-        print(f"   Товар {i + 1}: {product.get('name')} - {price}₽ x {quantity} шт.")
+    return product_rows
+
+
+@dataclass(frozen=True)
+class BatchRef:
+    """Ссылка на результат предыдущей команды batch ($result[command]).
+
+    Только такие значения попадают в команду без URL-кодирования: строки от пользователя,
+    даже похожие на "$result[...]", всегда кодируются и не могут добавить свои параметры.
+    """
+    command: str
+
+    def __str__(self) -> str:
+        return f"$result[{self.command}]"
+
+
+def flatten_params(value, prefix: str = "") -> List[Tuple[str, Union[str, BatchRef]]]:
+    """Разворачивает вложенные dict/list в пары ключ-значение в формате PHP: rows[0][PRICE]=..."""
+    if isinstance(value, BatchRef):
+        return [(prefix, value)]
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple)):
+        items = enumerate(value)
+    else:
+        return [(prefix, str(value))]
+
+    pairs = []
+    for key, item in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        pairs.extend(flatten_params(item, name))
+    return pairs
+
+
+def build_command(method: str, params: Dict) -> str:
+    """Команда для batch: метод и URL-кодированные параметры.
+
+    Ссылки на результаты предыдущих команд (BatchRef) не кодируются, иначе Bitrix24 их не подставит.
+    """
+    query = []
+    for key, value in flatten_params(params):
+        value = str(value) if isinstance(value, BatchRef) else quote(value, safe="")
+        query.append(f"{quote(key, safe='[]')}={value}")
+    return f"{method}?{'&'.join(query)}"
+
+
+def build_lead_commands(data: Dict, suffix: str = "") -> Dict[str, str]:
+    """Batch-команды для одного заказа: лид и его товарные позиции (ссылкой на ID нового лида)"""
+    lead_key = f"lead{suffix}"
+    commands = {lead_key: build_command("crm.lead.add", build_lead_payload(data))}
+    if data.get("products"):
+        commands[f"rows{suffix}"] = build_command(
+            "crm.lead.productrows.set",
+            {"id": BatchRef(lead_key), "rows": build_product_rows(data["products"])}
+        )
+    return commands
+
+
+def build_lead_batch(data: Dict) -> Dict:
+    """Один batch-запрос: создание лида и его товарных позиций за один сетевой вызов"""
+    return {"halt": 1, "cmd": build_lead_commands(data)}
+
+
+def add_products_to_lead_improved(lead_id: int, products: List[Dict]) -> bool:
+    """Улучшенная версия добавления товаров к лиду"""
+    if not BITRIX_URL:
+        print("❌ BITRIX_WEBHOOK не настроен для добавления товаров")
+        return False
+
+    base_url = BITRIX_BASE_URL
+
+    # Сначала попробуем добавить товары через crm.lead.productrows.set
+    webhook_url = base_url + 'crm.lead.productrows.set'
+
+    print(f"🛒 Добавляем {len(products)} товаров к лиду {lead_id}")
+    print(f"URL для товаров: {webhook_url}")
+
+    product_rows = build_product_rows(products)
+    for i, row in enumerate(product_rows):
+        print(f"   Товар {i + 1}: {row['PRODUCT_NAME']} - {row['PRICE']}₽ x {row['QUANTITY']} шт.")
 
     # Первый способ - через productrows.set
     payload = {
@@ -181,20 +288,14 @@ def add_products_to_lead_improved(lead_id: int, products: List[Dict]) -> bool:
 
 def add_products_batch(lead_id: int, products: List[Dict]) -> bool:
     """Добавление товаров через batch запрос"""
-    base_url = BITRIX_URL.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
-    if not base_url.endswith('/'):
-        base_url += '/'
+    base_url = BITRIX_BASE_URL
 
     batch_url = base_url + 'batch'
 
-    # Формируем batch команды
-    commands = {}
-    for i, product in enumerate(products):
-        price = float(product.get("priece", 0))
-        quantity = float(product.get("quantity", 1))
-
-        commands[
-            f"product_{i}"] = f"crm.lead.productrows.set?id={lead_id}&rows[0][PRODUCT_NAME]={product.get('name', f'Товар {i + 1}')}&rows[0][PRICE]={price}&rows[0][QUANTITY]={quantity}&rows[0][CUSTOMIZED]=Y&rows[0][MEASURE_CODE]=796&rows[0][MEASURE_NAME]=шт"
+    # Одна команда со всеми позициями: productrows.set перезаписывает строки лида целиком
+    commands = {
+        "products": build_command("crm.lead.productrows.set", {"id": lead_id, "rows": build_product_rows(products)})
+    }
 
     payload = {
         "cmd": commands
@@ -217,26 +318,8 @@ def add_products_batch(lead_id: int, products: List[Dict]) -> bool:
     return False
 
 
-def update_lead_with_products(lead_id: int, products: List[Dict]) -> bool:
-    """Обновляем лид с подробной информацией о товарах в комментарии"""
-    base_url = BITRIX_URL.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
-    if not base_url.endswith('/'):
-        base_url += '/'
-
-    update_url = base_url + 'crm.lead.update'
-
-    # Получаем текущий комментарий
-    get_url = base_url + 'crm.lead.get'
-    try:
-        get_response = requests.post(get_url, json={"id": lead_id}, timeout=10)
-        current_comments = ""
-        if get_response.status_code == 200:
-            lead_data = get_response.json()
-            if lead_data.get("result") and lead_data["result"].get("COMMENTS"):
-                current_comments = lead_data["result"]["COMMENTS"] + "\n\n"
-    except:
-        current_comments = ""
-
+def format_products_detail(products: List[Dict]) -> str:
+    """Подробный список товаров для комментария лида"""
     # Добавляем детальную информацию о товарах
     products_detail = "🛒 ТОВАРНЫЕ ПОЗИЦИИ:\n"
     products_detail += "=" * 50 + "\n"
@@ -266,6 +349,28 @@ def update_lead_with_products(lead_id: int, products: List[Dict]) -> bool:
     products_detail += "=" * 50 + "\n"
     products_detail += f"💰 ИТОГОВАЯ СУММА: {total}₽\n"
     products_detail += f"📊 Количество позиций: {len(products)}\n"
+    return products_detail
+
+
+def update_lead_with_products(lead_id: int, products: List[Dict]) -> bool:
+    """Обновляем лид с подробной информацией о товарах в комментарии"""
+    base_url = BITRIX_BASE_URL
+
+    update_url = base_url + 'crm.lead.update'
+
+    # Получаем текущий комментарий
+    get_url = base_url + 'crm.lead.get'
+    try:
+        get_response = requests.post(get_url, json={"id": lead_id}, timeout=10)
+        current_comments = ""
+        if get_response.status_code == 200:
+            lead_data = get_response.json()
+            if lead_data.get("result") and lead_data["result"].get("COMMENTS"):
+                current_comments = lead_data["result"]["COMMENTS"] + "\n\n"
+    except:
+        current_comments = ""
+
+    products_detail = format_products_detail(products)
 
     # Обновляем лид
     payload = {
@@ -333,10 +438,7 @@ def test_bitrix_connection() -> bool:
         print("❌ BITRIX_WEBHOOK не настроен")
         return False
 
-    # Формируем корректный URL для тестирования
-    base_url = BITRIX_URL.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
-    if not base_url.endswith('/'):
-        base_url += '/'
+    base_url = BITRIX_BASE_URL
     test_url = base_url + 'crm.lead.list'
 
     try:
@@ -376,9 +478,7 @@ def check_lead_products(lead_id: int) -> bool:
     if not BITRIX_URL:
         return False
 
-    base_url = BITRIX_URL.replace('/crm.lead.add.json', '').replace('/crm.lead.add', '')
-    if not base_url.endswith('/'):
-        base_url += '/'
+    base_url = BITRIX_BASE_URL
 
     check_url = base_url + 'crm.lead.productrows.get'
 
@@ -400,4 +500,312 @@ def check_lead_products(lead_id: int) -> bool:
     except Exception as e:
         print(f"❌ Ошибка проверки товаров: {e}")
 
-    return False
\ No newline at end of file
+    return False
+
+class BitrixClient:
+    """Асинхронный клиент Bitrix24.
+
+    Держит один пул keep-alive соединений (aiohttp.ClientSession) на всё приложение
+    и повторяет API синхронных функций модуля в виде корутин.
+    """
+
+    def __init__(self, webhook_url: Optional[str], timeout: float = 30, pool_size: int = 10,
+                 limiter: TokenBucket = limiters["bitrix"]):
+        self.webhook_url = webhook_url
+        self.limiter = limiter
+        self.base_url = get_base_url(webhook_url)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессию создаём лениво: ей нужен запущенный event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=self.timeout,
+                headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def call(self, method: str, payload: Optional[Dict] = None, http_method: str = "POST",
+                   priority: int = PRIORITY_ORDER) -> Optional[Dict]:
+        """Вызов метода REST API. Возвращает разобранный JSON или None при ошибке сети/HTTP.
+
+        Каждый запрос проходит через общий ограничитель частоты; при 429/503 делаем паузу и повторяем.
+        """
+        if not self.base_url:
+            log.error("BITRIX_WEBHOOK не указан в .env")
+            return None
+
+        url = self.base_url + method
+        for attempt in range(BITRIX_THROTTLE_RETRIES + 1):
+            with span(f"crm.{method}"):
+                async with self.limiter.slot(priority):
+                    started = time.perf_counter()
+                    status, text, retry_after = await self._request(method, url, payload, http_method)
+                    crm_latency.observe(time.perf_counter() - started, method=method)
+            crm_requests.inc(method=method, status=status or "error")
+            if status in (429, 503) and attempt < BITRIX_THROTTLE_RETRIES:
+                delay = retry_after or 2 ** attempt
+                log.warning("Bitrix24 ограничивает запросы, повторяем",
+                            extra=fields(method=method, status=status, delay_s=delay))
+                await asyncio.sleep(delay)
+                continue
+            break
+
+        if status is None:
+            return None
+        if status != 200:
+            # Тело ответа может содержать данные клиента - только в отладочном режиме
+            log.error("HTTP ошибка Bitrix24", extra=fields(method=method, status=status))
+            log.debug("Тело ответа Bitrix24: %s", text[:500], extra=fields(method=method))
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            log.error("Ответ Bitrix24 не JSON", extra=fields(method=method, error=str(e)))
+            return None
+
+    async def _request(self, method: str, url: str, payload: Optional[Dict],
+                       http_method: str) -> Tuple[Optional[int], str, Optional[float]]:
+        session = self._get_session()
+        try:
+            if http_method == "GET":
+                request = session.get(url, params=payload)
+            else:
+                request = session.post(url, json=payload or {})
+            async with request as response:
+                text = await response.text()
+                retry_after = response.headers.get("Retry-After")
+                return response.status, text, float(retry_after) if retry_after and retry_after.isdigit() else None
+        except (aiohttp.ServerTimeoutError, asyncio.TimeoutError):
+            log.error("Таймаут запроса к Bitrix24", extra=fields(method=method))
+        except aiohttp.ClientError as e:
+            log.error("Ошибка соединения с Bitrix24", extra=fields(method=method, error=str(e)))
+        except Exception:
+            log.exception("Неожиданная ошибка запроса к Bitrix24", extra=fields(method=method))
+        return None, "", None
+
+    async def create_lead(self, data: Dict) -> Optional[int]:
+        """Создание лида. Возвращает ID лида или None.
+
+        Сначала пробуем один batch-запрос; если Bitrix24 его отклонил, используем прежнюю цепочку вызовов.
+        """
+        result = await self.call("batch", build_lead_batch(data))
+        if result is None:
+            # Ответ потерян: лид мог быть создан, повторная отправка решается на уровне очереди
+            return None
+
+        batch = result.get("result") or {}
+        results = batch.get("result") or {}
+        errors = batch.get("result_error") or {}
+        lead_id = results.get("lead")
+        if not lead_id:
+            log.warning("Batch-создание лида не сработало, пробуем по шагам",
+                        extra=fields(error=errors or result.get("error")))
+            return await self.create_lead_chain(data)
+
+        log.info("Лид создан одним batch-запросом", extra=fields(lead_id=lead_id))
+        if data.get("products") and "rows" in errors:
+            log.warning("Товары не добавились в batch", extra=fields(lead_id=lead_id, error=errors["rows"]))
+            if not await self.add_products_to_lead_improved(lead_id, data["products"]):
+                await self.update_lead_with_products(lead_id, data["products"])
+        return int(lead_id)
+
+    async def create_lead_chain(self, data: Dict) -> Optional[int]:
+        """Создание лида последовательными вызовами: crm.lead.add, затем товары"""
+        result = await self.call("crm.lead.add", build_lead_payload(data))
+        if not result:
+            return None
+
+        if not result.get("result"):
+            log.error("Ошибка Bitrix24 API", extra=fields(method="crm.lead.add", error=result.get("error")))
+            return None
+
+        lead_id = result["result"]
+        log.info("Лид создан", extra=fields(lead_id=lead_id))
+
+        if data.get("products"):
+            if not await self.add_products_to_lead_improved(lead_id, data["products"]):
+                log.warning("Товары не добавились, записываем их в комментарий", extra=fields(lead_id=lead_id))
+                await self.update_lead_with_products(lead_id, data["products"])
+
+        return lead_id
+
+    async def find_lead_by_origin(self, order_key: str) -> Optional[int]:
+        """ID лида, уже созданного для заказа с этим ключом, или None"""
+        payload = {
+            "filter": {"ORIGINATOR_ID": ORIGINATOR_ID, "ORIGIN_ID": order_key},
+            "select": ["ID"],
+        }
+        result = await self.call("crm.lead.list", payload)
+        if result is None:
+            raise ConnectionError("Bitrix24 недоступен")
+        leads = result.get("result") or []
+        return int(leads[0]["ID"]) if leads else None
+
+    async def add_products_to_lead_improved(self, lead_id: int, products: List[Dict]) -> bool:
+        result = await self.call("crm.lead.productrows.set", {"id": lead_id, "rows": build_product_rows(products)})
+        if result and result.get("result") is not None:
+            log.info("Товары добавлены к лиду", extra=fields(lead_id=lead_id, via="productrows.set"))
+            return True
+
+        log.debug("productrows.set не сработал, пробуем batch", extra=fields(lead_id=lead_id))
+        return await self.add_products_batch(lead_id, products)
+
+    async def add_products_batch(self, lead_id: int, products: List[Dict]) -> bool:
+        commands = {
+            "products": build_command("crm.lead.productrows.set", {"id": lead_id, "rows": build_product_rows(products)})
+        }
+
+        result = await self.call("batch", {"cmd": commands})
+        if result and result.get("result"):
+            log.info("Товары добавлены к лиду", extra=fields(lead_id=lead_id, via="batch"))
+            return True
+        return False
+
+    async def update_lead_with_products(self, lead_id: int, products: List[Dict]) -> bool:
+        current_comments = ""
+        lead_data = await self.call("crm.lead.get", {"id": lead_id})
+        if lead_data and lead_data.get("result") and lead_data["result"].get("COMMENTS"):
+            current_comments = lead_data["result"]["COMMENTS"] + "\n\n"
+
+        payload = {
+            "id": lead_id,
+            "fields": {
+                "COMMENTS": current_comments + format_products_detail(products)
+            }
+        }
+        result = await self.call("crm.lead.update", payload)
+        if result and result.get("result"):
+            log.info("Комментарий лида дополнен товарами", extra=fields(lead_id=lead_id))
+            return True
+        return False
+
+    async def check_lead_products(self, lead_id: int) -> bool:
+        result = await self.call("crm.lead.productrows.get", {"id": lead_id}, priority=PRIORITY_DIAGNOSTIC)
+        if not result:
+            return False
+
+        products = result.get("result", [])
+        log.info("Товарные позиции лида", extra=fields(lead_id=lead_id, count=len(products)))
+        return len(products) > 0
+
+    async def test_bitrix_connection(self) -> bool:
+        result = await self.call("crm.lead.list", {"select[]": "ID", "start": 0}, http_method="GET",
+                                 priority=PRIORITY_DIAGNOSTIC)
+        if result is None:
+            return False
+
+        log.info("Соединение с Bitrix24 работает", extra=fields(leads=len(result.get("result", []))))
+        return True
+
+    async def debug_create_lead(self, data: Dict) -> Optional[int]:
+        # Полный дамп заказа содержит персональные данные: пишем его выборочно и только на уровне DEBUG
+        if log.isEnabledFor(logging.DEBUG) and should_sample():
+            log.debug("Отладочный дамп заказа: %s", json.dumps(data, ensure_ascii=False))
+
+        result = await self.create_lead(data)
+        log.info("Результат отладочного создания лида", extra=fields(lead_id=result))
+        return result
+
+
+class LeadAggregator:
+    """Собирает заказы, пришедшие почти одновременно, в один batch-запрос к Bitrix24.
+
+    Заказы копятся в течение окна (BITRIX_BATCH_WINDOW) или пока не наберётся BITRIX_BATCH_LIMIT команд,
+    затем отправляются одним вызовом, а ID лидов раздаются ожидающим корутинам.
+    """
+
+    def __init__(self, client: BitrixClient, window: float = BITRIX_BATCH_WINDOW,
+                 max_commands: int = BITRIX_BATCH_LIMIT):
+        self.client = client
+        self.window = window
+        self.max_commands = max_commands
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._pending_commands = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, data: Dict) -> Optional[int]:
+        """Добавляет заказ в ближайший batch и ждёт ID лида.
+
+        Если лид не создан, бросает исключение с причиной (нет связи или ошибка Bitrix24),
+        чтобы очередь заказов сохранила её в last_error.
+        """
+        # Лид и, если есть товары, ещё одна команда на товарные позиции
+        commands = 2 if data.get("products") else 1
+        if self._pending and self._pending_commands + commands > self.max_commands:
+            self._flush()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((data, future))
+        self._pending_commands += commands
+
+        if self._pending_commands >= self.max_commands:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_commands = self._pending, [], 0
+        asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        try:
+            cmd = {}
+            for n, (data, _) in enumerate(batch):
+                cmd.update(build_lead_commands(data, suffix=f"_{n}"))
+
+            # halt=0: ошибка одного заказа не должна отменять остальные
+            result = await self.client.call("batch", {"halt": 0, "cmd": cmd})
+            if result is None:
+                for _, future in batch:
+                    future.set_exception(ConnectionError("Bitrix24 недоступен"))
+                return
+
+            response = result.get("result") or {}
+            results = response.get("result") or {}
+            errors = response.get("result_error") or {}
+            log.info("Batch заказов отправлен в Bitrix24", extra=fields(orders=len(batch), commands=len(cmd)))
+
+            await asyncio.gather(*(
+                self._resolve(n, data, future, results, errors)
+                for n, (data, future) in enumerate(batch)
+            ))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _resolve(self, n: int, data: Dict, future: asyncio.Future, results: Dict, errors: Dict):
+        lead_id = results.get(f"lead_{n}")
+        try:
+            if not lead_id:
+                log.warning("Заказ не создан в общем batch, пробуем по шагам",
+                            extra=fields(error=errors.get(f"lead_{n}")))
+                lead_id = await self.client.create_lead_chain(data)
+                if not lead_id:
+                    raise RuntimeError(f"Bitrix24 не создал лид: {errors.get(f'lead_{n}') or 'нет ответа'}")
+            elif f"rows_{n}" in errors:
+                if not await self.client.add_products_to_lead_improved(lead_id, data["products"]):
+                    await self.client.update_lead_with_products(lead_id, data["products"])
+        except Exception as e:
+            future.set_exception(e)
+            return
+        future.set_result(int(lead_id))
+
+
+bitrix = BitrixClient(BITRIX_URL)
+lead_aggregator = LeadAggregator(bitrix)
@@ -1,47 +1,372 @@
+import asyncio
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional
+
 import gspread
 from google.oauth2.service_account import Credentials
 
-SERVICE_ACCOUNT_FILE = 'C:\\Users\\User\\PycharmProjects\coffeshop2\\app\\coffemenu-462712-5af8851dacc6.json'
+from catalog import MenuCatalog, MenuDiff, Product
+from ratelimit import PRIORITY_DEFAULT, limiters
+from search import MenuSearchIndex
+from telemetry import fields, get_logger, menu_lookups, sheets_latency
+from tracing import traced
+
+# Путь к ключу сервисного аккаунта Google
+SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE", "service_account.json")
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets',
           'https://www.googleapis.com/auth/drive']
-creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-client = gspread.authorize(creds)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> gspread.Client:
+    """Клиент gspread создаётся при первом обращении к Google, а не при импорте модуля"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            _client = gspread.authorize(creds)
+        return _client
+
+
+SPREADSHEET_TITLE = "МенюКофейни"
+WORKSHEET_TITLE = "Меню"
+# Откуда брать меню: google (по умолчанию) или local - CSV-файл MENU_LOCAL_FILE
+MENU_SOURCE = os.getenv("MENU_SOURCE", "google")
+MENU_LOCAL_FILE = os.getenv("MENU_LOCAL_FILE", "menu.csv")
+# Последнее удачно загруженное меню: с него бот стартует сразу и работает, пока Google недоступен
+MENU_SNAPSHOT_FILE = os.getenv("MENU_SNAPSHOT_FILE", "menu_snapshot.json")
+
+# Проверка ревизии - один запрос к Drive, загрузка листа - метаданные листа и значения
+MENU_PROBE_COST = 1
+MENU_LOAD_COST = 2
+
+# Сколько секунд снимок меню считается свежим
+MENU_TTL = float(os.getenv("MENU_TTL", "300"))
+# Как часто вспомогательные воркеры вебхука проверяют файл снимка, который обновляет основной
+MENU_FOLLOW_TTL = float(os.getenv("MENU_FOLLOW_TTL", "10"))
+# Сколько потоков одновременно могут ходить в Google Sheets
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "2"))
+
+log = get_logger("sheets")
+
+_executor = ThreadPoolExecutor(max_workers=SHEETS_WORKERS, thread_name_prefix="sheets")
+_inflight: Dict[Hashable, asyncio.Task] = {}
+
+
+async def run_blocking(func, *args):
+    """Выполняет синхронный вызов gspread в ограниченном пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def coalesce(key: Hashable, coro_factory):
+    """Одинаковые одновременные запросы разделяют один выполняющийся вызов"""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(coro_factory())
+        _inflight[key] = task
+
+        def _forget(done, key=key):
+            if _inflight.get(key) is done:
+                del _inflight[key]
+
+        task.add_done_callback(_forget)
+    # shield: отмена одного ожидающего не отменяет загрузку для остальных
+    return await asyncio.shield(task)
+
+
+class GoogleMenuSource:
+    """Лист "Меню" в Google Sheets.
+
+    revision() - дешёвый запрос к Drive за modifiedTime; сам лист скачивается только если он изменился.
+    """
+
+    def __init__(self, title: str = SPREADSHEET_TITLE, worksheet: str = WORKSHEET_TITLE):
+        self.title = title
+        self.worksheet = worksheet
+        self.spreadsheet_id = None
+
+    def revision(self) -> Optional[str]:
+        files = get_client().list_spreadsheet_files(self.title)
+        if not files:
+            return None
+        self.spreadsheet_id = files[0]["id"]
+        return files[0].get("modifiedTime")
+
+    def load_rows(self) -> List[List[str]]:
+        """Скачивает лист целиком"""
+        client = get_client()
+        if self.spreadsheet_id:
+            spreadsheet = client.open_by_key(self.spreadsheet_id)
+        else:
+            spreadsheet = client.open(self.title)
+        return spreadsheet.worksheet(self.worksheet).get_all_values()
+
+
+class LocalMenuSource:
+    """Меню из локального CSV-файла с теми же колонками, что и лист "Меню".
+
+    Нужен для разработки и тестов без доступа к Google: ревизия - время изменения файла.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def revision(self) -> Optional[str]:
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def load_rows(self) -> List[List[str]]:
+        with open(self.path, encoding="utf-8", newline="") as file:
+            return list(csv.reader(file))
+
+
+class SnapshotMenuSource:
+    """Файл снимка меню, который сохраняет другой процесс.
+
+    Вспомогательные воркеры вебхука читают меню отсюда и не ходят в Google сами.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def revision(self) -> Optional[str]:
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def load_rows(self) -> List[List[str]]:
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)["rows"]
+
+
+def create_menu_source():
+    if MENU_SOURCE == "local":
+        return LocalMenuSource(MENU_LOCAL_FILE)
+    return GoogleMenuSource()
+
+
+class MenuSnapshot:
+    """Снимок меню в памяти.
+
+    Таблица скачивается один раз, по ней строится индекс MenuCatalog, который отдаётся из памяти.
+    Когда снимок старше TTL, он по-прежнему отдаётся (stale-while-revalidate),
+    а обновление уходит в фоновую задачу. Перед загрузкой проверяется ревизия источника:
+    если меню не менялось, лист не скачивается, а если менялось - каталог обновляется по разнице строк.
+
+    Каждая новая версия сохраняется в snapshot_path. При старте снимок поднимается из этого файла
+    и считается устаревшим: бот отвечает сразу, а свежая версия подтягивается в фоне.
+    """
+
+    def __init__(self, source, ttl: float, snapshot_path: Optional[str] = None):
+        self.source = source
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.catalog = None
+        self.revision = None
+        self._offline_checked = False
+        self.loaded_at = 0.0
+        self._refresh_task = None
+        self._listeners = []
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "unchanged": 0,
+            "offline_loads": 0,
+            "last_refresh_ms": 0.0,
+            "total_refresh_ms": 0.0,
+        }
+
+    def follow(self, ttl: float = MENU_FOLLOW_TTL):
+        """Переключает снимок на чтение файла snapshot_path, который обновляет другой процесс"""
+        if not self.snapshot_path:
+            return
+        self.source = SnapshotMenuSource(self.snapshot_path)
+        self.snapshot_path = None  # Файл пишет только процесс, который ходит в Google
+        self.ttl = ttl
+
+    def is_stale(self) -> bool:
+        return self.catalog is None or time.monotonic() - self.loaded_at >= self.ttl
+
+    def add_listener(self, callback):
+        """Подписка на событие "меню изменилось": callback(catalog, diff), может быть корутиной.
+
+        diff - MenuDiff с добавленными, удалёнными и изменёнными товарами (None при первой загрузке).
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, catalog: MenuCatalog, diff: Optional[MenuDiff]):
+        for callback in self._listeners:
+            try:
+                result = callback(catalog, diff)
+                if asyncio.iscoroutine(result):
+                    try:
+                        asyncio.get_running_loop().create_task(result)
+                    except RuntimeError:
+                        result.close()  # Нет event loop - асинхронным подписчикам негде выполниться
+            except Exception:
+                log.exception("Ошибка обработчика обновления меню")
+
+    def _needs_offline(self) -> bool:
+        return not self._offline_checked and self.catalog is None and bool(self.snapshot_path)
+
+    def _read_offline(self) -> Optional[dict]:
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning("Файл снимка меню не прочитан", extra=fields(path=self.snapshot_path, error=str(e)))
+            return None
+
+    def _apply_offline(self, data: Optional[dict]) -> bool:
+        self._offline_checked = True
+        if not data or self.catalog is not None:
+            return self.catalog is not None
+
+        self.catalog = MenuCatalog(data["rows"])
+        self.revision = data.get("revision")
+        self.loaded_at = time.monotonic() - self.ttl  # сразу устаревший: обновится в фоне
+        self.stats["offline_loads"] += 1
+        self._notify(self.catalog, None)
+        return True
+
+    async def load_offline_async(self) -> bool:
+        """Поднимает каталог из файла снимка (один раз, только если каталог ещё пуст); файл читается в пуле потоков"""
+        if not self._needs_offline():
+            return self.catalog is not None
+        return self._apply_offline(await run_blocking(self._read_offline))
+
+    def _save_offline(self, rows):
+        if not self.snapshot_path:
+            return
+        data = {"revision": self.revision, "saved_at": time.time(), "rows": rows}
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            log.warning("Не удалось сохранить снимок меню", extra=fields(error=str(e)))
+
+    def _is_unchanged(self, revision: Optional[str]) -> bool:
+        if self.catalog is None or revision is None or revision != self.revision:
+            return False
+        self.loaded_at = time.monotonic()
+        self.stats["unchanged"] += 1
+        return True
+
+    def _store(self, rows, started: float, revision: Optional[str]):
+        if self.catalog is None:
+            self.catalog = MenuCatalog(rows)
+            diff = None
+        else:
+            old_version = self.catalog.version
+            diff = self.catalog.update(rows)
+            if self.catalog.version == old_version:
+                diff = False  # Ревизия сменилась, а содержимое нет
+        self.revision = revision
+        self._save_offline(rows)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.loaded_at = time.monotonic()
+        self.stats["refreshes"] += 1
+        self.stats["last_refresh_ms"] = elapsed_ms
+        self.stats["total_refresh_ms"] += elapsed_ms
+        if diff is not False:
+            self._notify(self.catalog, diff)
+
+    async def _reload(self):
+        await self.load_offline_async()
+        sheets = limiters["sheets"]
+        async with sheets.slot(PRIORITY_DEFAULT, cost=MENU_PROBE_COST):
+            with sheets_latency.time(stage="revision"):
+                revision = await run_blocking(self.source.revision)
+        if self._is_unchanged(revision):
+            return self.catalog
+
+        async with sheets.slot(PRIORITY_DEFAULT, cost=MENU_LOAD_COST):
+            started = time.perf_counter()
+            with sheets_latency.time(stage="load"):
+                rows = await run_blocking(self.source.load_rows)
+        self._store(rows, started, revision)
+        return self.catalog
+
+    async def refresh_async(self):
+        """Перезагрузка снимка в пуле потоков; параллельные вызовы ждут одну загрузку"""
+        return await coalesce(("menu", id(self)), self._reload)
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh_async()
+        except Exception as e:
+            self.stats["refresh_errors"] += 1
+            log.error("Не удалось обновить меню из Google Sheets", extra=fields(error=str(e)))
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.get_running_loop().create_task(self._background_refresh())
+
+    @traced("sheets")
+    async def get_catalog_async(self) -> MenuCatalog:
+        """Каталог из памяти; устаревший отдаётся сразу и обновляется в фоне, первая загрузка идёт в пуле потоков"""
+        if self.catalog is None and not await self.load_offline_async():
+            self.stats["misses"] += 1
+            menu_lookups.inc(result="miss")
+            return await self.refresh_async()
+
+        self.stats["hits"] += 1
+        menu_lookups.inc(result="hit")
+        if self.is_stale():
+            self._schedule_refresh()
+        return self.catalog
+
+    async def run_refresher(self, interval: float = None):
+        """Фоновая задача: периодически обновляет снимок, чтобы пользователи не ждали Google"""
+        while True:
+            await self._background_refresh()
+            await asyncio.sleep(interval or self.ttl)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["avg_refresh_ms"] = stats["total_refresh_ms"] / stats["refreshes"] if stats["refreshes"] else 0.0
+        stats["age_s"] = time.monotonic() - self.loaded_at if self.catalog is not None else None
+        return stats
 
 
-def get_categories():
-    spreadsheet = client.open("МенюКофейни")
-    sheet = spreadsheet.worksheet("Меню")
-    column_j = sheet.col_values(10)[1:]
-    result = set()
-    for value in column_j:
-        result.add(value)
-    return result
+menu_snapshot = MenuSnapshot(create_menu_source(), MENU_TTL, MENU_SNAPSHOT_FILE)
+_search_index: Optional[MenuSearchIndex] = None
 
 
-def get_products_by_category(keyword):
-    spreadsheet = client.open("МенюКофейни")
-    sheet = spreadsheet.worksheet("Меню")
-    rows = sheet.get_all_values()
+def get_search_index(catalog: MenuCatalog) -> MenuSearchIndex:
+    """Поисковый индекс для текущей версии каталога"""
+    global _search_index
+    if _search_index is None or _search_index.version != catalog.version:
+        _search_index = MenuSearchIndex(catalog)
+    return _search_index
 
-    # Ищем строки, где в колонке J (индекс 9) содержится нужное слово
-    matching_rows = []
 
-    for row in rows[1:]:  # Пропускаем заголовок
-        if len(row) >= 10 and keyword.lower() in row[9].lower():  # Ищем в 10-й колонке (индекс 9)
-            matching_rows.append(row[1])
+# Индекс перестраивается сразу после изменения меню, а не на первом запросе пользователя
+menu_snapshot.add_listener(lambda catalog, diff: get_search_index(catalog))
 
-    return matching_rows
 
+# Асинхронный фасад для хендлеров: сетевые вызовы уходят в пул потоков
 
-def get_product(name):
-    spreadsheet = client.open("МенюКофейни")
-    sheet = spreadsheet.worksheet("Меню")
-    rows = sheet.get_all_values()
+async def fetch_catalog() -> MenuCatalog:
+    return await menu_snapshot.get_catalog_async()
 
-    # Ищем строки, где в колонке J (индекс 9) содержится нужное слово
-    matching_rows = []
 
-    for row in rows[1:]:  # Пропускаем заголовок
-        if len(row) >= 10 and name.lower() in row[1].lower():  # Ищем в 10-й колонке (индекс 9)
-            matching_rows.append(row)
-    return matching_rows
+async def search_products(query: str, limit: int = 20) -> List[Product]:
+    """Поиск по названиям и описаниям с автодополнением и допуском опечаток, без обращения к Google"""
+    return get_search_index(await menu_snapshot.get_catalog_async()).search(query, limit)
@@ -1,21 +1,32 @@
-import asyncio
+from datetime import datetime
 from aiogram import Router, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message, FSInputFile, CallbackQuery, ReplyKeyboardRemove
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
-from bot import bot
+
+from bot import ADMIN_IDS, bot
 import keyboard as kb
-from google_sheets import get_products_by_category, get_product
-from crm import create_lead, debug_create_lead, test_bitrix_connection
+from callbacks import CategoryCallback, ProductCallback, ProductPageCallback
+from cart import Cart
+from catalog import Product
+from google_sheets import fetch_catalog, menu_snapshot
+from crm import bitrix
+from outbox import order_outbox
+from orders import order_store
+from photo_cache import warm_up_photos
+from ratelimit import PRIORITY_ORDER, limiters
+from screens import show_screen
+from send_scheduler import send_priority, send_scheduler
+from telemetry import fields, get_logger
+from tracing import traces
 
 router = Router(name=__name__)
-tasks = {}
-reply_events: dict[int, asyncio.Event] = {}
-
-# Сохраняем последнее отправленное сообщение для удаления
-active_messages: dict[int, list[int]] = {}
+log = get_logger("handlers")
+# Текст, который пользователь вводит на шаге оформления. Кнопки главного меню и команды
+# сюда не попадают: их обрабатывают свои хендлеры, даже если они зарегистрированы ниже
+user_input = F.text & ~F.text.startswith("/") & ~F.text.in_(kb.MAIN_MENU_TEXTS)
 
 
 class OrderStates(StatesGroup):
@@ -30,17 +41,6 @@ class OrderStates(StatesGroup):
     editing_quantity = State()
 
 
-async def delete_active_messages(tg_id: int):
-    """Удаляет все сохранённые сообщения пользователя."""
-    if tg_id in active_messages:
-        for msg_id in active_messages[tg_id]:
-            try:
-                await bot.delete_message(tg_id, msg_id)
-            except Exception as e:
-                print(f"[{tg_id}] Не удалось удалить сообщение {msg_id}: {e}")
-        active_messages[tg_id] = []
-
-
 @router.message(CommandStart())
 async def cmd(mes: Message):
     await mes.answer("🌟 Добро пожаловать в нашу кофейню!\n"
@@ -51,55 +51,76 @@ async def cmd(mes: Message):
 
 @router.message(F.text == "Сделать заказ☕")
 async def show_categories(mes: Message, state: FSMContext):
-    await mes.answer("Выберете категорию", reply_markup=kb.create_categories())
+    await show_screen(mes, "Выберете категорию", await kb.create_categories())
+    await state.set_state(OrderStates.choosing_category)
+
+
+async def answer_stale_menu(callback: CallbackQuery, state: FSMContext):
+    """Кнопка из старой версии меню: не угадываем товар, а показываем актуальные категории"""
+    await show_screen(callback, "🔄 Меню обновилось, выберите категорию заново", await kb.create_categories())
+    await callback.answer()
     await state.set_state(OrderStates.choosing_category)
 
 
-@router.callback_query(F.data.startswith("category_"))
-async def show_product(callback: CallbackQuery, state: FSMContext):
-    category = callback.data.replace("category_", "")
-    products = get_products_by_category(category)
-    await callback.message.answer("Выберете товар", reply_markup=kb.create_products(products))
+@router.callback_query(CategoryCallback.filter())
+async def show_product(callback: CallbackQuery, callback_data: CategoryCallback, state: FSMContext):
+    catalog = await fetch_catalog()
+    category = catalog.category_at(callback_data.idx)
+    if callback_data.v != catalog.version or category is None:
+        await answer_stale_menu(callback, state)
+        return
+
+    await show_screen(callback, "Выберете товар", await kb.create_products(category))
     await callback.answer()
     await state.set_state(OrderStates.choosing_item)
 
 
+@router.callback_query(ProductPageCallback.filter())
+async def turn_products_page(callback: CallbackQuery, callback_data: ProductPageCallback, state: FSMContext):
+    """Листание товаров категории: меняется только клавиатура того же сообщения"""
+    catalog = await fetch_catalog()
+    category = catalog.category_at(callback_data.idx)
+    if callback_data.v != catalog.version or category is None:
+        await answer_stale_menu(callback, state)
+        return
+
+    await show_screen(callback, "Выберете товар", await kb.create_products(category, callback_data.page))
+    await callback.answer()
+
+
+@router.callback_query(F.data == "noop")
+async def ignore_noop(callback: CallbackQuery):
+    await callback.answer()
+
+
 @router.callback_query(F.data == 'return_categories')
 async def return_to_categories(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("Выберете категорию", reply_markup=kb.create_categories())
+    await show_screen(callback, "Выберете категорию", await kb.create_categories())
     await callback.answer()
     await state.set_state(OrderStates.choosing_category)
 
 
-@router.callback_query(F.data.startswith("product_"))
-async def show_product(callback: CallbackQuery, state: FSMContext):
-    name_product = callback.data.replace("product_", "")
-    product = get_product(name_product)[0]
+def product_caption(product: Product) -> str:
+    return (
+        f"{product.category[:1]}{product.name}\n\n📝{product.description}\n"
+        f"💰Цена {product.price}\n"
+        f"📊КБЖУ: K : {product.calories}, Б : {product.proteins}, Ж : {product.fats}, У : {product.sugar}"
+    )
+
+
+@router.callback_query(ProductCallback.filter())
+async def show_product(callback: CallbackQuery, callback_data: ProductCallback, state: FSMContext):
+    catalog = await fetch_catalog()
+    # ID товара не зависит от версии каталога: старая кнопка ведёт на тот же товар, пока он есть в меню
+    product = catalog.get(callback_data.id)
+    if product is None:
+        await answer_stale_menu(callback, state)
+        return
 
     # Просто сохраняем продукт как текущий, но не добавляем в корзину
-    await state.update_data(current_product={
-        "id": product[0],
-        "name": product[1],
-        "description": product[2],
-        'priece': int(product[3]),
-        "calories": product[4],
-        "proteins": product[5],
-        "fats": product[6],
-        "sugar": product[7],
-        "image_url": product[8],
-        "category": product[9]
-    })
-
-    await callback.message.answer_photo(
-        photo=product[8],
-        caption=(
-            f"{product[9][0]}{product[1]}\n\n📝{product[2]}\n"
-            f"💰Цена {product[3]}\n"
-            f"📊КБЖУ: K : {product[4]}, Б : {product[5]}, Ж : {product[6]}, У : {product[7]}"
-        ),
-        reply_markup=kb.create_quantity()
-    )
+    await state.update_data(current_product_id=product.id)
 
+    await show_screen(callback, product_caption(product), kb.create_quantity(), photo=product.image_url or None)
     await callback.answer()
     await state.set_state(OrderStates.choosing_quantity)
 
@@ -109,85 +130,78 @@ async def set_quantity(callback: CallbackQuery, state: FSMContext):
     quantity = int(callback.data.replace("quantity_", ""))
     data = await state.get_data()
 
-    product = data.get("current_product")
+    catalog = await fetch_catalog()
+    product = catalog.get(data.get("current_product_id") or "")
     if not product:
         await callback.message.answer("❌ Ошибка: товар не выбран.")
         return
 
-    product["quantity"] = quantity
-
-    products = data.get("products", [])
-    products.append(product)
-
-    await state.update_data(products=products)
-    await state.update_data(current_product=None)
+    cart = Cart.from_state(data)
+    cart.add(product.id, quantity, product.price)
+    await state.update_data(cart=cart.to_state(), current_product_id=None)
 
-    await show_cart_summary_message(callback.message.chat.id, state)
+    await show_cart_summary_message(callback, state)
     await callback.answer()
 
 
 @router.callback_query(F.data == "add_more")
 async def show_categories(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("Выберете категорию", reply_markup=kb.create_categories())
+    await show_screen(callback, "Выберете категорию", await kb.create_categories())
     await state.set_state(OrderStates.choosing_category)
     await callback.answer()
 
 
 @router.callback_query(F.data == "show_cart")
-async def show_cart(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    products = data.get("products", [])
+async def show_cart(callback: CallbackQuery, state: FSMContext, notice: str = ""):
+    cart = Cart.from_state(await state.get_data())
 
-    if not products:
-        await callback.message.answer("🛒 Ваша корзина пуста.")
+    if not cart:
+        await show_screen(callback, notice + "🛒 Ваша корзина пуста.", kb.empty_cart())
         await callback.answer()
         return
 
-    message = "🛒 Ваша корзина:\n\n"
-    total = 0
-    for i, p in enumerate(products):
-        subtotal = int(p["priece"]) * p["quantity"]
-        total += subtotal
-        message += f"{i + 1}. {p['name']} x{p['quantity']} = {subtotal}₽\n"
+    lines = cart.hydrate(await fetch_catalog())
+    message = notice + "🛒 Ваша корзина:\n\n"
+    for i, line in enumerate(lines):
+        message += f"{i + 1}. {line.name} x{line.quantity} = {line.subtotal}₽\n"
 
-    message += f"\n💰 Сумма: {total}₽"
-    await callback.message.answer(message, reply_markup=kb.create_cart_buttons(products))
+    message += f"\n💰 Сумма: {cart.total_cost}₽"
+    await show_screen(callback, message, kb.create_cart_buttons(lines))
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("remove_"))
 async def remove_item(callback: CallbackQuery, state: FSMContext):
-    index = int(callback.data.replace("remove_", ""))
-    data = await state.get_data()
-    products = data.get("products", [])
+    product_id = callback.data.replace("remove_", "")
+    cart = Cart.from_state(await state.get_data())
 
-    if 0 <= index < len(products):
-        removed = products.pop(index)
-        await state.update_data(products=products)
-        await callback.message.answer(f"❌ {removed['name']} удалён из корзины.")
+    if cart.remove(product_id):
+        await state.update_data(cart=cart.to_state())
+        product = (await fetch_catalog()).get(product_id)
+        notice = f"❌ {product.name if product else 'Товар'} удалён из корзины.\n\n"
     else:
-        await callback.message.answer("⚠️ Не удалось удалить товар.")
+        notice = "⚠️ Не удалось удалить товар.\n\n"
 
-    await show_cart(callback, state)  # показать обновлённую корзину
+    await show_cart(callback, state, notice)  # показать обновлённую корзину
 
 
 @router.callback_query(F.data == "clear_cart")
 async def clear_cart(callback: CallbackQuery, state: FSMContext):
-    await state.update_data(products=[])
-    await callback.message.answer("🗑 Корзина очищена.")
+    await state.update_data(cart=Cart().to_state())
+    await show_screen(callback, "🗑 Корзина очищена.", kb.empty_cart())
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("editqty_"))
 async def start_quantity_edit(callback: CallbackQuery, state: FSMContext):
-    index = int(callback.data.replace("editqty_", ""))
-    await state.update_data(edit_index=index)
-    await callback.message.answer("✏ Введите новое количество:")
+    product_id = callback.data.replace("editqty_", "")
+    await state.update_data(edit_product_id=product_id)
+    await show_screen(callback, "✏ Введите новое количество:", kb.back_to_cart())
     await state.set_state(OrderStates.editing_quantity)
     await callback.answer()
 
 
-@router.message(OrderStates.editing_quantity)
+@router.message(OrderStates.editing_quantity, user_input)
 async def update_quantity(message: Message, state: FSMContext):
     try:
         qty = int(message.text)
@@ -198,13 +212,14 @@ async def update_quantity(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    products = data.get("products", [])
-    index = data.get("edit_index")
-
-    if index is not None and 0 <= index < len(products):
-        products[index]["quantity"] = qty
-        await state.update_data(products=products)
-        await message.answer(f"✅ Обновлено: {products[index]['name']} теперь x{qty}", reply_markup=kb.back_to_cart())
+    cart = Cart.from_state(data)
+    product_id = data.get("edit_product_id")
+
+    if product_id is not None and cart.set_quantity(product_id, qty):
+        await state.update_data(cart=cart.to_state())
+        product = (await fetch_catalog()).get(product_id)
+        name = product.name if product else "Товар"
+        await show_screen(message, f"✅ Обновлено: {name} теперь x{qty}", kb.back_to_cart())
     else:
         await message.answer("⚠️ Не удалось найти товар для изменения.")
 
@@ -213,12 +228,12 @@ async def update_quantity(message: Message, state: FSMContext):
 
 @router.callback_query(F.data == "purchase")
 async def purchase_cart(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("👤 Как к вам обращаться? Введите ваше имя:", reply_markup=kb.return_to_cart_summary())
+    await show_screen(callback, "👤 Как к вам обращаться? Введите ваше имя:", kb.return_to_cart_summary())
     await state.set_state(OrderStates.entering_name)
     await callback.answer()
 
 
-@router.message(OrderStates.entering_name)
+@router.message(OrderStates.entering_name, user_input)
 async def receive_name(message: Message, state: FSMContext):
     name = message.text.strip()
 
@@ -227,11 +242,11 @@ async def receive_name(message: Message, state: FSMContext):
         return
 
     await state.update_data(name=name)
-    await message.answer(f"✅ Приятно познакомиться, {name}! Теперь введите номер телефона в формате +7xxxxxxxxxx")
+    await show_screen(message, f"✅ Приятно познакомиться, {name}! Теперь введите номер телефона в формате +7xxxxxxxxxx")
     await state.set_state(OrderStates.entering_contact)
 
 
-@router.message(OrderStates.entering_contact)
+@router.message(OrderStates.entering_contact, user_input)
 async def receive_phone(message: Message, state: FSMContext):
     phone = message.text.strip()
 
@@ -248,11 +263,11 @@ async def receive_phone(message: Message, state: FSMContext):
         phone = '+' + phone
 
     await state.update_data(phone=phone)
-    await message.answer("✅ Номер сохранён. Теперь укажите адрес доставки:")
+    await show_screen(message, "✅ Номер сохранён. Теперь укажите адрес доставки:")
     await state.set_state(OrderStates.entering_address)
 
 
-@router.message(OrderStates.entering_address)
+@router.message(OrderStates.entering_address, user_input)
 async def receive_address(message: Message, state: FSMContext):
     address = message.text.strip()
 
@@ -265,19 +280,17 @@ async def receive_address(message: Message, state: FSMContext):
     data = await state.get_data()
     name = data.get("name")
     phone = data.get("phone")
-    products = data.get("products", [])
+    total = Cart.from_state(data).total_cost
 
-    # Подсчитываем итоговую сумму
-    total = sum(int(p["priece"]) * int(p.get("quantity", 1)) for p in products)
-
-    await message.answer(
+    await show_screen(
+        message,
         f"📋 Проверьте данные заказа:\n\n"
         f"👤 Имя: {name}\n"
         f"📞 Телефон: {phone}\n"
         f"🏠 Адрес: {address}\n"
         f"💰 Сумма заказа: {total}₽\n\n"
         f"✅ Всё верно? Подтверждаем заказ?",
-        reply_markup=kb.confirm_order_menu()
+        kb.confirm_order_menu()
     )
     await state.set_state(OrderStates.confirming_order)
 
@@ -285,6 +298,13 @@ async def receive_address(message: Message, state: FSMContext):
 @router.callback_query(F.data == "confirm_order")
 async def confirm_order(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
+    cart = Cart.from_state(data)
+
+    # Повторное нажатие после оформления (state уже очищен) или кнопка со старого экрана:
+    # пустой заказ без телефона и адреса не должен уйти в Bitrix24 и историю
+    if not cart or not data.get("phone") or not data.get("address"):
+        await callback.answer("⚠️ Этот заказ уже оформлен или в нём не хватает данных", show_alert=True)
+        return
 
     # Получаем данные пользователя из Telegram
     user = callback.from_user
@@ -298,64 +318,104 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
         "address": data.get("address"),
         "telegram_id": user.id,
         "telegram_username": user.username,  # Убираем проверку на None
-        "products": data.get("products", [])
+        "products": cart.to_order_products(await fetch_catalog())
     }
 
-    print(f"🔄 Создаём заказ для пользователя: {lead_data['name']}")
-    print(f"📦 Товаров в заказе: {len(lead_data['products'])}")
+    total_amount = cart.total_cost
 
-    # Выводим детали заказа для отладки
-    total_amount = 0
-    for product in lead_data['products']:
-        price = int(product.get("priece", 0))
-        quantity = int(product.get("quantity", 1))
-        subtotal = price * quantity
-        total_amount += subtotal
-        print(f"   - {product.get('name')}: {price}₽ x {quantity} = {subtotal}₽")
+    # Сначала сохраняем заказ на диск, в Bitrix24 его отправит фоновый воркер
+    try:
+        order_key = order_outbox.put(lead_data)
+    except Exception:
+        log.exception("Не удалось сохранить заказ", extra=fields(user=user.id))
+        await callback.message.answer(
+            "❌ Произошла ошибка при создании заказа.\n"
+            "📞 Пожалуйста, свяжитесь с нами напрямую или попробуйте позже.",
+            reply_markup=kb.main
+        )
+        await callback.answer()
+        return
 
-    print(f"💰 Общая сумма заказа: {total_amount}₽")
+    order_store.add(
+        order_key,
+        user.id,
+        total_amount,
+        [[product["name"], product["quantity"], product["priece"]] for product in lead_data["products"]],
+    )
 
-    # Используем debug версию для отладки
-    if debug_create_lead(lead_data):
-        await callback.message.answer(
-            f"✅ Заказ успешно подтверждён и отправлен в систему!\n"
+    # Нижняя клавиатура kb.main не убиралась во время оформления, поэтому просто правим экран.
+    # Подтверждение заказа обгоняет в очереди отправки всё остальное
+    with send_priority(PRIORITY_ORDER):
+        await show_screen(
+            callback,
+            f"✅ Заказ успешно подтверждён и принят в работу!\n"
+            f"🧾 Номер заказа: {order_key[:8]}\n"
             f"💰 Сумма заказа: {total_amount}₽\n"
             f"📞 Наш менеджер свяжется с вами в ближайшее время.\n"
             f"☕️ Спасибо за заказ!",
-            reply_markup=kb.main
-        )
-    else:
-        await callback.message.answer(
-            "❌ Произошла ошибка при создании заказа.\n"
-            "📞 Пожалуйста, свяжитесь с нами напрямую или попробуйте позже.\n"
-            "Ваш заказ сохранён и будет обработан.",
-            reply_markup=kb.main
         )
 
     await state.clear()
     await callback.answer()
 
 
+# Статусы лидов Bitrix24 в истории заказов
+ORDER_STATUSES = {
+    "NEW": "🕓 Принят",
+    "IN_PROCESS": "👨‍🍳 Готовится",
+    "PROCESSED": "🚚 Обработан",
+    "CONVERTED": "✅ Выполнен",
+    "JUNK": "❌ Отменён",
+}
+
+
+def format_orders_page(orders) -> str:
+    if not orders:
+        return "📃 У вас пока нет заказов."
+
+    message = "📃 Ваши заказы:\n"
+    for order in orders:
+        created = datetime.fromtimestamp(order.created_at).strftime("%d.%m.%Y %H:%M")
+        status = ORDER_STATUSES.get(order.status, order.status)
+        message += f"\n🧾 Заказ {order.key[:8]} от {created} — {status}\n"
+        for name, quantity, price in order.items:
+            message += f"   • {name} x{quantity} = {price * quantity}₽\n"
+        message += f"   💰 Сумма: {order.total}₽\n"
+    return message
+
+
+@router.message(F.text == "Мои заказы📃")
+async def show_orders(message: Message):
+    orders, has_next = order_store.page(message.from_user.id, 0)
+    await show_screen(message, format_orders_page(orders), kb.orders_pagination(0, has_next))
+
+
+@router.callback_query(F.data.startswith("orders_page_"))
+async def show_orders_page(callback: CallbackQuery):
+    page = max(int(callback.data.replace("orders_page_", "")), 0)
+    orders, has_next = order_store.page(callback.from_user.id, page)
+    await show_screen(callback, format_orders_page(orders), kb.orders_pagination(page, has_next))
+    await callback.answer()
+
+
 @router.callback_query(F.data == "show_cart_summary")
 async def show_cart_summary(callback: CallbackQuery, state: FSMContext):
-    await show_cart_summary_message(callback.message.chat.id, state)
+    await show_cart_summary_message(callback, state)
     await callback.answer()
 
 
-async def show_cart_summary_message(chat_id: int, state: FSMContext):
-    data = await state.get_data()
-    products = data.get("products", [])
-
-    total_cost = sum(int(p["priece"]) * int(p.get("quantity", 1)) for p in products)
-    total_quantity = sum(int(p.get("quantity", 1)) for p in products)
+async def show_cart_summary_message(target: CallbackQuery, state: FSMContext):
+    cart = Cart.from_state(await state.get_data())
+    total_cost = cart.total_cost
+    total_quantity = cart.total_quantity
 
-    return await bot.send_message(
-        chat_id,
+    return await show_screen(
+        target,
         f'✅ Добавлено в корзину!\n\n'
         f'🛒 В корзине: {total_quantity} товаров\n'
         f'💰 Сумма заказа: {total_cost}₽\n'
         'Что дальше?',
-        reply_markup=kb.cart_menu()
+        kb.cart_menu()
     )
 
 
@@ -363,7 +423,98 @@ async def show_cart_summary_message(chat_id: int, state: FSMContext):
 @router.message(F.text == "/test_crm")
 async def test_crm(message: Message):
     """Тестирование подключения к CRM"""
-    if test_bitrix_connection():
+    if await bitrix.test_bitrix_connection():
         await message.answer("✅ Подключение к Bitrix24 работает!")
     else:
-        await message.answer("❌ Проблема с подключением к Bitrix24. Проверьте настройки.")
\ No newline at end of file
+        await message.answer("❌ Проблема с подключением к Bitrix24. Проверьте настройки.")
+
+
+# Команда для просмотра статистики кэша меню
+@router.message(F.text == "/menu_stats")
+async def menu_stats(message: Message):
+    """Статистика снимка меню: попадания, промахи, время обновления"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    stats = menu_snapshot.get_stats()
+    age = f"{stats['age_s']:.0f} с" if stats["age_s"] is not None else "не загружено"
+    await message.answer(
+        f"📊 Кэш меню\n"
+        f"✅ Попаданий: {stats['hits']}\n"
+        f"❌ Промахов: {stats['misses']}\n"
+        f"🎯 Доля попаданий: {stats['hit_ratio']:.1%}\n"
+        f"🔄 Обновлений: {stats['refreshes']} (ошибок: {stats['refresh_errors']})\n"
+        f"💤 Проверок без изменений: {stats['unchanged']}\n"
+        f"⏱ Последнее обновление: {stats['last_refresh_ms']:.0f} мс, среднее: {stats['avg_refresh_ms']:.0f} мс\n"
+        f"🕒 Возраст снимка: {age}"
+    )
+
+
+# Команда для просмотра очередей ограничителей запросов
+@router.message(F.text == "/limits")
+async def limits_stats(message: Message):
+    """Глубина очередей и время ожидания в ограничителях Bitrix24, Google Sheets и отправки в Telegram"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    lines = ["🚦 Ограничители запросов"]
+    for name, limiter in [*limiters.items(), ("telegram", send_scheduler)]:
+        stats = limiter.get_stats()
+        lines.append(
+            f"\n{name}: в очереди {stats['queue_depth']}, выполняется {stats['in_flight']}\n"
+            f"⏱ Ждали: {stats['waited']} из {stats['acquired']}, "
+            f"среднее {stats['avg_wait_s'] * 1000:.0f} мс, макс. {stats['max_wait_s'] * 1000:.0f} мс"
+        )
+    await message.answer("\n".join(lines))
+
+
+# Команда для загрузки фото меню в кэш file_id
+@router.message(F.text == "/warm_photos")
+async def warm_photos(message: Message):
+    """Прогрев кэша фото: загружает все фото меню в служебный чат"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    uploaded = await warm_up_photos(bot, await fetch_catalog())
+    await message.answer(f"🖼 Загружено новых фото: {uploaded}")
+
+
+# Команда для повторной отправки зависших заказов
+@router.message(F.text == "/requeue")
+async def requeue_orders(message: Message):
+    """Отправить неотправленные заказы в Bitrix24 сейчас, не дожидаясь задержки между попытками"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    stuck = order_outbox.stuck()
+    requeued = order_outbox.requeue()
+    lines = [f"🔁 Заказов в очереди на отправку: {requeued}"]
+    lines += [f"⚠️ {key}: попыток {attempts}, ошибка: {error}" for key, attempts, error in stuck]
+    await message.answer("\n".join(lines))
+
+
+async def notify_admins_about_order(key: str, data: dict, attempts: int, error: str):
+    """Уведомление администраторам о заказе, который не уходит в Bitrix24 (см. OutboxWorker.add_alert)"""
+    text = (
+        f"⚠️ Заказ {key} не отправлен в Bitrix24 после {attempts} попыток\n"
+        f"👤 {data.get('name')}, 📞 {data.get('phone')}\n"
+        f"🏠 {data.get('address')}\n"
+        f"Ошибка: {error}\n"
+        f"Попытки продолжаются; /requeue - повторить сейчас"
+    )
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            log.warning("Не удалось уведомить администратора", extra=fields(user=admin_id, error=str(e)))
+
+
+# Команда для просмотра трасс медленных апдейтов
+@router.message(F.text.startswith("/traces"))
+async def show_traces(message: Message):
+    """/traces - последние медленные апдейты, /traces fast - выборка из быстрых"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    slow = "fast" not in message.text
+    recent = traces.recent(slow=slow)
+    title = f"🐢 Медленные апдейты (>{traces.slow_ms:.0f} мс)" if slow else "⚡ Выборка быстрых апдейтов"
+    if not recent:
+        await message.answer(f"{title}\nПока пусто (всего апдейтов: {traces.seen})")
+        return
+    await message.answer(f"{title}, всего апдейтов: {traces.seen}\n\n" + "\n".join(t.format() for t in recent))
@@ -0,0 +1,55 @@
+import time
+from typing import List
+
+from aiogram import Router
+from aiogram.types import (InlineQuery, InlineQueryResultArticle, InlineQueryResultCachedPhoto,
+                           InlineQueryResultPhoto, InputTextMessageContent)
+
+from catalog import Product
+from google_sheets import search_products
+from handlers import product_caption
+from photo_cache import photo_cache
+from telemetry import Histogram, registry
+
+router = Router(name=__name__)
+
+# Telegram показывает не больше 50 результатов; больше 20 в подсказке не нужно
+INLINE_RESULTS_LIMIT = 20
+# Сколько секунд Telegram может отдавать ответ на тот же запрос из своего кэша
+INLINE_CACHE_TIME = 60
+
+inline_latency = registry.register(Histogram(
+    "inline_search_seconds", "Время поиска по меню для inline-запроса",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)))
+
+
+def inline_result(product: Product):
+    """Карточка товара: по file_id, если фото уже загружено в Telegram, иначе по URL"""
+    caption = product_caption(product)
+    file_id = photo_cache.get(product.image_url) if product.image_url else None
+    if file_id:
+        return InlineQueryResultCachedPhoto(
+            id=product.id, photo_file_id=file_id, title=product.name,
+            description=f"{product.price}₽", caption=caption,
+        )
+    if product.image_url:
+        return InlineQueryResultPhoto(
+            id=product.id, photo_url=product.image_url, thumbnail_url=product.image_url,
+            title=product.name, description=f"{product.price}₽", caption=caption,
+        )
+    return InlineQueryResultArticle(
+        id=product.id, title=f"{product.name} — {product.price}₽", description=product.description[:100],
+        input_message_content=InputTextMessageContent(message_text=caption),
+    )
+
+
+@router.inline_query()
+async def search_menu(inline_query: InlineQuery):
+    """Поиск по меню: @bot латте"""
+    started = time.perf_counter()
+    products: List[Product] = await search_products(inline_query.query, INLINE_RESULTS_LIMIT)
+    inline_latency.observe(time.perf_counter() - started)
+    await inline_query.answer(
+        [inline_result(product) for product in products if product.id],
+        cache_time=INLINE_CACHE_TIME,
+    )
@@ -1,34 +1,92 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from google_sheets import get_categories
+from callbacks import CategoryCallback, ProductCallback, ProductPageCallback
+from catalog import MenuCatalog
+from google_sheets import fetch_catalog, menu_snapshot
+from tracing import traced
 
 main = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="Сделать заказ☕")],
                                      [KeyboardButton(text="Мои заказы📃")],
                                      [KeyboardButton(text='О кофейнеℹ️')]])
+# Тексты кнопок главного меню: в шагах оформления их не принимаем за ввод пользователя
+MAIN_MENU_TEXTS = frozenset(button.text for row in main.keyboard for button in row)
 
 
-def create_categories():
-    categories = get_categories()
-    builder = InlineKeyboardBuilder()
-    for category in categories:
-        builder.add(InlineKeyboardButton(text=category, callback_data=f"category_{category}"))
-    builder.adjust(1)
-    keyboard = builder.as_markup()
-    return keyboard
+# Клавиатуры, построенные по меню, живут до смены версии каталога
+_menu_keyboards = {"version": None, "categories": None, "products": {}}
 
 
-def create_products(products):
-    builder = InlineKeyboardBuilder()
-    for product in products:
-        builder.add(InlineKeyboardButton(text=product, callback_data=f"product_{product}"))
-    builder.add(InlineKeyboardButton(text="Назад к категорям⬅", callback_data="return_categories"))
-    builder.adjust(1)
-    keyboard = builder.as_markup()
-    return keyboard
+def _menu_cache(catalog: MenuCatalog) -> dict:
+    if _menu_keyboards["version"] != catalog.version:
+        _menu_keyboards.update(version=catalog.version, categories=None, products={})
+    return _menu_keyboards
 
 
-def create_quantity():
+def reset_menu_keyboards(catalog: MenuCatalog, diff=None):
+    """Подписчик на изменение меню: кнопки содержат версию каталога, поэтому сбрасываем все"""
+    _menu_keyboards.update(version=catalog.version, categories=None, products={})
+
+
+menu_snapshot.add_listener(reset_menu_keyboards)
+
+
+def _build_categories(catalog: MenuCatalog) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for index, category in enumerate(catalog.categories):
+        callback_data = CategoryCallback(v=catalog.version, idx=index).pack()
+        builder.add(InlineKeyboardButton(text=category, callback_data=callback_data))
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def _build_products(catalog: MenuCatalog, category: str, page: int) -> InlineKeyboardMarkup:
+    """Страница товаров категории; листание - кнопками ◀️/▶️ с правкой той же клавиатуры"""
+    version = catalog.version
+    rows = [
+        [InlineKeyboardButton(text=product.name, callback_data=ProductCallback(v=version, id=product.id).pack())]
+        for product in catalog.products_page(category, page)
+    ]
+    pages = catalog.page_count(category)
+    if pages > 1:
+        idx = catalog.categories.index(category)
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(
+                text="◀️", callback_data=ProductPageCallback(v=version, idx=idx, page=page - 1).pack()))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(
+                text="▶️", callback_data=ProductPageCallback(v=version, idx=idx, page=page + 1).pack()))
+        rows.append(navigation)
+    rows.append([InlineKeyboardButton(text="Назад к категорям⬅", callback_data="return_categories")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@traced("keyboard")
+async def create_categories():
+    catalog = await fetch_catalog()
+    cache = _menu_cache(catalog)
+    if cache["categories"] is None:
+        cache["categories"] = _build_categories(catalog)
+    return cache["categories"]
+
+
+@traced("keyboard")
+async def create_products(category, page: int = 0):
+    catalog = await fetch_catalog()
+    products = _menu_cache(catalog)["products"]
+    if category not in catalog.by_category or not 0 <= page < catalog.page_count(category):
+        # Категория или страница из старого меню: не кэшируем, чтобы не копить мусор
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Назад к категорям⬅", callback_data="return_categories")]])
+    key = (category, page)
+    if key not in products:
+        products[key] = _build_products(catalog, category, page)
+    return products[key]
+
+
+def _build_quantity():
     builder = InlineKeyboardBuilder()
     for i in range(10):
         if i != 0:
@@ -39,7 +97,7 @@ def create_quantity():
     return keyboard
 
 
-def cart_menu():
+def _build_cart_menu():
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="➕Добавить еще", callback_data="add_more"))
     builder.add(InlineKeyboardButton(text='🛒Моя корзина', callback_data="show_cart"))
@@ -49,19 +107,19 @@ def cart_menu():
     return keyboard
 
 
-def create_cart_buttons(products):
+def create_cart_buttons(lines):
     buttons = []
-    for i, p in enumerate(products):
+    for line in lines:
         buttons.append([
-            InlineKeyboardButton(text=f"❌ Удалить {p['name']}", callback_data=f"remove_{i}"),
-            InlineKeyboardButton(text="✏ Кол-во", callback_data=f"editqty_{i}")
+            InlineKeyboardButton(text=f"❌ Удалить {line.name}", callback_data=f"remove_{line.product_id}"),
+            InlineKeyboardButton(text="✏ Кол-во", callback_data=f"editqty_{line.product_id}")
         ])
     buttons.append([InlineKeyboardButton(text="🗑 Очистить корзину", callback_data="clear_cart")])
     buttons.append([InlineKeyboardButton(text="⬅ Назад", callback_data="show_cart_summary")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def back_to_cart():
+def _build_back_to_cart():
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="🛒Вернуться в корзину", callback_data="show_cart"))
     builder.adjust(1)
@@ -69,17 +127,61 @@ def back_to_cart():
     return keyboard
 
 
-def return_to_cart_summary():
+def _build_return_to_cart_summary():
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="⬅Назад", callback_data="show_cart_summary"))
     keyboard = builder.as_markup()
     return keyboard
 
 
+def _build_empty_cart():
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="➕Добавить товары", callback_data="add_more"))
+    return builder.as_markup()
+
+
+# Статичные клавиатуры строятся один раз при импорте
+QUANTITY = _build_quantity()
+CART_MENU = _build_cart_menu()
+BACK_TO_CART = _build_back_to_cart()
+RETURN_TO_CART_SUMMARY = _build_return_to_cart_summary()
+EMPTY_CART = _build_empty_cart()
+CONFIRM_ORDER_MENU = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Подтвердить заказ", callback_data="confirm_order")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="show_cart_summary")]
+    ]
+)
+
+
+def orders_pagination(page: int, has_next: bool):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="⬅ Новее", callback_data=f"orders_page_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Старее ➡", callback_data=f"orders_page_{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def create_quantity():
+    return QUANTITY
+
+
+def cart_menu():
+    return CART_MENU
+
+
+def empty_cart():
+    return EMPTY_CART
+
+
+def back_to_cart():
+    return BACK_TO_CART
+
+
+def return_to_cart_summary():
+    return RETURN_TO_CART_SUMMARY
+
+
 def confirm_order_menu():
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Подтвердить заказ", callback_data="confirm_order")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="show_cart_summary")]
-        ]
-    )
+    return CONFIRM_ORDER_MENU
@@ -1,11 +1,166 @@
 import asyncio
+import multiprocessing
+import os
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
 from bot import bot, dp  # Импортируем бот и диспетчер
-from handlers import router
+from handlers import notify_admins_about_order, router
+from inline import router as inline_router
+from google_sheets import menu_snapshot
+from crm import bitrix
+from outbox import outbox_worker
+from orders import order_reconciler
+from photo_cache import warm_up_photos
+from send_scheduler import send_scheduler
+from middlewares import BotApiTracingMiddleware, MetricsMiddleware, ThrottlingMiddleware, TracingMiddleware
+from ratelimit import limiters
+from sessions import ProcessLocks
+from telemetry import METRICS_PATH, metrics_view, setup_logging, start_metrics_server
+
+# Режим запуска: polling (по умолчанию) или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+# Публичный HTTPS-адрес, на который Telegram будет слать обновления, например https://bot.example.com
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Сколько процессов слушают один порт (SO_REUSEPORT); состояние FSM у них общее в SQLite
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+WEBHOOK_KEEPALIVE = float(os.getenv("WEBHOOK_KEEPALIVE", "75"))
+# Сколько процессов обрабатывают апдейты бота
+WORKERS = WEBHOOK_WORKERS if RUN_MODE == "webhook" else 1
+
+background_tasks = []
+metrics_runner = None
+# Номер текущего воркера вебхука; фоновые задачи выполняет только нулевой
+worker_index = 0
+
+
+async def on_startup():
+    global metrics_runner
+    if WORKERS > 1:
+        # Квоты Bitrix24 и Telegram общие на всех: каждому воркеру достаётся своя доля.
+        # В Google Sheets ходит только нулевой воркер, его лимит не делится
+        limiters["bitrix"].share(WORKERS)
+        send_scheduler.share(WORKERS)
+    if worker_index != 0:
+        # Остальные воркеры только отвечают пользователям, меню читают из снимка нулевого
+        menu_snapshot.follow()
+        return
+
+    # В режиме webhook метрики отдаёт сервер вебхука (см. create_webhook_app)
+    if RUN_MODE != "webhook":
+        metrics_runner = await start_metrics_server()
+    # После каждого изменения меню заранее загружаем новые фото, чтобы карточки открывались по file_id
+    menu_snapshot.add_listener(lambda catalog, diff: warm_up_photos(bot, catalog))
+    # Фоновое обновление снимка меню (stale-while-revalidate)
+    background_tasks.append(asyncio.create_task(menu_snapshot.run_refresher()))
+    # Фоновая отправка заказов из очереди в Bitrix24; о зависших заказах узнают администраторы
+    outbox_worker.add_alert(notify_admins_about_order)
+    outbox_worker.start()
+    # Фоновая сверка истории заказов с Bitrix24 (ID лидов и статусы)
+    background_tasks.append(asyncio.create_task(order_reconciler.run()))
+
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await outbox_worker.stop()
+    await bitrix.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+setup_logging()
+dp.update.outer_middleware(MetricsMiddleware())
+# Трассы на уровне роутера: время хендлера с разбивкой по хранилищу, Sheets, клавиатурам, Bot API и CRM
+router.message.outer_middleware(TracingMiddleware())
+router.callback_query.outer_middleware(TracingMiddleware())
+bot.session.middleware(BotApiTracingMiddleware())
+# Все отправки и правки сообщений проходят через очередь с лимитами Telegram
+bot.session.middleware(send_scheduler)
+# Повторные нажатия, лимит частоты и последовательная обработка апдейтов одного пользователя.
+# Апдейты одного пользователя могут попасть в разные воркеры вебхука - тогда блокировка общая через файл
+user_locks = ProcessLocks() if WORKERS > 1 else None
+router.message.outer_middleware(ThrottlingMiddleware(process_locks=user_locks))
+router.callback_query.outer_middleware(ThrottlingMiddleware(process_locks=user_locks))
+dp.include_router(router)
+dp.include_router(inline_router)
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
 
 
 async def main():
-    dp.include_router(router)
     await dp.start_polling(bot)  # Запускаем бота
 
+
+def create_webhook_app() -> web.Application:
+    app = web.Application()
+    # handle_in_background: Telegram сразу получает 200, обновление обрабатывается отдельной задачей
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+    # При нескольких воркерах запрос попадает в один из них: у каждого свой реестр метрик,
+    # поэтому Prometheus видит долю трафика одного воркера, а не сумму
+    app.router.add_get(METRICS_PATH, metrics_view)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def run_webhook_worker(index: int = 0):
+    global worker_index
+    worker_index = index
+    web.run_app(
+        create_webhook_app(),
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        keepalive_timeout=WEBHOOK_KEEPALIVE,
+        reuse_port=WEBHOOK_WORKERS > 1,
+        print=None,
+    )
+
+
+async def set_webhook():
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        drop_pending_updates=False,
+    )
+    await bot.session.close()
+
+
+def run_webhook():
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для RUN_MODE=webhook укажите WEBHOOK_BASE_URL")
+
+    # Вебхук регистрируем один раз, до запуска воркеров
+    asyncio.run(set_webhook())
+    if WEBHOOK_WORKERS <= 1:
+        run_webhook_worker()
+        return
+
+    # spawn: каждый воркер заново открывает свои соединения (SQLite, HTTP-сессии)
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_webhook_worker, args=(index,)) for index in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if RUN_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,130 @@
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from sessions import ProcessLocks, user_sessions
+from telemetry import handler_errors, handler_latency, throttled_updates
+from tracing import span, trace_update
+
+_CALLBACK_KIND = re.compile(r"[A-Za-z]+")
+# Повторное нажатие той же кнопки на том же сообщении в пределах окна считается дублем
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "1.0"))
+
+
+def event_kind(event: TelegramObject) -> str:
+    """Тип события для меток метрик и имён трасс. Значения ограничены, чтобы не плодить серии"""
+    if isinstance(event, CallbackQuery):
+        match = _CALLBACK_KIND.match(event.data or "")
+        return f"callback:{match.group(0) if match else 'other'}"
+    if isinstance(event, Message):
+        if event.text and event.text.startswith("/"):
+            return "command"
+        if event.contact is not None:
+            return "contact"
+        return "text" if event.text else "other"
+    return "other"
+
+
+def update_kind(update: Update) -> str:
+    return event_kind(update.event)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработки каждого апдейта и число исключений по типу события"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = {"event": event.event_type, "kind": update_kind(event)}
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(**labels)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, **labels)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Трасса на каждое событие роутера: общее время и разбивка по span (см. tracing.py)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        with trace_update(event_kind(event), user.id if user else None):
+            return await handler(event, data)
+
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Span для каждого вызова Telegram Bot API внутри трассы апдейта"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Защита от частых и повторных нажатий.
+
+    - одинаковый callback на том же сообщении в течение DEDUP_WINDOW отбрасывается;
+    - на пользователя действует token bucket (USER_RATE/USER_BURST);
+    - обработчики одного пользователя не выполняются параллельно (per-user lock);
+      с process_locks - и в разных процессах, когда апдейты делят несколько воркеров вебхука.
+    """
+
+    def __init__(self, dedup_window: float = DEDUP_WINDOW, process_locks: Optional[ProcessLocks] = None):
+        self.dedup_window = dedup_window
+        self.process_locks = process_locks
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        session = user_sessions.get(user.id)
+
+        if isinstance(event, CallbackQuery):
+            now = time.monotonic()
+            message_id = event.message.message_id if event.message else 0
+            last = session.last_callback
+            if last and last[0] == event.data and last[1] == message_id and now - last[2] < self.dedup_window:
+                throttled_updates.inc(reason="duplicate")
+                await event.answer()
+                return None
+            session.last_callback = (event.data, message_id, now)
+
+        if not session.bucket.try_acquire():
+            throttled_updates.inc(reason="rate")
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Слишком часто, подождите секунду")
+            return None
+
+        async with session.lock:
+            if self.process_locks is None:
+                return await handler(event, data)
+            async with self.process_locks.hold(user.id):
+                return await handler(event, data)
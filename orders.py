@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from crm import ORIGINATOR_ID, BitrixClient, bitrix
+from outbox import Outbox, order_outbox
+from ratelimit import PRIORITY_BACKGROUND
+from telemetry import fields, get_logger
+
+log = get_logger("orders")
+
+ORDERS_DB = os.getenv("ORDERS_DB", "orders.sqlite3")
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "5"))
+# Сколько пользователей держим в LRU-кэше истории
+ORDERS_CACHE_USERS = int(os.getenv("ORDERS_CACHE_USERS", "1000"))
+# Как часто сверять заказы с Bitrix24 (секунды)
+ORDERS_RECONCILE_INTERVAL = float(os.getenv("ORDERS_RECONCILE_INTERVAL", "300"))
+# Сколько заказов без ID лида проверяем за один цикл сверки
+ORDERS_RECONCILE_BATCH = 500
+# Статусы лида, после которых заказ больше не сверяем
+FINAL_STATUSES = ("CONVERTED", "JUNK")
+# crm.lead.list отдаёт не больше 50 записей за запрос
+BITRIX_LIST_LIMIT = 50
+
+
+class Order(NamedTuple):
+    key: str
+    telegram_id: int
+    created_at: float
+    total: int
+    items: List[List]  # [название, количество, цена]
+    lead_id: Optional[int]
+    status: str
+
+
+class OrderStore:
+    """Локальная история заказов, индексированная по telegram_id и времени.
+
+    История отдаётся отсюда постранично через LRU-кэш и никогда не ходит в CRM.
+    """
+
+    def __init__(self, path: str, cache_users: int = ORDERS_CACHE_USERS):
+        self.path = path
+        self.cache_users = cache_users
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                key TEXT PRIMARY KEY,
+                telegram_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                total INTEGER NOT NULL,
+                items TEXT NOT NULL,
+                lead_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'NEW',
+                lead_checked_at REAL
+            )
+        """)
+        # Базы, созданные до появления lead_checked_at
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(orders)")}
+        if "lead_checked_at" not in columns:
+            self.conn.execute("ALTER TABLE orders ADD COLUMN lead_checked_at REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS orders_user_time ON orders (telegram_id, created_at DESC)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS orders_time ON orders (created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS orders_without_lead ON orders (lead_checked_at, created_at) "
+                          "WHERE lead_id IS NULL")
+        # telegram_id -> {номер страницы: (заказы, есть ли следующая)}
+        self._cache: "OrderedDict[int, Dict[int, Tuple[List[Order], bool]]]" = OrderedDict()
+
+    def add(self, key: str, telegram_id: int, total: int, items: List[List]):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO orders (key, telegram_id, created_at, total, items) VALUES (?, ?, ?, ?, ?)",
+            (key, telegram_id, time.time(), total, json.dumps(items, ensure_ascii=False)),
+        )
+        self._cache.pop(telegram_id, None)
+
+    def page(self, telegram_id: int, page: int, page_size: int = ORDERS_PAGE_SIZE) -> Tuple[List[Order], bool]:
+        """Страница истории пользователя (новые сверху) и признак наличия следующей"""
+        pages = self._cache.get(telegram_id)
+        if pages is not None and page in pages:
+            self._cache.move_to_end(telegram_id)
+            return pages[page]
+
+        rows = self.conn.execute(
+            "SELECT key, telegram_id, created_at, total, items, lead_id, status FROM orders "
+            "WHERE telegram_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (telegram_id, page_size + 1, page * page_size),
+        ).fetchall()
+        orders = [self._order(row) for row in rows[:page_size]]
+        result = (orders, len(rows) > page_size)
+
+        self._cache.setdefault(telegram_id, {})[page] = result
+        self._cache.move_to_end(telegram_id)
+        while len(self._cache) > self.cache_users:
+            self._cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _order(row) -> Order:
+        key, telegram_id, created_at, total, items, lead_id, status = row
+        return Order(key, telegram_id, created_at, total, json.loads(items), lead_id, status)
+
+    def without_lead(self, limit: int = ORDERS_RECONCILE_BATCH) -> List[str]:
+        """Заказы без ID лида: сначала ни разу не проверенные, затем те, что проверялись давнее всего.
+
+        Заказы, для которых лид так и не нашёлся, уходят в конец очереди и не заслоняют новые.
+        """
+        rows = self.conn.execute(
+            "SELECT key FROM orders WHERE lead_id IS NULL ORDER BY lead_checked_at, created_at LIMIT ?", (limit,)
+        ).fetchall()
+        return [key for key, in rows]
+
+    def mark_lead_checked(self, keys: List[str]):
+        if not keys:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE orders SET lead_checked_at = ? WHERE key = ?",
+                [(now, key) for key in keys],
+            )
+
+    def open_leads(self, limit: int = 500) -> List[int]:
+        placeholders = ", ".join("?" for _ in FINAL_STATUSES)
+        rows = self.conn.execute(
+            f"SELECT lead_id FROM orders WHERE lead_id IS NOT NULL AND status NOT IN ({placeholders}) "
+            f"ORDER BY created_at DESC LIMIT ?",
+            (*FINAL_STATUSES, limit),
+        ).fetchall()
+        return [lead_id for lead_id, in rows]
+
+    def set_lead_ids(self, lead_ids: Dict[str, int]):
+        if not lead_ids:
+            return
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE orders SET lead_id = ? WHERE key = ?",
+                [(lead_id, key) for key, lead_id in lead_ids.items()],
+            )
+        self._cache.clear()
+
+    def set_statuses(self, statuses: Dict[int, str]):
+        if not statuses:
+            return
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE orders SET status = ? WHERE lead_id = ?",
+                [(status, lead_id) for lead_id, status in statuses.items()],
+            )
+        self._cache.clear()
+
+    def close(self):
+        self.conn.close()
+
+
+class OrderReconciler:
+    """Фоновая задача: пачками подтягивает ID лидов и их статусы из Bitrix24 в локальную историю"""
+
+    def __init__(self, store: OrderStore, outbox: Outbox, client: BitrixClient,
+                 interval: float = ORDERS_RECONCILE_INTERVAL, batch: int = ORDERS_RECONCILE_BATCH):
+        self.store = store
+        self.outbox = outbox
+        self.client = client
+        self.interval = interval
+        self.batch = batch
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                log.error("Ошибка сверки заказов с Bitrix24", extra=fields(error=str(e)))
+            await asyncio.sleep(self.interval)
+
+    async def reconcile(self):
+        keys = self.store.without_lead(self.batch)
+        if keys:
+            # Сначала то, что уже знает очередь отправки, затем поиск в Bitrix24 по ORIGIN_ID
+            known = self.outbox.lead_ids(keys)
+            self.store.set_lead_ids(known)
+            # Заказ, который ещё в очереди, она найдёт в Bitrix24 по ORIGIN_ID сама при следующей попытке
+            queued = self.outbox.undelivered(keys)
+            missing = [key for key in keys if key not in known and key not in queued]
+            found = {}
+            for chunk in _chunks(missing, BITRIX_LIST_LIMIT):
+                leads = await self._list_leads({"ORIGINATOR_ID": ORIGINATOR_ID, "@ORIGIN_ID": chunk},
+                                               ["ID", "ORIGIN_ID", "STATUS_ID"])
+                found.update({lead["ORIGIN_ID"]: int(lead["ID"]) for lead in leads})
+            self.store.set_lead_ids(found)
+            self.store.mark_lead_checked([key for key in keys if key not in known and key not in found])
+
+        statuses = {}
+        for chunk in _chunks(self.store.open_leads(), BITRIX_LIST_LIMIT):
+            leads = await self._list_leads({"@ID": chunk}, ["ID", "STATUS_ID"])
+            statuses.update({int(lead["ID"]): lead["STATUS_ID"] for lead in leads})
+        self.store.set_statuses(statuses)
+
+    async def _list_leads(self, lead_filter: Dict, select: List[str]) -> List[Dict]:
+        result = await self.client.call("crm.lead.list", {"filter": lead_filter, "select": select},
+                                        priority=PRIORITY_BACKGROUND)
+        if result is None:
+            raise ConnectionError("Bitrix24 недоступен")
+        return result.get("result") or []
+
+
+def _chunks(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+order_store = OrderStore(ORDERS_DB)
+order_reconciler = OrderReconciler(order_store, order_outbox, bitrix)
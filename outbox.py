@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from crm import BitrixClient, LeadAggregator, bitrix, lead_aggregator
+from telemetry import fields, get_logger
+
+log = get_logger("outbox")
+
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.sqlite3")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+# После стольких неудачных попыток подряд (и каждых следующих стольких же) заказ считается
+# зависшим: очередь продолжает его отправлять, а администраторы получают уведомление
+OUTBOX_ALERT_ATTEMPTS = int(os.getenv("OUTBOX_ALERT_ATTEMPTS", "10"))
+# Сколько заказов воркер забирает за раз (они уходят в Bitrix24 общим batch)
+OUTBOX_CLAIM_LIMIT = int(os.getenv("OUTBOX_CLAIM_LIMIT", "25"))
+
+# Экспоненциальная задержка между попытками: 2, 4, 8 ... но не больше 10 минут
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 600.0
+# Заказ в статусе 'sending' дольше этого времени считается брошенным (процесс упал)
+SENDING_LEASE = 300.0
+
+
+class Outbox:
+    """Надёжная очередь заказов в SQLite.
+
+    Заказ записывается на диск до ответа пользователю и переживает перезапуск бота.
+    Ключ заказа служит ключом идемпотентности: он уходит в Bitrix24 как ORIGIN_ID лида.
+    Подтверждённый заказ очередь не бросает: попытки повторяются, пока лид не создастся.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lead_id INTEGER,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self.new_order = asyncio.Event()
+
+    def put(self, data: Dict, key: Optional[str] = None) -> str:
+        """Сохраняет заказ в очередь и возвращает его ключ"""
+        key = key or uuid.uuid4().hex
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR IGNORE INTO outbox (key, payload, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(data, ensure_ascii=False), now, now, now),
+        )
+        self.new_order.set()
+        return key
+
+    def claim(self, limit: int = 1) -> List[Tuple[str, Dict, int]]:
+        """Забирает готовые к отправке заказы, помечая их 'sending'"""
+        now = time.time()
+        rows = self.conn.execute(
+            "UPDATE outbox SET status = 'sending', updated_at = ? "
+            "WHERE key IN (SELECT key FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?) "
+            "RETURNING key, payload, attempts",
+            (now, now, limit),
+        ).fetchall()
+        return [(key, json.loads(payload), attempts) for key, payload, attempts in rows]
+
+    def mark_done(self, key: str, lead_id: int):
+        self.conn.execute(
+            "UPDATE outbox SET status = 'done', lead_id = ?, last_error = NULL, updated_at = ? WHERE key = ?",
+            (lead_id, time.time(), key),
+        )
+
+    def mark_retry(self, key: str, attempts: int, error: str) -> int:
+        """Планирует повторную попытку с экспоненциальной задержкой (не больше BACKOFF_MAX).
+
+        Возвращает число сделанных попыток.
+        """
+        attempts += 1
+        now = time.time()
+        delay = min(BACKOFF_BASE ** attempts, BACKOFF_MAX)
+        self.conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+            "WHERE key = ?",
+            (attempts, now + delay * random.uniform(0.8, 1.2), error, now, key),
+        )
+        return attempts
+
+    def requeue(self) -> int:
+        """Отправить неотправленные заказы прямо сейчас, не дожидаясь задержки.
+
+        Заодно возвращает в очередь заказы 'failed', брошенные прежними версиями бота.
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE outbox SET status = 'pending', next_attempt_at = ?, updated_at = ? "
+            "WHERE status IN ('pending', 'failed')",
+            (now, now),
+        )
+        if cursor.rowcount:
+            self.new_order.set()
+        return cursor.rowcount
+
+    def stuck(self) -> List[Tuple[str, int, Optional[str]]]:
+        """Заказы, которые не уходят в Bitrix24 OUTBOX_ALERT_ATTEMPTS попыток и больше"""
+        return self.conn.execute(
+            "SELECT key, attempts, last_error FROM outbox WHERE status != 'done' AND attempts >= ? "
+            "ORDER BY created_at",
+            (OUTBOX_ALERT_ATTEMPTS,),
+        ).fetchall()
+
+    def recover(self) -> int:
+        """Возвращает в очередь заказы, зависшие в 'sending' после падения процесса.
+
+        Брошенная отправка считается попыткой: лид мог успеть создаться, поэтому повтор
+        сначала ищет его по ORIGIN_ID.
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, updated_at = ? "
+            "WHERE status = 'sending' AND updated_at <= ?",
+            (now, now, now - SENDING_LEASE),
+        )
+        return cursor.rowcount
+
+    def lead_ids(self, keys: List[str]) -> Dict[str, int]:
+        """ID лидов для уже отправленных заказов"""
+        if not keys:
+            return {}
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self.conn.execute(
+            f"SELECT key, lead_id FROM outbox WHERE status = 'done' AND key IN ({placeholders})", keys
+        ).fetchall()
+        return dict(rows)
+
+    def undelivered(self, keys: List[str]) -> Set[str]:
+        """Заказы, которые ещё в очереди: лид для них ищет и создаёт сама очередь"""
+        if not keys:
+            return set()
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self.conn.execute(
+            f"SELECT key FROM outbox WHERE status != 'done' AND key IN ({placeholders})", keys
+        ).fetchall()
+        return {key for key, in rows}
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class OutboxWorker:
+    """Пул фоновых задач, которые отправляют заказы из очереди в Bitrix24"""
+
+    def __init__(self, outbox: Outbox, client: BitrixClient, aggregator: LeadAggregator,
+                 concurrency: int = OUTBOX_WORKERS, poll_interval: float = 1.0):
+        self.outbox = outbox
+        self.client = client
+        self.aggregator = aggregator
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._alerts: List[Callable] = []
+
+    def add_alert(self, callback):
+        """Подписка на зависший заказ: callback(key, data, attempts, error) - корутина.
+
+        Вызывается после OUTBOX_ALERT_ATTEMPTS неудачных попыток подряд и затем после каждых
+        следующих OUTBOX_ALERT_ATTEMPTS, пока заказ не уйдёт.
+        """
+        self._alerts.append(callback)
+
+    def start(self):
+        self.outbox.recover()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            claimed = self.outbox.claim(OUTBOX_CLAIM_LIMIT)
+            if not claimed:
+                # Заказы, брошенные упавшим процессом, возвращаются в очередь, как только истечёт
+                # SENDING_LEASE, - не дожидаясь следующего перезапуска
+                recovered = self.outbox.recover()
+                if recovered:
+                    log.warning("Зависшие заказы возвращены в очередь", extra=fields(orders=recovered))
+                    continue
+                self.outbox.new_order.clear()
+                try:
+                    await asyncio.wait_for(self.outbox.new_order.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Заказы отправляются параллельно, агрегатор объединит их в общий batch
+            await asyncio.gather(*(self._deliver(key, data, attempts) for key, data, attempts in claimed))
+
+    async def _deliver(self, key: str, data: Dict, attempts: int):
+        error = "lead was not created"
+        try:
+            lead_id = None
+            if attempts:
+                # Предыдущая попытка могла создать лид, но ответ потерялся
+                lead_id = await self.client.find_lead_by_origin(key)
+            if lead_id is None:
+                lead_id = await self.aggregator.submit({**data, "order_key": key})
+        except Exception as e:
+            lead_id = None
+            error = str(e) or type(e).__name__
+            log.error("Ошибка отправки заказа", extra=fields(order=key, error=error))
+
+        if lead_id:
+            self.outbox.mark_done(key, lead_id)
+            log.info("Заказ отправлен в Bitrix24", extra=fields(order=key, lead_id=lead_id))
+        else:
+            attempts = self.outbox.mark_retry(key, attempts, error)
+            log.warning("Заказ не отправлен, повторим позже", extra=fields(order=key, attempt=attempts))
+            if attempts % OUTBOX_ALERT_ATTEMPTS == 0:
+                await self._alert(key, data, attempts, error)
+
+    async def _alert(self, key: str, data: Dict, attempts: int, error: str):
+        log.error("Заказ не уходит в Bitrix24", extra=fields(order=key, attempts=attempts, error=error))
+        for callback in self._alerts:
+            try:
+                await callback(key, data, attempts, error)
+            except Exception:
+                log.exception("Ошибка уведомления о зависшем заказе")
+
+
+order_outbox = Outbox(OUTBOX_DB)
+outbox_worker = OutboxWorker(order_outbox, bitrix, lead_aggregator)
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional
+
+from aiogram import Bot
+
+from catalog import MenuCatalog
+from ratelimit import PRIORITY_BACKGROUND
+from send_scheduler import send_priority
+from telemetry import fields, get_logger
+
+log = get_logger("photos")
+
+PHOTO_CACHE_DB = os.getenv("PHOTO_CACHE_DB", "photos.sqlite3")
+# Служебный чат, куда бот заранее загружает фото меню (например, закрытый канал с ботом-админом)
+PHOTO_CACHE_CHAT_ID = os.getenv("PHOTO_CACHE_CHAT_ID")
+# Ответы Telegram, по которым видно, что сохранённый file_id больше не годится
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file", "wrong file_id", "wrong padding")
+
+
+def is_file_id_error(error: Exception) -> bool:
+    """Ошибка именно в file_id (а не, например, "message to edit not found" или длинная подпись)"""
+    message = str(error).lower()
+    return any(marker in message for marker in FILE_ID_ERRORS)
+
+
+class PhotoCache:
+    """Постоянный кэш: URL картинки из таблицы -> file_id в Telegram.
+
+    Повторная отправка по file_id не заставляет Telegram снова скачивать картинку.
+    Ключ - сам URL, поэтому смена ссылки в таблице автоматически даёт промах.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS photos (
+                url TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._file_ids: Dict[str, str] = dict(self.conn.execute("SELECT url, file_id FROM photos").fetchall())
+
+    def get(self, url: str) -> Optional[str]:
+        return self._file_ids.get(url)
+
+    def put(self, url: str, file_id: str):
+        if self._file_ids.get(url) == file_id:
+            return
+        self._file_ids[url] = file_id
+        self.conn.execute(
+            "INSERT INTO photos (url, file_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET file_id = excluded.file_id, updated_at = excluded.updated_at",
+            (url, file_id, time.time()),
+        )
+
+    def forget(self, url: str):
+        self._file_ids.pop(url, None)
+        self.conn.execute("DELETE FROM photos WHERE url = ?", (url,))
+
+    def __len__(self) -> int:
+        return len(self._file_ids)
+
+    def prune(self, urls: Iterable[str]):
+        """Удаляет записи для картинок, которых больше нет в меню"""
+        keep = set(urls)
+        for url in [url for url in self._file_ids if url not in keep]:
+            self.forget(url)
+
+
+def menu_photo_urls(catalog: MenuCatalog):
+    return {product.image_url for product in catalog.by_id.values() if product.image_url}
+
+
+async def warm_up_photos(bot: Bot, catalog: MenuCatalog, chat_id=PHOTO_CACHE_CHAT_ID) -> int:
+    """Заранее загружает фото меню в служебный чат и запоминает их file_id"""
+    urls = menu_photo_urls(catalog)
+    photo_cache.prune(urls)
+    if not chat_id:
+        return 0
+
+    uploaded = 0
+    # Темп задаёт очередь отправки: прогрев идёт с низким приоритетом и не мешает ответам пользователям
+    with send_priority(PRIORITY_BACKGROUND):
+        for url in sorted(urls):
+            if photo_cache.get(url):
+                continue
+            try:
+                message = await bot.send_photo(chat_id, photo=url, disable_notification=True)
+                photo_cache.put(url, message.photo[-1].file_id)
+                uploaded += 1
+                await bot.delete_message(chat_id, message.message_id)
+            except Exception as e:
+                log.warning("Не удалось загрузить фото", extra=fields(url=url, error=str(e)))
+
+    log.info("Прогрев фото меню", extra=fields(uploaded=uploaded, cached=len(photo_cache)))
+    return uploaded
+
+
+photo_cache = PhotoCache(PHOTO_CACHE_DB)
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from telemetry import Gauge, registry
+
+# Чем меньше число, тем раньше вызов пройдёт через очередь
+PRIORITY_ORDER = 0  # оформление заказа
+PRIORITY_DEFAULT = 5  # меню, история и прочие пользовательские запросы
+PRIORITY_DIAGNOSTIC = 10  # проверки и отладка (test_bitrix_connection, check_lead_products)
+PRIORITY_BACKGROUND = 20  # фоновая сверка истории заказов
+
+
+class TokenBucket:
+    """Клиентский ограничитель частоты запросов (token bucket) с приоритетной очередью.
+
+    Запросы, которым не хватило токена, ждут в куче по приоритету, поэтому заказы
+    обгоняют диагностику. Дополнительно ограничивается число одновременных запросов.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float, max_concurrency: Optional[int] = None):
+        self.name = name
+        self.rate = rate  # токенов в секунду
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        self._concurrency = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.in_flight = 0
+        self.stats = {
+            "acquired": 0,
+            "waited": 0,
+            "total_wait_s": 0.0,
+            "max_wait_s": 0.0,
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, cost: float = 1) -> bool:
+        """Забирает токен без ожидания; False, если токенов нет"""
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def _record(self, waited: float):
+        self.stats["acquired"] += 1
+        if waited > 0:
+            self.stats["waited"] += 1
+            self.stats["total_wait_s"] += waited
+            self.stats["max_wait_s"] = max(self.stats["max_wait_s"], waited)
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT, cost: float = 1):
+        """Ждёт токен; при нехватке встаёт в очередь согласно приоритету"""
+        if not self._waiters and self.try_acquire(cost):
+            self._record(0)
+            return
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), cost, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен уже выдан, но ждать его некому - возвращаем
+                self.tokens = min(self.capacity, self.tokens + cost)
+            raise
+        self._record(time.monotonic() - started)
+
+    async def _pump(self):
+        while self._waiters:
+            # Отменённые ожидания просто выбрасываем
+            while self._waiters and self._waiters[0][3].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                break
+
+            _, _, cost, future = self._waiters[0]
+            self._refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+                continue
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_DEFAULT, cost: float = 1):
+        """Токен плюс место среди одновременно выполняющихся запросов"""
+        await self.acquire(priority, cost)
+        if self._concurrency is None:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+            return
+
+        async with self._concurrency:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def defer(self, seconds: float):
+        """Долг в токенах: следующий токен будет выдан не раньше чем через seconds секунд"""
+        self._refill()
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+    def share(self, workers: int):
+        """Оставляет процессу 1/workers лимита, когда одну квоту делят несколько процессов"""
+        self.rate /= workers
+        self.capacity = max(self.capacity / workers, 1)
+        self.tokens = min(self.tokens, self.capacity)
+        if self._concurrency is not None:
+            self._concurrency = asyncio.Semaphore(max(1, self._concurrency._value // workers))
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats["queue_depth"] = self.queue_depth
+        stats["in_flight"] = self.in_flight
+        stats["avg_wait_s"] = stats["total_wait_s"] / stats["waited"] if stats["waited"] else 0.0
+        return stats
+
+
+# Настройки по умолчанию: вебхук Bitrix24 ~2 запроса в секунду, Sheets API - квота на чтение в минуту
+limiters: Dict[str, TokenBucket] = {
+    "bitrix": TokenBucket(
+        "bitrix",
+        rate=float(os.getenv("BITRIX_RPS", "2")),
+        capacity=float(os.getenv("BITRIX_BURST", "2")),
+        max_concurrency=int(os.getenv("BITRIX_CONCURRENCY", "2")),
+    ),
+    "sheets": TokenBucket(
+        "sheets",
+        rate=float(os.getenv("SHEETS_RPM", "60")) / 60,
+        capacity=float(os.getenv("SHEETS_BURST", "5")),
+        max_concurrency=int(os.getenv("SHEETS_WORKERS", "2")),
+    ),
+}
+
+limiter_queue_depth = registry.register(Gauge(
+    "rate_limiter_queue_depth", "Запросы, ждущие токена ограничителя", ["limiter"]))
+limiter_in_flight = registry.register(Gauge(
+    "rate_limiter_in_flight", "Выполняющиеся запросы через ограничитель", ["limiter"]))
+limiter_acquired = registry.register(Gauge(
+    "rate_limiter_acquired", "Выданные токены с запуска процесса", ["limiter"]))
+limiter_waited = registry.register(Gauge(
+    "rate_limiter_waited", "Выдачи токена, которым пришлось ждать в очереди", ["limiter"]))
+limiter_wait_avg = registry.register(Gauge(
+    "rate_limiter_wait_avg_seconds", "Среднее ожидание токена среди ждавших", ["limiter"]))
+limiter_wait_max = registry.register(Gauge(
+    "rate_limiter_wait_max_seconds", "Максимальное ожидание токена", ["limiter"]))
+
+
+def _collect_limiters():
+    for name, limiter in limiters.items():
+        stats = limiter.get_stats()
+        limiter_queue_depth.set(stats["queue_depth"], limiter=name)
+        limiter_in_flight.set(stats["in_flight"], limiter=name)
+        limiter_acquired.set(stats["acquired"], limiter=name)
+        limiter_waited.set(stats["waited"], limiter=name)
+        limiter_wait_avg.set(stats["avg_wait_s"], limiter=name)
+        limiter_wait_max.set(stats["max_wait_s"], limiter=name)
+
+
+registry.add_collector(_collect_limiters)
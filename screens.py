@@ -0,0 +1,116 @@
+import hashlib
+from typing import Optional, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InputMediaPhoto, Message
+
+from bot import bot
+from photo_cache import is_file_id_error, photo_cache
+from sessions import user_sessions
+from telemetry import Counter, fields, get_logger, registry
+
+log = get_logger("screens")
+
+screen_updates = registry.register(Counter(
+    "bot_screen_updates_total", "Обновления экрана пользователя: edit, send или skip (ничего не изменилось)",
+    ["action"]))
+
+Markup = Optional[InlineKeyboardMarkup]
+
+
+def _digest(text: str, photo: Optional[str], reply_markup) -> str:
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ""
+    return hashlib.blake2b(f"{photo}\0{text}\0{markup}".encode(), digest_size=8).hexdigest()
+
+
+async def show_screen(target: Union[Message, CallbackQuery], text: str, reply_markup=None,
+                      photo: Optional[str] = None) -> Optional[Message]:
+    """Показывает экран пользователю, по возможности правя уже отправленное сообщение.
+
+    Для нажатия кнопки правится сообщение, на котором она была (edit_message_text,
+    edit_message_reply_markup, если текст тот же, или edit_message_media), для сообщения
+    пользователя экран отправляется заново - ниже его ввода. Если содержимое не изменилось,
+    запроса к Telegram нет. Фото отправляется по file_id из кэша, когда он есть.
+    Возвращает новое сообщение или None, если правка не понадобилась.
+    """
+    if isinstance(target, CallbackQuery):
+        chat_id = target.message.chat.id
+        # Старое сообщение (InaccessibleMessage) править уже нельзя
+        message = target.message if isinstance(target.message, Message) else None
+    else:
+        chat_id = target.chat.id
+        message = None
+    session = user_sessions.get(chat_id)
+    digest = _digest(text, photo, reply_markup)
+
+    # Править можно только сообщение с inline-клавиатурой (или без клавиатуры)
+    editable = message is not None and (reply_markup is None or isinstance(reply_markup, InlineKeyboardMarkup))
+    if editable:
+        if session.screen == (message.message_id, digest):
+            screen_updates.inc(action="skip")
+            return None
+        # Текст нельзя превратить в фото и наоборот - такие переходы отправляем заново
+        if bool(message.photo) == bool(photo):
+            sent = await _edit(message, text, reply_markup, photo)
+            if sent is not None:
+                session.screen = (message.message_id, digest)
+                screen_updates.inc(action="edit")
+                return sent if isinstance(sent, Message) else None
+
+    # Старое сообщение не удаляем: на пути заказа это лишний запрос на каждый переход текст <-> фото
+    # (см. bench/order_flow_calls.py)
+    sent = await _send(chat_id, text, reply_markup, photo)
+    session.screen = (sent.message_id, digest)
+    screen_updates.inc(action="send")
+    return sent
+
+
+async def _edit(message: Message, text: str, reply_markup: Markup, photo: Optional[str]):
+    """Правит сообщение; None, если правка невозможна и экран нужно отправить заново"""
+    try:
+        if photo:
+            file_id = photo_cache.get(photo)
+            try:
+                edited = await message.edit_media(InputMediaPhoto(media=file_id or photo, caption=text),
+                                                  reply_markup=reply_markup)
+            except TelegramBadRequest as e:
+                # Кэш сбрасываем только если Telegram не принял сам file_id, остальные ошибки -
+                # обычный повод отправить экран заново
+                if not file_id or not is_file_id_error(e):
+                    raise
+                photo_cache.forget(photo)
+                file_id = None
+                edited = await message.edit_media(InputMediaPhoto(media=photo, caption=text),
+                                                  reply_markup=reply_markup)
+            if not file_id and isinstance(edited, Message) and edited.photo:
+                photo_cache.put(photo, edited.photo[-1].file_id)
+            return edited
+        if message.text == text:
+            # Изменилась только клавиатура (например, листание страниц) - текст заново не шлём
+            return await message.edit_reply_markup(reply_markup=reply_markup)
+        return await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "not modified" in str(e):
+            return True
+        log.debug("Экран не удалось изменить, отправляем заново",
+                  extra=fields(user=message.chat.id, error=str(e)))
+        return None
+
+
+async def _send(chat_id: int, text: str, reply_markup, photo: Optional[str]) -> Message:
+    if not photo:
+        return await bot.send_message(chat_id, text, reply_markup=reply_markup)
+
+    # Если фото уже отправлялось, шлём file_id: Telegram не будет заново качать картинку по URL
+    file_id = photo_cache.get(photo)
+    try:
+        sent = await bot.send_photo(chat_id, photo=file_id or photo, caption=text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if not file_id or not is_file_id_error(e):
+            raise
+        photo_cache.forget(photo)
+        file_id = None
+        sent = await bot.send_photo(chat_id, photo=photo, caption=text, reply_markup=reply_markup)
+    if not file_id and sent.photo:
+        photo_cache.put(photo, sent.photo[-1].file_id)
+    return sent
@@ -0,0 +1,102 @@
+import re
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from catalog import MenuCatalog, Product
+
+# Длина префиксов, которые индексируются для автодополнения
+PREFIX_MAX = 10
+# Минимальная доля общих триграмм, при которой слово считается похожим (опечатки)
+TRIGRAM_THRESHOLD = 0.35
+# Совпадение в названии весит больше, чем в описании
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова в нижнем регистре; "ё" приравнивается к "е" """
+    return _WORD.findall(text.lower().replace("ё", "е"))
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MenuSearchIndex:
+    """Индекс для поиска по меню: префиксы слов и триграммы для нечёткого совпадения.
+
+    Строится один раз на версию каталога. Запрос сначала ищет слова с таким префиксом
+    (автодополнение), затем похожие по триграммам слова (опечатки), и ранжирует товары
+    по сумме совпадений, где слова названия весят больше слов описания.
+    """
+
+    def __init__(self, catalog: MenuCatalog):
+        self.version = catalog.version
+        self.products: Dict[str, Product] = dict(catalog.by_id)
+        # слово -> {ID товара: вес}
+        self._words: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._prefixes: Dict[str, Set[str]] = defaultdict(set)
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)
+
+        for product in self.products.values():
+            self._add_words(product.id, tokenize(product.name), NAME_WEIGHT)
+            self._add_words(product.id, tokenize(product.description), DESCRIPTION_WEIGHT)
+
+        for word in self._words:
+            for i in range(1, min(len(word), PREFIX_MAX) + 1):
+                self._prefixes[word[:i]].add(word)
+            for gram in trigrams(word):
+                self._trigrams[gram].add(word)
+
+    def _add_words(self, product_id: str, words: List[str], weight: float):
+        for word in words:
+            postings = self._words[word]
+            postings[product_id] = max(postings.get(product_id, 0), weight)
+
+    def _similar(self, token: str) -> List[Tuple[str, float]]:
+        """Слова индекса, похожие на token, с оценкой совпадения от 0 до 1"""
+        matches: Dict[str, float] = {}
+        prefix = token[:PREFIX_MAX]
+        for word in self._prefixes.get(prefix, ()):
+            if word.startswith(token):
+                matches[word] = 1.0 if word == token else 0.9
+
+        grams = trigrams(token)
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for word in self._trigrams.get(gram, ()):
+                shared[word] += 1
+        for word, count in shared.items():
+            if word in matches:
+                continue
+            similarity = count / (len(grams) + len(trigrams(word)) - count)
+            if similarity >= TRIGRAM_THRESHOLD:
+                matches[word] = similarity * 0.8
+        return list(matches.items())
+
+    def search(self, query: str, limit: int = 20) -> List[Product]:
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            best: Dict[str, float] = {}
+            for word, similarity in self._similar(token):
+                for product_id, weight in self._words[word].items():
+                    best[product_id] = max(best.get(product_id, 0), similarity * weight)
+            for product_id, score in best.items():
+                scores[product_id] += score
+                matched[product_id] += 1
+
+        # Для запроса из нескольких слов требуем совпадения хотя бы половины из них
+        required = (len(tokens) + 1) // 2
+        ranked = sorted(
+            (product_id for product_id in scores if matched[product_id] >= required),
+            key=lambda product_id: (-scores[product_id], self.products[product_id].name),
+        )
+        return [self.products[product_id] for product_id in ranked[:limit]]
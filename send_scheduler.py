@@ -0,0 +1,128 @@
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from ratelimit import PRIORITY_BACKGROUND, PRIORITY_DEFAULT, PRIORITY_ORDER, TokenBucket
+from telemetry import Counter, Gauge, Histogram, fields, get_logger, registry
+
+log = get_logger("send")
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+TELEGRAM_RPS = float(os.getenv("TELEGRAM_RPS", "30"))
+TELEGRAM_CHAT_RPS = float(os.getenv("TELEGRAM_CHAT_RPS", "1"))
+# Короткую серию в один чат (ответ + правка экрана) Telegram пропускает без ожидания
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+# Сколько чатов держим с собственными ограничителями
+SEND_MAX_CHATS = int(os.getenv("SEND_MAX_CHATS", "10000"))
+# Сколько раз повторять запрос после TelegramRetryAfter
+SEND_RETRIES = 3
+
+# Методы, на которые действуют лимиты отправки; ответы на callback и служебные вызовы идут напрямую
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_DEFAULT)
+
+send_wait = registry.register(Histogram(
+    "telegram_send_wait_seconds", "Ожидание в очереди отправки Telegram", ["priority"]))
+retry_after_total = registry.register(Counter(
+    "telegram_retry_after_total", "Ответы Telegram 429 (RetryAfter)"))
+send_queue_depth = registry.register(Gauge(
+    "telegram_send_queue_depth", "Запросы, ждущие общего лимита отправки"))
+
+PRIORITY_NAMES = {PRIORITY_ORDER: "order", PRIORITY_DEFAULT: "default", PRIORITY_BACKGROUND: "background"}
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Приоритет сообщений, отправляемых внутри блока: PRIORITY_ORDER обгоняет рассылки (PRIORITY_BACKGROUND)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих сообщений для bot.session.
+
+    Каждый send*/edit* запрос сначала ждёт токен своего чата (честная очередь: один
+    активный чат не может занять общий лимит), затем общий токен бота в очереди по
+    приоритету. На TelegramRetryAfter ограничители чата и бота "занимаются в долг" на
+    указанное время, и запрос повторяется без исключения в обработчике.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_RPS, chat_rate: float = TELEGRAM_CHAT_RPS,
+                 chat_burst: float = TELEGRAM_CHAT_BURST, max_chats: int = SEND_MAX_CHATS):
+        self.bucket = TokenBucket("telegram", rate=rate, capacity=rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        registry.add_collector(lambda: send_queue_depth.set(self.bucket.queue_depth))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket("chat", rate=self.chat_rate, capacity=self.chat_burst)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not method.__api_method__.startswith(_LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        for attempt in range(SEND_RETRIES + 1):
+            started = time.perf_counter()
+            chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            if chat_bucket is not None:
+                await chat_bucket.acquire(priority)
+            await self.bucket.acquire(priority)
+            send_wait.observe(time.perf_counter() - started, priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retry_after_total.inc()
+                if attempt == SEND_RETRIES:
+                    raise
+                log.warning("Telegram просит подождать", extra=fields(
+                    method=method.__api_method__, chat=chat_id, retry_after=e.retry_after))
+                # Долг в токенах: повтор и следующие сообщения подождут retry_after, а не получат 429 снова.
+                # Telegram не говорит, чей лимит превышен - чата или всего бота, поэтому ждут оба
+                if chat_bucket is not None:
+                    chat_bucket.defer(e.retry_after)
+                self.bucket.defer(e.retry_after)
+
+    def share(self, workers: int):
+        """Делит лимиты бота и чатов между процессами, которые отправляют от имени одного бота"""
+        self.bucket.share(workers)
+        self.chat_rate /= workers
+        self.chat_burst = max(self.chat_burst / workers, 1)
+        for bucket in self._chats.values():
+            bucket.share(workers)
+
+    def get_stats(self) -> dict:
+        stats = self.bucket.get_stats()
+        stats["chats"] = len(self._chats)
+        return stats
+
+
+send_scheduler = SendScheduler()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+from ratelimit import TokenBucket
+
+# Сколько пользователей держим в памяти одновременно
+SESSIONS_MAX_USERS = int(os.getenv("SESSIONS_MAX_USERS", "10000"))
+# Через сколько секунд бездействия пользователь забывается
+SESSIONS_IDLE_TTL = float(os.getenv("SESSIONS_IDLE_TTL", "1800"))
+# Сколько действий в секунду в среднем и подряд разрешено одному пользователю
+USER_RATE = float(os.getenv("USER_RATE", "2"))
+USER_BURST = float(os.getenv("USER_BURST", "5"))
+# Файл межпроцессных блокировок пользователей (воркеры вебхука) и число байт-слотов в нём
+USER_LOCK_FILE = os.getenv("USER_LOCK_FILE", "user_locks.lock")
+USER_LOCK_SLOTS = int(os.getenv("USER_LOCK_SLOTS", "4096"))
+# Как часто проверять, освободил ли другой процесс блокировку
+USER_LOCK_POLL = 0.01
+
+
+class UserSession:
+    """Временное состояние пользователя в памяти процесса"""
+
+    __slots__ = ("last_seen", "_bucket", "_lock", "last_callback", "screen")
+
+    def __init__(self):
+        self.last_seen = time.monotonic()
+        self._bucket: Optional[TokenBucket] = None
+        self._lock: Optional[asyncio.Lock] = None
+        # (данные кнопки, ID сообщения, время нажатия) - для отсева повторных нажатий
+        self.last_callback: Optional[Tuple[str, int, float]] = None
+        # (ID сообщения-экрана, хэш его содержимого) - чтобы не слать правку без изменений
+        self.screen: Optional[Tuple[int, str]] = None
+
+    @property
+    def bucket(self) -> TokenBucket:
+        if self._bucket is None:
+            self._bucket = TokenBucket("user", rate=USER_RATE, capacity=USER_BURST)
+        return self._bucket
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Обработчики одного пользователя выполняются строго по очереди"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+
+class UserRegistry:
+    """Ограниченный реестр сессий пользователей (LRU по времени последнего обращения).
+
+    Сессии упорядочены по last_seen, поэтому устаревшие всегда в начале словаря и
+    вычищаются по ходу обращений без отдельной фоновой задачи. Сверх max_users
+    вытесняется самый давний пользователь.
+    """
+
+    def __init__(self, max_users: int = SESSIONS_MAX_USERS, idle_ttl: float = SESSIONS_IDLE_TTL):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[int, UserSession]" = OrderedDict()
+        self.stats = {"created": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def get(self, user_id: int) -> UserSession:
+        """Сессия пользователя; создаётся при первом обращении"""
+        now = time.monotonic()
+        self.expire(now)
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = UserSession()
+            self.stats["created"] += 1
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+                self.stats["evicted"] += 1
+        else:
+            self._sessions.move_to_end(user_id)
+        session.last_seen = now
+        return session
+
+    def peek(self, user_id: int) -> Optional[UserSession]:
+        """Сессия без продления и без создания"""
+        return self._sessions.get(user_id)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        deadline = (now or time.monotonic()) - self.idle_ttl
+        expired = 0
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen > deadline:
+                break
+            del self._sessions[user_id]
+            expired += 1
+        self.stats["expired"] += expired
+        return expired
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "active": len(self._sessions)}
+
+
+class ProcessLocks:
+    """Блокировка пользователя, общая для нескольких процессов (воркеры вебхука).
+
+    Пользователю соответствует байт файла блокировок (fcntl.lockf, user_id % slots).
+    POSIX-блокировка принадлежит процессу, поэтому внутри процесса слот считается по
+    числу держателей и отпускается последним. Ожидание - опрос без блокировки event loop.
+    """
+
+    def __init__(self, path: str = USER_LOCK_FILE, slots: int = USER_LOCK_SLOTS, poll: float = USER_LOCK_POLL):
+        self.path = path
+        self.slots = slots
+        self.poll = poll
+        self._fd: Optional[int] = None
+        self._holders: Dict[int, int] = {}
+
+    def _try_lock(self, slot: int) -> bool:
+        import fcntl  # Только POSIX: несколько воркеров вебхука (SO_REUSEPORT) бывают только там
+
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self, slot: int):
+        import fcntl
+
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+
+    @asynccontextmanager
+    async def hold(self, user_id: int):
+        slot = user_id % self.slots
+        if slot not in self._holders:
+            while not self._try_lock(slot):
+                await asyncio.sleep(self.poll)
+        self._holders[slot] = self._holders.get(slot, 0) + 1
+        try:
+            yield
+        finally:
+            self._holders[slot] -= 1
+            if not self._holders[slot]:
+                del self._holders[slot]
+                self._unlock(slot)
+
+
+user_sessions = UserRegistry()
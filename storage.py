@@ -0,0 +1,217 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from telemetry import fields, get_logger
+from tracing import traced
+
+log = get_logger("storage")
+
+# Через сколько секунд повторить запись, если база была занята или недоступна
+FLUSH_RETRY_DELAY = 1.0
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite (режим WAL), общее для нескольких процессов бота на одном хосте.
+
+    Записи копятся в памяти и сбрасываются в базу одной транзакцией раз в flush_interval секунд.
+    Чтения проходят через небольшой LRU-кэш с коротким TTL. Это безопасно только для одного
+    процесса: другой процесс увидит старые данные и перезапишет ими чужие изменения. Поэтому
+    при нескольких воркерах (см. create_storage в bot.py) flush_interval=0 и cache_ttl=0 -
+    каждая запись сразу уходит в базу, каждое чтение идёт из базы.
+
+    Если запись не удалась (например, database is locked), изменения возвращаются в очередь
+    и записываются повторно, а не теряются.
+
+    update_data при общей базе читает, дополняет и записывает данные одной транзакцией
+    BEGIN IMMEDIATE, поэтому одновременные обновления из разных процессов не затирают друг друга.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05, cache_ttl: float = 1.0,
+                 cache_size: int = 1024, key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            )
+        """)
+
+        # Ещё не записанные изменения: key -> {"state": ..., "data": json}
+        self._pending: Dict[str, Dict[str, Optional[str]]] = {}
+        # Кэш чтения: key -> (момент устаревания, state, data json)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[str], str]]" = OrderedDict()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def _key(self, key: StorageKey) -> str:
+        return self.key_builder.build(key)
+
+    def _read(self, key: str) -> Tuple[Optional[str], str]:
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            return cached[1], cached[2]
+
+        row = self.conn.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        state, data = row if row else (None, "{}")
+        self._remember(key, state, data)
+        return state, data
+
+    def _remember(self, key: str, state: Optional[str], data: str):
+        if self.cache_ttl <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.cache_ttl, state, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _write(self, key: str, field: str, value: Optional[str]):
+        self._pending.setdefault(key, {})[field] = value
+        if self.flush_interval <= 0:
+            # Запись сразу: ошибка базы дойдёт до обработчика, изменения останутся в очереди
+            self.flush()
+            return
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires, state, data = cached
+            if field == "state":
+                state = value
+            else:
+                data = value
+            self._cache[key] = (expires, state, data)
+        self._schedule_flush()
+
+    def _schedule_flush(self, delay: Optional[float] = None):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(
+            self.flush_interval if delay is None else delay, self._flush_later)
+
+    def _flush_later(self):
+        """Отложенная запись из таймера: ошибку некому пробросить, поэтому пишем в лог и повторяем"""
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            log.warning("FSM не записано в базу, повторим", extra=fields(
+                keys=len(self._pending), error=str(e)))
+            self._schedule_flush(FLUSH_RETRY_DELAY)
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией.
+
+        При ошибке изменения возвращаются в _pending (поверх них - то, что успели записать
+        за время попытки), а исключение пробрасывается.
+        """
+        self._flush_handle = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = time.time()
+        states = [(key, values["state"], now) for key, values in pending.items() if "state" in values]
+        datas = [(key, values["data"], now) for key, values in pending.items() if "data" in values]
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    states,
+                )
+                self.conn.executemany(
+                    "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    datas,
+                )
+        except sqlite3.Error:
+            for key, values in pending.items():
+                self._pending[key] = {**values, **self._pending.get(key, {})}
+            raise
+
+    @traced("storage")
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        self._write(self._key(key), "state", value)
+
+    @traced("storage")
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        storage_key = self._key(key)
+        pending = self._pending.get(storage_key)
+        if pending and "state" in pending:
+            return pending["state"]
+        return self._read(storage_key)[0]
+
+    @traced("storage")
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self._write(self._key(key), "data", json.dumps(dict(data), ensure_ascii=False))
+
+    def _current_data(self, key: str) -> Dict[str, Any]:
+        pending = self._pending.get(key)
+        if pending and "data" in pending:
+            return json.loads(pending["data"])
+        return json.loads(self._read(key)[1])
+
+    @traced("storage")
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._current_data(self._key(key))
+
+    def _merge_data(self, key: str, data: Mapping[str, Any]) -> Dict[str, Any]:
+        """Чтение, слияние и запись данных одной транзакцией; блокировка записи берётся до чтения"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            pending = self._pending.get(key)
+            if pending and "data" in pending:
+                current = pending["data"]
+            else:
+                row = self.conn.execute("SELECT data FROM fsm WHERE key = ?", (key,)).fetchone()
+                current = row[0] if row else "{}"
+            merged = {**json.loads(current), **data}
+            value = json.dumps(merged, ensure_ascii=False)
+            self.conn.execute(
+                "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (key, value, time.time()),
+            )
+        if pending:
+            pending.pop("data", None)
+            if not pending:
+                del self._pending[key]
+        self._cache.pop(key, None)
+        return merged
+
+    @traced("storage")
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        storage_key = self._key(key)
+        if self.flush_interval > 0:
+            # Один процесс: чтение и запись идут без await между ними, запись уходит отложенной пачкой
+            merged = {**self._current_data(storage_key), **data}
+            self._write(storage_key, "data", json.dumps(merged, ensure_ascii=False))
+            return merged
+        return self._merge_data(storage_key, data)
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,247 @@
+import atexit
+import bisect
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Доля заказов, для которых пишется подробный отладочный дамп (0..1)
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_SAMPLE_RATE", "0.01"))
+# Локальный адрес, на котором в режиме polling отдаются метрики в формате Prometheus (0 - выключено).
+# Не 9100: его обычно занимает node_exporter. В режиме webhook /metrics отдаёт сам сервер вебхука
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_PATH = "/metrics"
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ---------- Логирование ----------
+
+class StructuredFormatter(logging.Formatter):
+    """Одна строка на событие: время, уровень, логгер, сообщение и поля key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = (f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname:<7} "
+                f"{record.name} {record.getMessage()}")
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" if isinstance(value, str) and " " in value
+                                   else f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Логи уходят в очередь, а в stdout их пишет отдельный поток - event loop не ждёт вывод"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter())
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger("coffebot")
+    root.setLevel(level)
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"coffebot.{name}")
+
+
+def fields(**values) -> Dict:
+    """extra для логгера: log.info("...", extra=fields(order=key, total=100))"""
+    return {"fields": values}
+
+
+def should_sample(rate: float = DEBUG_SAMPLE_RATE) -> bool:
+    """Выборка для тяжёлых отладочных дампов: пишем их только для части событий"""
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+# ---------- Метрики ----------
+
+def _label_key(names: Sequence[str], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in names)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labels, labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Ключ меток -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(self.labels, labels))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback):
+        """callback() вызывается перед каждой выдачей метрик - для значений, которые считаются по запросу"""
+        self._collectors.append(callback)
+
+    def render(self) -> str:
+        for callback in self._collectors:
+            callback()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+handler_latency = registry.register(Histogram(
+    "bot_handler_seconds", "Время обработки апдейта", ["event", "kind"]))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ["event", "kind"]))
+crm_latency = registry.register(Histogram(
+    "crm_request_seconds", "Время запроса к Bitrix24 по методу", ["method"]))
+crm_requests = registry.register(Counter(
+    "crm_requests_total", "Запросы к Bitrix24 по методу и результату", ["method", "status"]))
+sheets_latency = registry.register(Histogram(
+    "sheets_fetch_seconds", "Время обращения к Google Sheets", ["stage"]))
+throttled_updates = registry.register(Counter(
+    "bot_throttled_total", "Отброшенные апдейты: превышение частоты или повторное нажатие", ["reason"]))
+menu_lookups = registry.register(Counter(
+    "menu_cache_lookups_total", "Обращения к снимку меню", ["result"]))
+menu_hit_ratio = registry.register(Gauge(
+    "menu_cache_hit_ratio", "Доля обращений к меню, обслуженных из памяти"))
+
+
+def _collect_menu_ratio():
+    hits, misses = menu_lookups.value(result="hit"), menu_lookups.value(result="miss")
+    menu_hit_ratio.set(hits / (hits + misses) if hits + misses else 0.0)
+
+
+registry.add_collector(_collect_menu_ratio)
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """Отдельный небольшой HTTP-сервер с /metrics (для режима polling).
+
+    Если порт занят, бот всё равно запускается - без метрик, с предупреждением в логе.
+    """
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get(METRICS_PATH, metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        get_logger("metrics").warning("Сервер метрик не запущен", extra=fields(
+            host=host, port=port, error=str(e)))
+        await runner.cleanup()
+        return None
+    return runner
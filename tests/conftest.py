@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+# Модули бота создают базы и клиентов при импорте: направляем их во временный каталог,
+# чтобы тесты не трогали рабочие outbox.sqlite3 и fsm.sqlite3
+_tmp = tempfile.mkdtemp(prefix="coffebot-tests-")
+os.environ.setdefault("OUTBOX_DB", os.path.join(_tmp, "outbox.sqlite3"))
+os.environ.setdefault("ORDERS_DB", os.path.join(_tmp, "orders.sqlite3"))
+os.environ.setdefault("FSM_DB", os.path.join(_tmp, "fsm.sqlite3"))
+os.environ.setdefault("PHOTO_CACHE_DB", os.path.join(_tmp, "photos.sqlite3"))
+os.environ.setdefault("MENU_SNAPSHOT_FILE", os.path.join(_tmp, "menu_snapshot.json"))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+# Тесты меню обновляют снимок десятки раз подряд - не ждём квоту Google Sheets
+os.environ.setdefault("SHEETS_RPM", "60000")
+os.environ.setdefault("SHEETS_BURST", "1000")
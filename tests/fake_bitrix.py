@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+
+class FakeBitrix:
+    """Локальный сервер, отвечающий как REST API Bitrix24 на вызовы, которые делает бот.
+
+    Поддерживает batch (со ссылками $result[...]), crm.lead.add, crm.lead.list (фильтр по
+    ORIGIN_ID), crm.lead.get, crm.lead.update и crm.lead.productrows.set. Сбои задаются
+    счётчиками: fail_requests - следующие запросы получают HTTP 500 без обработки,
+    lose_responses - запрос выполняется (лид создаётся), но ответ заменяется на HTTP 500.
+    delay имитирует сетевую задержку каждого ответа.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.fail_requests = 0
+        self.lose_responses = 0
+        self.leads: Dict[int, Dict] = {}
+        self.calls: List[str] = []
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер и возвращает URL вебхука для BitrixClient"""
+        app = web.Application()
+        app.router.add_route("*", "/rest/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/rest/"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def leads_by_origin(self, origin_id: str) -> List[int]:
+        return [lead_id for lead_id, lead in self.leads.items() if lead["fields"].get("ORIGIN_ID") == origin_id]
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls.append(method)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail_requests:
+            self.fail_requests -= 1
+            return web.Response(status=500, text="fake outage")
+
+        params = await request.json() if request.can_read_body else dict(request.query)
+        if method == "batch":
+            body = self._batch(params)
+        else:
+            body = self._call(method, params)
+
+        if self.lose_responses:
+            self.lose_responses -= 1
+            return web.Response(status=500, text="response lost")
+        return web.json_response(body)
+
+    def _batch(self, params: Dict) -> Dict:
+        results, errors = {}, {}
+        for name, command in params.get("cmd", {}).items():
+            method, _, query = command.partition("?")
+            flat = {}
+            for key, value in parse_qsl(query, keep_blank_values=True):
+                if value.startswith("$result[") and value.endswith("]"):
+                    value = results.get(value[len("$result["):-1])
+                flat[key] = value
+            body = self._call(method, flat)
+            if "error" in body:
+                errors[name] = body
+                if int(params.get("halt", 0)):
+                    break
+            else:
+                results[name] = body["result"]
+        return {"result": {"result": results, "result_error": errors}}
+
+    def _call(self, method: str, params: Dict) -> Dict:
+        if method == "crm.lead.add":
+            lead_id = next(self._ids)
+            self.leads[lead_id] = {"fields": _section(params, "fields"), "rows": []}
+            return {"result": lead_id}
+        if method == "crm.lead.list":
+            origin = _section(params, "filter").get("ORIGIN_ID")
+            return {"result": [{"ID": str(lead_id)} for lead_id in self.leads_by_origin(origin)]}
+
+        lead = self.leads.get(int(params.get("id") or 0))
+        if lead is None:
+            return {"error": "NOT_FOUND", "error_description": "Lead not found"}
+        if method == "crm.lead.productrows.set":
+            lead["rows"] = _rows(params)
+            return {"result": True}
+        if method == "crm.lead.update":
+            lead["fields"].update(_section(params, "fields"))
+            return {"result": True}
+        if method == "crm.lead.get":
+            return {"result": {"ID": params["id"], **lead["fields"]}}
+        return {"error": "ERROR_METHOD_NOT_FOUND", "error_description": method}
+
+
+def _section(params: Dict, name: str) -> Dict:
+    """Вложенный словарь из JSON или из плоских ключей вида fields[TITLE] (batch)"""
+    if isinstance(params.get(name), dict):
+        return params[name]
+    prefix = f"{name}["
+    return {key[len(prefix):-1]: value for key, value in params.items()
+            if key.startswith(prefix) and key.count("[") == 1}
+
+
+def _rows(params: Dict) -> List:
+    if isinstance(params.get("rows"), list):
+        return params["rows"]
+    rows: Dict[str, Dict] = {}
+    for key, value in params.items():
+        if key.startswith("rows["):
+            index, _, field = key[len("rows["):].partition("][")
+            rows.setdefault(index, {})[field.rstrip("]")] = value
+    return [rows[index] for index in sorted(rows, key=int)]
+
+
+if __name__ == "__main__":
+    # Ручная проверка: BITRIX_WEBHOOK=http://127.0.0.1:8765/rest/ python main.py
+    async def serve():
+        fake = FakeBitrix()
+        print(f"BITRIX_WEBHOOK={await fake.start(port=8765)}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
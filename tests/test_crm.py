@@ -0,0 +1,38 @@
+from urllib.parse import parse_qsl
+
+from crm import BatchRef, build_command, build_lead_commands
+
+ORDER = {
+    "name": "$result[x]&fields[ASSIGNED_BY_ID]=7&fields[OPPORTUNITY]=0",
+    "phone": "79990000000",
+    "address": "ул. Ленина, 1",
+    "products": [{"name": "Раф $result[lead]&id=1", "priece": "320", "quantity": 1}],
+}
+
+
+def command_params(command: str):
+    method, _, query = command.partition("?")
+    return method, parse_qsl(query, keep_blank_values=True)
+
+
+def test_user_text_cannot_inject_batch_parameters():
+    commands = build_lead_commands(ORDER)
+
+    method, params = command_params(commands["lead"])
+    values = dict(params)
+    assert method == "crm.lead.add"
+    assert values["fields[NAME]"] == ORDER["name"]
+    assert [value for key, value in params if key == "fields[ASSIGNED_BY_ID]"] == ["1"]
+    assert values["fields[OPPORTUNITY]"] == "320"
+    assert "$result[" not in commands["lead"]
+
+
+def test_only_batch_ref_stays_unencoded():
+    commands = build_lead_commands(ORDER)
+
+    assert commands["rows"].startswith("crm.lead.productrows.set?id=$result[lead]&")
+    _, params = command_params(commands["rows"])
+    assert [key for key, _ in params].count("id") == 1
+    assert dict(params)["rows[0][PRODUCT_NAME]"] == "Раф $result[lead]&id=1"
+    assert build_command("m", {"id": "$result[lead]"}) == "m?id=%24result%5Blead%5D"
+    assert build_command("m", {"id": BatchRef("lead")}) == "m?id=$result[lead]"
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, User
+
+import handlers
+from bot import bot
+from cart import Cart
+from catalog import MenuCatalog
+
+HEADER = ["ID", "Название", "Описание", "Цена", "Ккал", "Б", "Ж", "С", "Фото", "Категория"]
+CATALOG = MenuCatalog([HEADER, ["1", "Капучино", "", "250", "", "", "", "", "", "Кофе"]])
+
+
+class FakeUser:
+    id = 42
+    first_name = "Анна"
+    last_name = None
+    username = "anna"
+
+
+class FakeCallback:
+    from_user = FakeUser()
+
+    def __init__(self):
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=None):
+        self.answers.append(text)
+
+
+def test_repeated_confirm_does_not_queue_empty_order(monkeypatch):
+    orders, screens = [], []
+
+    async def fetch_catalog():
+        return CATALOG
+
+    async def show_screen(target, text, reply_markup=None, photo=None):
+        screens.append(text)
+
+    monkeypatch.setattr(handlers, "fetch_catalog", fetch_catalog)
+    monkeypatch.setattr(handlers, "show_screen", show_screen)
+    monkeypatch.setattr(handlers.order_outbox, "put", lambda data: orders.append(data) or f"key{len(orders)}")
+    monkeypatch.setattr(handlers.order_store, "add", lambda *args: None)
+
+    async def scenario():
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=42, user_id=42))
+        cart = Cart()
+        cart.add("1", 2, 250)
+        await state.set_state(handlers.OrderStates.confirming_order)
+        await state.update_data(cart=cart.to_state(), name="Анна", phone="+79990000000", address="ул. Ленина, 1")
+
+        await handlers.confirm_order(FakeCallback(), state)
+        # Второе нажатие той же кнопки после того, как заказ оформлен и state очищен
+        repeated = FakeCallback()
+        await handlers.confirm_order(repeated, state)
+
+        assert len(orders) == 1
+        assert orders[0]["products"][0]["name"] == "Капучино"
+        assert len(screens) == 1
+        assert "уже оформлен" in repeated.answers[0]
+
+    asyncio.run(scenario())
+
+
+async def first_message_handler(text: str, state) -> str:
+    """Имя хендлера, который роутер выберет для текста в указанном состоянии"""
+    user = User(id=42, is_bot=False, first_name="Анна")
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type="private"),
+                      from_user=user, text=text)
+    for handler in handlers.router.message.handlers:
+        matched, _ = await handler.check(message, raw_state=state, bot=bot, event_from_user=user)
+        if matched:
+            return handler.callback.__name__
+
+
+@pytest.mark.parametrize("state, text, expected", [
+    (handlers.OrderStates.entering_name, "Мои заказы📃", "show_orders"),
+    (handlers.OrderStates.entering_address, "Мои заказы📃", "show_orders"),
+    (handlers.OrderStates.entering_contact, "/limits", "limits_stats"),
+    (handlers.OrderStates.editing_quantity, "/traces", "show_traces"),
+    (handlers.OrderStates.entering_name, "Анна", "receive_name"),
+    (handlers.OrderStates.entering_address, "ул. Ленина, 1", "receive_address"),
+])
+def test_menu_buttons_and_commands_are_not_taken_as_input(state, text, expected):
+    assert asyncio.run(first_message_handler(text, state.state)) == expected
+
+
+@pytest.mark.parametrize("handler", [handlers.menu_stats, handlers.limits_stats, handlers.requeue_orders])
+def test_admin_commands_ignore_other_users(monkeypatch, handler):
+    monkeypatch.setattr(handlers, "ADMIN_IDS", {1})
+    replies = []
+
+    class FakeMessage:
+        from_user = FakeUser()
+
+        async def answer(self, text, **kwargs):
+            replies.append(text)
+
+    asyncio.run(handler(FakeMessage()))
+    assert replies == []
+
+
+@pytest.mark.parametrize("product_id, expected", [("1", "Капучино"), ("2", None)])
+def test_product_button_survives_catalog_version_change(monkeypatch, product_id, expected):
+    screens, stale = [], []
+
+    async def fetch_catalog():
+        return CATALOG
+
+    async def show_screen(target, text, reply_markup=None, photo=None):
+        screens.append(text)
+
+    async def answer_stale_menu(callback, state):
+        stale.append(callback)
+
+    monkeypatch.setattr(handlers, "fetch_catalog", fetch_catalog)
+    monkeypatch.setattr(handlers, "show_screen", show_screen)
+    monkeypatch.setattr(handlers, "answer_stale_menu", answer_stale_menu)
+
+    async def scenario():
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=42, user_id=42))
+        # Кнопка из меню до обновления каталога
+        callback_data = handlers.ProductCallback(v="old" + CATALOG.version, id=product_id)
+        await handlers.show_product(FakeCallback(), callback_data, state)
+        return await state.get_data()
+
+    data = asyncio.run(scenario())
+
+    if expected:
+        assert expected in screens[0] and not stale
+        assert data["current_product_id"] == product_id
+    else:
+        assert not screens and len(stale) == 1
@@ -0,0 +1,165 @@
+import asyncio
+import csv
+import os
+
+from catalog import MenuCatalog
+from google_sheets import LocalMenuSource, MenuSnapshot
+
+HEADER = ["ID", "Название", "Описание", "Цена", "Ккал", "Белки", "Жиры", "Сахар", "Фото", "Категория"]
+
+
+def product_row(product_id: str, name: str, price: int = 200, category: str = "Кофе") -> list:
+    return [product_id, name, "", str(price), "", "", "", "", "", category]
+
+
+def write_menu(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        csv.writer(file).writerows([HEADER] + rows)
+    # Ревизия LocalMenuSource - mtime и размер; сдвигаем mtime, чтобы быстрые перезаписи не совпали
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_follower_reads_menu_from_primary_snapshot(tmp_path):
+    menu_path = tmp_path / "menu.csv"
+    snapshot_path = str(tmp_path / "menu_snapshot.json")
+    primary = MenuSnapshot(LocalMenuSource(str(menu_path)), ttl=300, snapshot_path=snapshot_path)
+    follower = MenuSnapshot(LocalMenuSource(str(menu_path)), ttl=300, snapshot_path=snapshot_path)
+    follower.follow(ttl=0)
+
+    async def scenario():
+        write_menu(menu_path, [product_row("1", "Латте")])
+        await primary.refresh_async()
+        assert (await follower.get_catalog_async()).get("1").name == "Латте"
+
+        write_menu(menu_path, [product_row("1", "Латте"), product_row("2", "Раф")])
+        await primary.refresh_async()
+        await follower.refresh_async()
+        assert follower.catalog.get("2").name == "Раф"
+        assert follower.catalog.version == primary.catalog.version
+
+    asyncio.run(scenario())
+    # Снимок пишет только основной процесс
+    assert follower.snapshot_path is None
+
+
+def assert_same_catalog(catalog, rows):
+    """Каталог после обновлений по разнице совпадает с построенным заново по тем же строкам"""
+    fresh = MenuCatalog(rows)
+    assert catalog.version == fresh.version
+    assert catalog.by_id == fresh.by_id
+    assert catalog.by_name == fresh.by_name
+    assert catalog.by_category == fresh.by_category
+    assert catalog.categories == fresh.categories
+    assert catalog.pages == fresh.pages
+
+
+class Menu:
+    """MenuSnapshot поверх LocalMenuSource во временном CSV; запоминает уведомления подписчиков"""
+
+    def __init__(self, tmp_path):
+        self.path = tmp_path / "menu.csv"
+        self.snapshot = MenuSnapshot(LocalMenuSource(str(self.path)), ttl=300)
+        self.events = []
+        self.snapshot.add_listener(lambda catalog, diff: self.events.append(diff))
+
+    def refresh(self):
+        return asyncio.run(self.snapshot.refresh_async())
+
+    def load(self, rows):
+        write_menu(self.path, rows)
+        catalog = self.refresh()
+        assert_same_catalog(catalog, [HEADER] + rows)
+        return self.events.pop() if self.events else "no event"
+
+
+def names(products):
+    return sorted(product.name for product in products)
+
+
+def test_diff_add_remove_change(tmp_path):
+    menu = Menu(tmp_path)
+    assert menu.load([product_row("1", "Латте"), product_row("2", "Раф")]) is None  # первая загрузка
+
+    diff = menu.load([product_row("1", "Латте", price=250), product_row("3", "Мокко", category="Сезонное")])
+    assert names(diff.added) == ["Мокко"]
+    assert names(diff.removed) == ["Раф"]
+    assert names(diff.changed) == ["Латте"]
+    assert diff.changed[0].price == 250
+    assert menu.snapshot.catalog.get("2") is None
+    assert menu.snapshot.catalog.categories == ["Кофе", "Сезонное"]
+
+
+def test_diff_reorder_updates_category_order(tmp_path):
+    menu = Menu(tmp_path)
+    menu.load([product_row("1", "Латте"), product_row("2", "Раф"), product_row("3", "Мокко")])
+
+    diff = menu.load([product_row("3", "Мокко"), product_row("1", "Латте"), product_row("2", "Раф")])
+    # Товары те же, сменилась только версия и порядок в категории
+    assert not diff
+    assert [p.name for p in menu.snapshot.catalog.products_in("Кофе")] == ["Мокко", "Латте", "Раф"]
+
+
+def test_duplicate_ids_and_names(tmp_path):
+    menu = Menu(tmp_path)
+    # Дубль ID: побеждает первая строка; одинаковые названия с разными ID - оба товара, поиск по имени - верхний
+    menu.load([product_row("1", "Латте"), product_row("1", "Капучино"),
+               product_row("2", "Раф"), product_row("3", "Раф", price=300)])
+    catalog = menu.snapshot.catalog
+    assert catalog.get("1").name == "Латте"
+    assert catalog.find_by_name("раф").id == "2"
+
+    # Верхний "Раф" удалён - поиск по имени переходит на оставшийся
+    diff = menu.load([product_row("1", "Латте"), product_row("1", "Капучино"), product_row("3", "Раф", price=300)])
+    assert names(diff.removed) == ["Раф"]
+    assert catalog.find_by_name("раф").id == "3"
+
+    # Строки без ID сопоставляются по названию
+    diff = menu.load([product_row("", "Американо"), product_row("1", "Латте"), product_row("3", "Раф", price=300)])
+    assert names(diff.added) == ["Американо"]
+    diff = menu.load([product_row("", "Американо", price=150), product_row("1", "Латте"),
+                      product_row("3", "Раф", price=300)])
+    assert names(diff.changed) == ["Американо"]
+    assert catalog.find_by_name("Американо").price == 150
+
+
+def test_new_revision_with_same_content_does_not_notify(tmp_path):
+    menu = Menu(tmp_path)
+    rows = [product_row("1", "Латте"), product_row("2", "Раф")]
+    menu.load(rows)
+    version = menu.snapshot.catalog.version
+
+    # Файл перезаписан (новая ревизия), содержимое прежнее: каталог и подписчики не трогаются
+    assert menu.load(rows) == "no event"
+    assert menu.snapshot.catalog.version == version
+    assert menu.snapshot.stats["refreshes"] == 2
+
+
+def test_unchanged_revision_skips_download(tmp_path):
+    menu = Menu(tmp_path)
+    menu.load([product_row("1", "Латте")])
+
+    menu.refresh()
+    assert menu.snapshot.stats["unchanged"] == 1
+    assert menu.snapshot.stats["refreshes"] == 1
+    assert menu.events == []
+
+
+def test_async_listeners_run_in_event_loop(tmp_path):
+    menu = Menu(tmp_path)
+    seen = []
+
+    async def on_change(catalog, diff):
+        seen.append((len(catalog), names(diff.added) if diff else None))
+
+    menu.snapshot.add_listener(on_change)
+
+    async def scenario():
+        write_menu(menu.path, [product_row("1", "Латте")])
+        await menu.snapshot.refresh_async()
+        write_menu(menu.path, [product_row("1", "Латте"), product_row("2", "Раф")])
+        await menu.snapshot.refresh_async()
+        await asyncio.sleep(0)  # подписчики-корутины запускаются отдельными задачами
+
+    asyncio.run(scenario())
+    assert seen == [(1, None), (2, ["Раф"])]
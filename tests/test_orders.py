@@ -0,0 +1,54 @@
+import asyncio
+
+from orders import OrderReconciler, OrderStore
+from outbox import Outbox
+
+
+class FakeClient:
+    """crm.lead.list: лиды находятся только для заказов из leads (ORIGIN_ID -> ID)"""
+
+    def __init__(self, leads=None):
+        self.leads = leads or {}
+        self.searched = []
+
+    async def call(self, method, payload, priority=None):
+        lead_filter = payload["filter"]
+        if "@ORIGIN_ID" in lead_filter:
+            self.searched += lead_filter["@ORIGIN_ID"]
+            found = [{"ID": str(self.leads[key]), "ORIGIN_ID": key, "STATUS_ID": "NEW"}
+                     for key in lead_filter["@ORIGIN_ID"] if key in self.leads]
+            return {"result": found}
+        return {"result": [{"ID": str(lead_id), "STATUS_ID": "NEW"} for lead_id in lead_filter["@ID"]]}
+
+
+def test_unresolved_orders_do_not_block_newer_ones(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.sqlite3"))
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    # 60 старых заказов, лиды для которых так и не появятся
+    for n in range(60):
+        store.add(f"old{n}", 1, 100, [])
+    store.add("new", 1, 100, [])
+    client = FakeClient({"new": 7})
+    reconciler = OrderReconciler(store, outbox, client, batch=50)
+
+    asyncio.run(reconciler.reconcile())
+    assert "new" not in client.searched
+
+    # Следующий цикл начинает с непроверенных, а не снова со старых
+    asyncio.run(reconciler.reconcile())
+    assert store.page(1, 0)[0][0].lead_id == 7
+
+
+def test_orders_still_in_outbox_are_not_searched(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.sqlite3"))
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    store.add(outbox.put({"name": "A"}, key="queued"), 1, 100, [])
+    outbox.claim()
+    outbox.mark_retry("queued", 20, "Bitrix24 недоступен")
+    store.add("pending", 1, 100, [])
+    client = FakeClient()
+
+    asyncio.run(OrderReconciler(store, outbox, client).reconcile())
+
+    assert client.searched == ["pending"]
+    assert store.without_lead() == ["queued", "pending"]
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from crm import BitrixClient, LeadAggregator
+from outbox import OUTBOX_ALERT_ATTEMPTS, SENDING_LEASE, Outbox, OutboxWorker
+from ratelimit import TokenBucket
+from tests.fake_bitrix import FakeBitrix
+
+ORDER = {
+    "name": "Анна",
+    "phone": "79990000000",
+    "address": "ул. Ленина, 1",
+    "products": [{"name": "Капучино", "priece": "250", "quantity": 2}],
+}
+
+
+def run(scenario):
+    """Запускает сценарий с фейковым Bitrix24, очередью во временной базе и воркером"""
+    async def main(tmp_path):
+        fake = FakeBitrix()
+        client = BitrixClient(await fake.start(), limiter=TokenBucket("test", rate=1000, capacity=1000))
+        outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+        worker = OutboxWorker(outbox, client, LeadAggregator(client, window=0.01), poll_interval=0.02)
+        try:
+            await scenario(fake, outbox, worker)
+        finally:
+            await worker.stop()
+            await client.close()
+            await fake.close()
+            outbox.close()
+
+    return main
+
+
+async def wait_for(condition, timeout: float = 3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+def row(outbox: Outbox, key: str):
+    return outbox.conn.execute(
+        "SELECT status, attempts, lead_id, last_error FROM outbox WHERE key = ?", (key,)
+    ).fetchone()
+
+
+def retry_now(outbox: Outbox):
+    assert outbox.requeue()
+
+
+def test_order_is_delivered_with_products_and_origin_id(tmp_path):
+    async def scenario(fake, outbox, worker):
+        worker.start()
+        key = outbox.put(ORDER)
+        await wait_for(lambda: row(outbox, key)[0] == "done")
+
+        status, attempts, lead_id, _ = row(outbox, key)
+        assert fake.leads_by_origin(key) == [lead_id]
+        assert fake.leads[lead_id]["rows"][0]["PRODUCT_NAME"] == "Капучино"
+        # Лид и товары ушли одним batch-запросом
+        assert fake.calls == ["batch"]
+
+    asyncio.run(run(scenario)(tmp_path))
+
+
+def test_failed_delivery_is_retried_and_keeps_error(tmp_path):
+    async def scenario(fake, outbox, worker):
+        fake.fail_requests = 1
+        worker.start()
+        key = outbox.put(ORDER)
+        await wait_for(lambda: row(outbox, key)[1] == 1)
+
+        status, attempts, lead_id, error = row(outbox, key)
+        assert (status, lead_id) == ("pending", None)
+        assert error == "Bitrix24 недоступен"
+
+        retry_now(outbox)
+        await wait_for(lambda: row(outbox, key)[0] == "done")
+        assert len(fake.leads_by_origin(key)) == 1
+
+    asyncio.run(run(scenario)(tmp_path))
+
+
+def test_lost_response_does_not_create_duplicate_lead(tmp_path):
+    async def scenario(fake, outbox, worker):
+        # Лид создан, но ответ не дошёл: повтор должен найти его по ORIGIN_ID
+        fake.lose_responses = 1
+        worker.start()
+        key = outbox.put(ORDER)
+        await wait_for(lambda: row(outbox, key)[1] == 1)
+        assert len(fake.leads) == 1
+
+        retry_now(outbox)
+        await wait_for(lambda: row(outbox, key)[0] == "done")
+        assert fake.leads_by_origin(key) == [row(outbox, key)[2]]
+        assert len(fake.leads) == 1
+        assert fake.calls == ["batch", "crm.lead.list"]
+
+    asyncio.run(run(scenario)(tmp_path))
+
+
+def test_orders_stuck_in_sending_are_recovered_without_restart(tmp_path):
+    async def scenario(fake, outbox, worker):
+        # Процесс забрал заказ и упал до отправки; новый процесс стартовал раньше SENDING_LEASE
+        key = outbox.put(ORDER)
+        assert [claimed[0] for claimed in outbox.claim()] == [key]
+        worker.start()
+        await asyncio.sleep(0.1)
+        assert row(outbox, key)[0] == "sending"
+
+        # Аренда истекла: воркер возвращает заказ в очередь сам, без перезапуска
+        outbox.conn.execute("UPDATE outbox SET updated_at = ?", (time.time() - SENDING_LEASE - 1,))
+        await wait_for(lambda: row(outbox, key)[0] == "done")
+        assert len(fake.leads_by_origin(key)) == 1
+        # Упавший процесс мог успеть создать лид - сначала поиск по ORIGIN_ID
+        assert fake.calls == ["crm.lead.list", "batch"]
+
+    asyncio.run(run(scenario)(tmp_path))
+
+
+def test_order_is_never_dropped_and_admins_are_alerted(tmp_path):
+    async def scenario(fake, outbox, worker):
+        alerts = []
+
+        async def alert(key, data, attempts, error):
+            alerts.append((key, data["name"], attempts, error))
+
+        worker.add_alert(alert)
+        fake.fail_requests = OUTBOX_ALERT_ATTEMPTS + 1
+        worker.start()
+        key = outbox.put(ORDER)
+        for attempt in range(1, OUTBOX_ALERT_ATTEMPTS + 2):
+            await wait_for(lambda: row(outbox, key)[1] == attempt)
+            assert row(outbox, key)[0] == "pending"
+            retry_now(outbox)
+
+        # Уведомление одно - на OUTBOX_ALERT_ATTEMPTS-й попытке, заказ при этом остаётся в очереди
+        assert alerts == [(key, "Анна", OUTBOX_ALERT_ATTEMPTS, "Bitrix24 недоступен")]
+        assert outbox.stuck() == [(key, OUTBOX_ALERT_ATTEMPTS + 1, "Bitrix24 недоступен")]
+        await wait_for(lambda: row(outbox, key)[0] == "done")
+        assert len(fake.leads_by_origin(key)) == 1
+        assert outbox.stuck() == []
+
+    asyncio.run(run(scenario)(tmp_path))
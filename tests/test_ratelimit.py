@@ -0,0 +1,23 @@
+import asyncio
+
+from ratelimit import TokenBucket, limiters
+from telemetry import registry
+
+
+def test_limiter_queue_and_waits_are_exported(monkeypatch):
+    bucket = TokenBucket("bitrix", rate=20, capacity=1)
+    monkeypatch.setitem(limiters, "bitrix", bucket)
+
+    async def scenario():
+        await bucket.acquire()
+        waiting = [asyncio.create_task(bucket.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        queued = registry.render()
+        await asyncio.gather(*waiting)
+        return queued, registry.render()
+
+    queued, done = asyncio.run(scenario())
+    assert 'rate_limiter_queue_depth{limiter="bitrix"} 2' in queued
+    assert 'rate_limiter_queue_depth{limiter="bitrix"} 0' in done
+    assert 'rate_limiter_acquired{limiter="bitrix"} 3' in done
+    assert 'rate_limiter_waited{limiter="bitrix"} 2' in done
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+
+import screens
+from photo_cache import photo_cache
+
+URL = "https://example.com/latte.jpg"
+
+
+def bad_request(text: str) -> TelegramBadRequest:
+    return TelegramBadRequest(method=SendPhoto(chat_id=1, photo=URL), message=f"Bad Request: {text}")
+
+
+class FakeMessage:
+    """Сообщение-экран: edit_media сначала отвечает заданной ошибкой, потом успешно"""
+
+    def __init__(self, error: TelegramBadRequest):
+        self.chat = SimpleNamespace(id=1)
+        self.errors = [error]
+        self.media = []
+
+    async def edit_media(self, media, reply_markup=None):
+        self.media.append(media.media)
+        if self.errors:
+            raise self.errors.pop(0)
+        return True
+
+
+def test_edit_keeps_file_id_on_unrelated_error():
+    photo_cache.put(URL, "cached-file-id")
+    message = FakeMessage(bad_request("message to edit not found"))
+
+    assert asyncio.run(screens._edit(message, "Латте", None, URL)) is None
+    # Ошибка не связана с file_id: экран отправится заново, кэш остаётся
+    assert message.media == ["cached-file-id"]
+    assert photo_cache.get(URL) == "cached-file-id"
+
+
+def test_edit_forgets_rejected_file_id_and_retries_by_url():
+    photo_cache.put(URL, "stale-file-id")
+    message = FakeMessage(bad_request("wrong file identifier/HTTP URL specified"))
+
+    assert asyncio.run(screens._edit(message, "Латте", None, URL)) is True
+    assert message.media == ["stale-file-id", URL]
+    assert photo_cache.get(URL) is None
+
+
+def test_send_keeps_file_id_when_caption_is_rejected(monkeypatch):
+    photo_cache.put(URL, "cached-file-id")
+    sent = []
+
+    async def send_photo(chat_id, photo, caption=None, reply_markup=None):
+        sent.append(photo)
+        raise bad_request("message caption is too long")
+
+    monkeypatch.setattr(screens.bot, "send_photo", send_photo)
+    # Ошибка подписи доходит до обработчика, повторной загрузки по URL нет
+    with pytest.raises(TelegramBadRequest):
+        asyncio.run(screens._send(1, "Латте" * 300, None, URL))
+
+    assert sent == ["cached-file-id"]
+    assert photo_cache.get(URL) == "cached-file-id"
+
+
+class FakeTextMessage:
+    def __init__(self, text: str):
+        self.chat = SimpleNamespace(id=1)
+        self.text = text
+        self.calls = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.calls.append(("edit_text", text))
+        return True
+
+    async def edit_reply_markup(self, reply_markup=None):
+        self.calls.append(("edit_reply_markup", reply_markup))
+        return True
+
+
+def test_edit_sends_only_keyboard_when_text_is_the_same():
+    message = FakeTextMessage("Выберете товар")
+
+    asyncio.run(screens._edit(message, "Выберете товар", "page 2", None))
+    asyncio.run(screens._edit(message, "Выберете категорию", "categories", None))
+
+    assert message.calls == [("edit_reply_markup", "page 2"), ("edit_text", "Выберете категорию")]
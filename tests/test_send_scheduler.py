@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from ratelimit import PRIORITY_BACKGROUND, PRIORITY_ORDER
+from send_scheduler import SendScheduler, send_priority
+
+
+class FakeApi:
+    """make_request для SendScheduler: запоминает (chat_id, text, время) и по запросу отвечает 429"""
+
+    def __init__(self):
+        self.sent = []
+        self.retry_after = {}  # chat_id -> retry_after для следующего запроса в этот чат
+
+    async def __call__(self, bot, method):
+        retry_after = self.retry_after.pop(method.chat_id, None)
+        if retry_after is not None:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+        self.sent.append((method.chat_id, method.text, time.monotonic()))
+        return True
+
+
+async def send(scheduler: SendScheduler, api: FakeApi, chat_id: int, text: str = "", priority: int = None):
+    if priority is None:
+        return await scheduler(api, None, SendMessage(chat_id=chat_id, text=text))
+    with send_priority(priority):
+        return await scheduler(api, None, SendMessage(chat_id=chat_id, text=text))
+
+
+def test_order_messages_overtake_background_ones():
+    scheduler = SendScheduler(rate=20, chat_rate=100, chat_burst=100)
+    api = FakeApi()
+
+    async def scenario():
+        # Общий лимит исчерпан - дальше всё идёт через очередь по приоритету
+        await asyncio.gather(*(send(scheduler, api, chat_id) for chat_id in range(20)))
+        background = [asyncio.create_task(send(scheduler, api, 100 + n, "рассылка", PRIORITY_BACKGROUND))
+                      for n in range(3)]
+        await asyncio.sleep(0)
+        order = asyncio.create_task(send(scheduler, api, 200, "заказ", PRIORITY_ORDER))
+        await asyncio.gather(order, *background)
+
+    asyncio.run(scenario())
+    assert [text for _, text, _ in api.sent[20:]] == ["заказ", "рассылка", "рассылка", "рассылка"]
+
+
+def test_one_chat_is_paced_without_slowing_others():
+    scheduler = SendScheduler(rate=1000, chat_rate=10, chat_burst=1)
+    api = FakeApi()
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*(send(scheduler, api, 1) for _ in range(4)), send(scheduler, api, 2))
+        return started
+
+    started = asyncio.run(scenario())
+    busy = [at - started for chat_id, _, at in api.sent if chat_id == 1]
+    other = [at - started for chat_id, _, at in api.sent if chat_id == 2]
+    # Четыре сообщения в один чат при 10 в секунду и серии в 1: не быстрее 0.3 с
+    assert busy[-1] >= 0.29
+    assert all(b - a >= 0.09 for a, b in zip(busy, busy[1:]))
+    assert other[0] < 0.05
+
+
+def test_retry_after_puts_chat_and_bot_into_debt():
+    scheduler = SendScheduler(rate=1000, chat_rate=1000, chat_burst=1000)
+    api = FakeApi()
+    api.retry_after[1] = 1
+
+    async def scenario():
+        started = time.monotonic()
+        first = asyncio.create_task(send(scheduler, api, 1, "после 429"))
+        await asyncio.sleep(0.05)
+        # Лимит мог быть общим на бота - другой чат тоже ждёт retry_after, а не получает 429
+        await send(scheduler, api, 2, "другой чат")
+        await first
+        return started
+
+    started = asyncio.run(scenario())
+    delays = {text: at - started for _, text, at in api.sent}
+    assert delays["после 429"] >= 0.95
+    assert delays["другой чат"] >= 0.95
@@ -0,0 +1,77 @@
+import asyncio
+import gc
+import multiprocessing
+import tracemalloc
+
+from sessions import USER_LOCK_SLOTS, ProcessLocks, UserRegistry
+
+
+def simulate(registry: UserRegistry, users: range):
+    """Пользователь листает меню: лимит частоты, блокировка, последнее нажатие и экран"""
+    for user_id in users:
+        session = registry.get(user_id)
+        session.bucket.try_acquire()
+        session.lock  # создаёт asyncio.Lock, как первый апдейт пользователя
+        session.last_callback = ("return_categories", user_id, 0.0)
+        session.screen = (user_id, "0123456789abcdef")
+
+
+def test_memory_stays_bounded_over_many_users():
+    registry = UserRegistry(max_users=1000, idle_ttl=3600)
+    tracemalloc.start()
+    # Реестр заполнен и уже вытесняет: дальше память должна оставаться на этом уровне
+    simulate(registry, range(5000))
+    gc.collect()
+    baseline = tracemalloc.take_snapshot()
+    simulate(registry, range(5000, 55000))
+    gc.collect()
+    growth = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+    tracemalloc.stop()
+
+    assert len(registry) == 1000
+    assert registry.get_stats()["evicted"] == 54000
+    # 50 000 новых пользователей почти не добавили памяти (одна сессия - около 2 КБ)
+    assert growth < 64 * 1024
+
+
+def test_idle_users_expire():
+    registry = UserRegistry(max_users=100, idle_ttl=60)
+    simulate(registry, range(10))
+    # Первые пятеро давно ничего не нажимали
+    for user_id in range(5):
+        registry.peek(user_id).last_seen -= 120
+
+    assert registry.expire() == 5
+    assert len(registry) == 5
+    assert registry.peek(0) is None
+
+
+def _try_lock_elsewhere(path: str, user_id: int, result):
+    result.put(ProcessLocks(path)._try_lock(user_id % USER_LOCK_SLOTS))
+
+
+def _locked_in_other_process(path: str, user_id: int) -> bool:
+    # fork: POSIX-блокировки родителя дочернему процессу не наследуются
+    context = multiprocessing.get_context("fork")
+    result = context.Queue()
+    process = context.Process(target=_try_lock_elsewhere, args=(path, user_id, result))
+    process.start()
+    acquired = result.get(timeout=30)
+    process.join()
+    return not acquired
+
+
+def test_process_locks_serialize_user_across_processes(tmp_path):
+    path = str(tmp_path / "user_locks.lock")
+    locks = ProcessLocks(path)
+
+    async def scenario():
+        async with locks.hold(42):
+            # Другой пользователь с тем же слотом в этом процессе не ждёт и не снимает чужую блокировку
+            async with locks.hold(42 + USER_LOCK_SLOTS):
+                pass
+            assert _locked_in_other_process(path, 42)
+            assert not _locked_in_other_process(path, 43)
+        assert not _locked_in_other_process(path, 42)
+
+    asyncio.run(scenario())
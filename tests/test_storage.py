@@ -0,0 +1,58 @@
+import asyncio
+import multiprocessing
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+
+def test_update_data_does_not_lose_fields_of_other_processes(tmp_path):
+    """Два процесса (как два воркера вебхука) одновременно дописывают свои поля одного пользователя"""
+    path = str(tmp_path / "fsm.sqlite3")
+    steps = 200
+
+    def worker(field: str):
+        async def run():
+            storage = SQLiteStorage(path, flush_interval=0, cache_ttl=0)
+            for step in range(steps):
+                data = await storage.get_data(KEY)
+                await storage.update_data(KEY, {field: data.get(field, []) + [step]})
+            await storage.close()
+
+        asyncio.run(run())
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=worker, args=(field,)) for field in ("cart", "name")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    async def read():
+        storage = SQLiteStorage(path, flush_interval=0, cache_ttl=0)
+        try:
+            return await storage.get_data(KEY)
+        finally:
+            await storage.close()
+
+    # Потерянное обновление навсегда укорачивает список: следующий шаг дописывает к устаревшей версии
+    assert asyncio.run(read()) == {"cart": list(range(steps)), "name": list(range(steps))}
+
+
+def test_update_data_merges_with_unflushed_changes(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"), flush_interval=0.05)
+        await storage.set_data(KEY, {"cart": ["1|1"]})
+        merged = await storage.update_data(KEY, {"name": "Анна"})
+        await storage.close()
+
+        reopened = SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+        data = await reopened.get_data(KEY)
+        await reopened.close()
+        return merged, data
+
+    merged, data = asyncio.run(scenario())
+    assert merged == data == {"cart": ["1|1"], "name": "Анна"}
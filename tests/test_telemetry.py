@@ -0,0 +1,20 @@
+import asyncio
+
+from aiohttp.test_utils import make_mocked_request
+
+
+def test_webhook_app_serves_metrics():
+    from main import create_webhook_app
+
+    app = create_webhook_app()
+
+    async def scenario():
+        # Без запуска приложения: on_startup ходит в Google Sheets и Telegram
+        request = make_mocked_request("GET", "/metrics", app=app)
+        match = await app.router.resolve(request)
+        return await match.handler(request)
+
+    response = asyncio.run(scenario())
+
+    assert response.status == 200
+    assert "rate_limiter_queue_depth" in response.text
@@ -0,0 +1,41 @@
+import asyncio
+
+from tracing import span, trace_update
+
+
+async def sleep_in_span(kind: str, seconds: float):
+    with span(kind):
+        await asyncio.sleep(seconds)
+
+
+def test_nested_span_time_is_subtracted_from_outer():
+    async def scenario():
+        with trace_update("callback:p", 1) as trace:
+            with span("keyboard"):
+                await sleep_in_span("sheets", 0.05)
+                await asyncio.sleep(0.02)
+        return trace
+
+    trace = asyncio.run(scenario())
+    assert 0.045 < trace.spans["sheets"][0] < 0.07
+    assert 0.015 < trace.spans["keyboard"][0] < 0.04
+
+
+def test_spans_of_other_tasks_do_not_skew_the_trace():
+    async def scenario():
+        with trace_update("callback:p", 1) as trace:
+            with span("keyboard"):
+                await asyncio.gather(sleep_in_span("bot.deleteMessages", 0.05),
+                                     sleep_in_span("bot.deleteMessages", 0.15))
+                background = asyncio.create_task(sleep_in_span("bot.sendPhoto", 0.2))
+            with span("storage"):
+                await asyncio.sleep(0.01)
+        await background
+        return trace
+
+    trace = asyncio.run(scenario())
+    # gather и фоновая задача идут в своих задачах: их span не вычитаются друг из друга
+    # и не уменьшают время открытого span обработчика
+    assert set(trace.spans) == {"keyboard", "storage"}
+    assert 0.14 < trace.spans["keyboard"][0] < 0.2
+    assert trace.spans["storage"][1] == 1
@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Сколько последних трасс держим в памяти
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "200"))
+# Апдейт дольше этого порога считается медленным и сохраняется всегда
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+# Доля быстрых апдейтов, которые тоже попадают в буфер (для сравнения с медленными)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+
+
+class Trace:
+    """Время обработки одного апдейта с разбивкой по видам работы (span).
+
+    Span одного вида суммируются: хранится общее время и число вызовов, поэтому
+    трасса не растёт от количества обращений к хранилищу или API. Время вложенных span
+    вычитается из внешнего (клавиатура, которая ждёт меню, не съедает время Sheets).
+
+    В трассу пишутся только span задачи, которая её открыла. Задачи, запущенные из
+    обработчика (gather, фоновые обновления), наследуют контекст, но их время идёт
+    параллельно и в разбивку апдейта не попадает.
+    """
+
+    __slots__ = ("name", "user_id", "started_at", "started", "duration", "spans", "error", "task")
+
+    def __init__(self, name: str, user_id: Optional[int] = None):
+        self.name = name
+        self.user_id = user_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: Dict[str, List[float]] = {}  # вид -> [секунды, количество]
+        self.error: Optional[str] = None
+        self.task = _current_task()
+
+    def add(self, kind: str, elapsed: float):
+        span = self.spans.get(kind)
+        if span is None:
+            self.spans[kind] = [elapsed, 1]
+        else:
+            span[0] += elapsed
+            span[1] += 1
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = type(error).__name__
+
+    def format(self) -> str:
+        total_ms = (self.duration or 0) * 1000
+        accounted = sum(elapsed for elapsed, _ in self.spans.values())
+        parts = [f"{kind} {elapsed * 1000:.0f}мс×{count}"
+                 for kind, (elapsed, count) in sorted(self.spans.items(), key=lambda item: -item[1][0])]
+        parts.append(f"прочее {max(total_ms - accounted * 1000, 0):.0f}мс")
+        header = f"{time.strftime('%H:%M:%S', time.localtime(self.started_at))} {self.name} {total_ms:.0f}мс"
+        if self.error:
+            header += f" ❌{self.error}"
+        return header + "\n  " + ", ".join(parts)
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+# Открытые span текущей задачи: у каждого ячейка с суммой времени вложенных span
+_open: ContextVar[Tuple[List[float], ...]] = ContextVar("open_spans", default=())
+
+
+class TraceBuffer:
+    """Кольцевые буферы трасс: все медленные и выборка из быстрых"""
+
+    def __init__(self, size: int = TRACE_BUFFER, slow_ms: float = TRACE_SLOW_MS,
+                 sample_rate: float = TRACE_SAMPLE_RATE):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.slow: Deque[Trace] = deque(maxlen=size)
+        self.sampled: Deque[Trace] = deque(maxlen=size)
+        self.seen = 0
+
+    def record(self, trace: Trace):
+        self.seen += 1
+        if trace.duration * 1000 >= self.slow_ms:
+            self.slow.append(trace)
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            self.sampled.append(trace)
+
+    def recent(self, slow: bool = True, limit: int = 10) -> List[Trace]:
+        traces = self.slow if slow else self.sampled
+        return list(traces)[-limit:][::-1]
+
+
+@contextmanager
+def trace_update(name: str, user_id: Optional[int] = None):
+    """Открывает трассу апдейта; span внутри обработчика добавляются в неё"""
+    trace = Trace(name, user_id)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.finish(e)
+        raise
+    else:
+        trace.finish()
+    finally:
+        _current.reset(token)
+        traces.record(trace)
+
+
+@contextmanager
+def span(kind: str):
+    """Замер участка внутри текущей трассы; вне трассы ничего не делает"""
+    trace = _current.get()
+    if trace is None or trace.duration is not None or trace.task is not _current_task():
+        yield
+        return
+    started = time.perf_counter()
+    parents = _open.get()
+    nested = [0.0]
+    token = _open.set(parents + (nested,))
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _open.reset(token)
+        if parents:
+            parents[-1][0] += elapsed
+        trace.add(kind, elapsed - nested[0])
+
+
+def traced(kind: str):
+    """Декоратор для корутин: всё время вызова попадает в span указанного вида"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(kind):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+traces = TraceBuffer()